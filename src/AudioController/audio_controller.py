@@ -1,13 +1,24 @@
+import time
+from collections import OrderedDict
+from utils.db_service import DBService
 from utils.db_handler import DB
-from utils.errors import TrackNotFound, TrackAlreadyInQueue, YoutubeLink, UnsupportedLink
+from utils.errors import TrackNotFound, TrackAlreadyInQueue, YoutubeLink, UnsupportedLink, RequestDropped, \
+    NoCurrentTrack
 from AudioController.spotify_api import Spotify
-import time
+from AudioController.playback_timeline import PlaybackTimeline
+from AudioController.request_scheduler import PLAYBACK, POLL
 from utils.async_timer import Timer
 from utils import Log
+from utils.event_bus import EventBus, PLAYBACK_CHANGED
 
 
 class Context:
-    def __init__(self) -> None:
+    # fields shown by the discord now playing message, setting any of them to a new
+    # value publishes playback_changed. progress is left out as it changes every poll
+    watched = ('paused', 'track', 'artist', 'album_art', 'requester', 'playing_queue', 'live', 'active')
+
+    def __init__(self, bus: EventBus = None) -> None:
+        self.bus = bus
         self.playlist = None
         self.progress = None
         self.duration = None
@@ -22,6 +33,12 @@ class Context:
         self.active = True
         self.live = False
 
+    def __setattr__(self, name, value):
+        changed = name in self.watched and getattr(self, name, None) != value
+        super().__setattr__(name, value)
+        if changed and self.bus is not None:
+            self.bus.publish(PLAYBACK_CHANGED)
+
     def update(self, context: dict):
         if not self.playing_queue:
             self.playlist = context.get('playlist', None)
@@ -52,7 +69,16 @@ class Context:
 
 
 class AudioController:
-    def __init__(self, db: DB, spot: Spotify, ctx: Context, log: Log):
+    # ms before the end of a track the poller aims its last poll at. A poll later than the start of
+    # the window leaves the handoff timer armed by the polls before it as it is
+    handoff_window = (2100, 9700)
+    # ms before the end of a track play_next queues the next request, on top of the poll round trip
+    handoff_lead = 2000
+    # ms after the end of a track to check the request is the one playing
+    requester_delay = 3000
+    history_age = 3600
+
+    def __init__(self, db: DBService, spot: Spotify, ctx: Context, log: Log, history_size: int = 10):
         self.db = db
         self.spot = spot
         self.log = log
@@ -61,14 +87,21 @@ class AudioController:
         self.context = ctx
         self.playlist = None
         self.next_timer = None
+        # playback id of the track the handoff timer last fired for, it only fires once a track
+        self.handoff_id = None
         self.timer_started = None
-        self.context_time = None
+        self.timeline = PlaybackTimeline()
         self.req_timer = None
         self.queue_blocked = False
         self.next = None
-        self.history = []
-
-    def add_to_queue(self, request: str, user: str):
+        # {playback id: requester} of the last history_size requests sent to spotify, oldest first.
+        # Loaded from the play log so requests still get attributed after a restart
+        self.history = OrderedDict()
+        self.history_size = history_size
+        if self.db is not None:
+            self.load_history()
+
+    async def add_to_queue(self, request: str, user: str):
         # deals with youtube request with link in request
         if 'https://www.youtube.com' in request or 'https://youtu.be/' in request:
             raise YoutubeLink
@@ -85,7 +118,7 @@ class AudioController:
                     link = link.strip('\n')
             if link is None:
                 raise TrackNotFound
-            track, artist, link = self.spot.get_track_info(url=link)
+            details = await self.spot.get_track_details(url=link)
 
         elif 'spotify:track:' in request:
             words = request.split(' ')
@@ -97,7 +130,7 @@ class AudioController:
                     link = link.strip('\n')
             if link is None:
                 raise TrackNotFound
-            track, artist, link = self.spot.get_track_info(url=link)
+            details = await self.spot.get_track_details(url=link)
 
         # raise error if link isn't spotify or youtube
         elif 'http' in request:
@@ -105,54 +138,65 @@ class AudioController:
 
         # deals spotify request without link in request
         else:
-            link = self.spot.search_song(request)
-            if link is not None:
-                track, artist, link = self.spot.get_track_info(url=link)
-            else:
+            details = await self.spot.search_track(request)
+            if details is None:
                 raise TrackNotFound
 
         # returns track and artist if song was found,
         # and adds song to queue if the request is a spotify request
 
-        if self.db.is_track_in_queue(track, artist):
+        track, artist = details['track'], details['artist']
+        if await self.db.is_track_id_in_queue(details['id']):
             raise TrackAlreadyInQueue(track, artist)
 
-        self.db.add_to_queue(requester=user, track=track,
-                             link=link, artist=artist)
+        await self.db.add_to_queue(requester=user, track=track,
+                             link=details['link'], artist=artist, track_id=details['id'],
+                             uri=details['uri'], duration_ms=details['duration_ms'])
         return track, artist
 
-    async def check_context(self):
-        if self.context.paused:
-            return
+    # ms left of the current track going by the playback timeline, None when nothing is playing
+    def time_left(self):
         if self.context.track is None:
-            return
-        if self.context_time is None:
-            return
-        if self.context.duration is None:
-            return
-        if self.context.progress is None:
-            return
+            return None
+        return self.timeline.time_left()
 
-        time_since_context_update = time.time() * 1000 - self.context_time
-        time_left = self.context.duration - \
-            (self.context.progress + time_since_context_update)
+    async def check_context(self):
+        time_left = self.time_left()
+        if time_left is None:
+            # paused or stopped, the next poll that finds it playing arms the handoff again
+            if self.next_timer is not None:
+                self.next_timer.cancel()
+                self.next_timer = None
+            return
 
-        if time_left <= 9700 and time_left > 2100:
+        # every poll re-arms the handoff from the corrected timeline, so a late or dropped
+        # poll near the end of the track still leaves the timer from an earlier one armed.
+        # Once it is due or has fired for this track, leave it alone
+        if self.context.playback_id == self.handoff_id:
+            return
+        # fire early by a round trip so the track is in spotify's queue handoff_lead ms before the end
+        fire_in = time_left - self.handoff_lead - self.timeline.rtt
+        if time_left > self.handoff_window[0] and fire_in > 0:
             if self.next_timer is not None:
                 self.next_timer.cancel()
-            self.next_timer = Timer(
-                time_left - 2000, self.play_next, args=[False, time_left])
+            self.next_timer = Timer(fire_in, self.handoff, args=[self.context.playback_id])
         return
 
+    async def handoff(self, playback_id):
+        self.handoff_id = playback_id
+        await self.play_next(skipped=False)
+
     async def set_requester(self, track_info):
         track_name = track_info[2]
-        current_playback_id = self.spot.get_context().get('playback_id', None)
+        # the poller looks again requester_delay - settle ms before this, if it was late
+        # check_history picks the requester up from the history on its next poll
+        current_playback_id = self.context.playback_id
 
         if current_playback_id is None:
             self.log.info('No current track.')
             return
 
-        playback_id = track_info[5].split('/')[-1]
+        playback_id = self.queued_track_id(track_info)
         if playback_id != current_playback_id:
             self.log.info('Playback ID does not match. ' +
                           f'{playback_id} != {current_playback_id}')
@@ -176,39 +220,47 @@ class AudioController:
             return
         self.check_history()
 
-    async def play_next(self, skipped: bool = False, time_left: int = 0):
-        # check if any songs are in queue
-        queue = self.db.get_queue()
+    async def play_next(self, skipped: bool = False):
+        # skips from either bot run on the shared spotify loop with the playback poller,
+        # so the handoff timers and queue state are only ever touched from that thread
+        await self.spot.sp.call(self._play_next(skipped))
+
+    async def _play_next(self, skipped: bool):
+        # get next song in queue, if there is one
+        next_song = await self.db.get_queue_head()
 
         if self.req_timer is not None:
             self.req_timer.cancel()
 
-        if len(queue) > 0:
+        if next_song is not None:
             if self.queue_blocked:
                 return
-            # get next song in queue
-            next_song = queue[0]
             # remove song from queue
-            self.db.remove_from_queue_by_id(next_song[0])
+            await self.db.remove_from_queue_by_id(next_song[0])
             # play song
             # self.spot.sp.start_playback(uris=[next_song[5]])
             # update context
             self.log.info(f'Preparing to play {next_song[2]} ' +
                           f'requested by {next_song[4]}')
-            self.spot.sp.add_to_queue(next_song[5])
-            spot_queue = self.spot.get_queue()
-            playback_id = next_song[5].split('/')[-1]
+            await self.spot.add_to_queue(next_song[7] or next_song[5])
+            spot_queue = await self.spot.get_queue(priority=PLAYBACK)
+            playback_id = self.queued_track_id(next_song)
             if spot_queue[0] != playback_id:
                 self.log.info('Playback position is not correct. ' +
                               f'{str(spot_queue[0])} != {playback_id}')
                 self.queue_blocked = True
                 self.next = {'id': playback_id, 'requester': next_song[4]}
             else:
+                # a skip starts the request straight away, otherwise it starts when the current track ends
+                time_left = self.time_left()
+                if skipped or time_left is None:
+                    time_left = 0
                 self.req_timer = Timer(
-                    time_left + 3000, self.set_requester, args=[next_song])
+                    max(time_left, 0) + self.requester_delay, self.set_requester, args=[next_song])
             if skipped:
-                self.spot.sp.next_track()
+                await self.spot.next_track()
             self.add_to_history(playback_id, next_song[4])
+            await self.db.log_play(playback_id, next_song[2], next_song[3], next_song[5], next_song[4])
 
         elif self.context.playing_queue:
             # if no songs are in queue, play the playlist
@@ -217,35 +269,59 @@ class AudioController:
             await self.update_context()
 
         elif skipped:
-            self.spot.sp.next_track()
+            await self.spot.next_track()
             await self.update_context()
 
         return
 
+    # track id of a get_queue_head row, requests added without one only have the link
+    @staticmethod
+    def queued_track_id(track_info):
+        if track_info[6] is not None:
+            return track_info[6]
+        return track_info[5].split('/')[-1]
+
     def check_history(self):
-        for song in self.history:
-            if song['id'] == self.context.playback_id:
-                self.context.requester = song['requester']
-                self.context.playing_queue = True
-                self.history.remove(song)
-                self.log.info(f'Set requester to {song["requester"]} ' +
-                              f'for {self.context.track}')
-                return True
-        return False
+        requester = self.history.pop(self.context.playback_id, None)
+        if requester is None:
+            return False
+        self.context.requester = requester
+        self.context.playing_queue = True
+        self.log.info(f'Set requester to {requester} ' +
+                      f'for {self.context.track}')
+        return True
 
     def add_to_history(self, playback_id, requester):
-        self.history.append({'id': playback_id, 'requester': requester})
-        if len(self.history) > 10:
-            self.history.pop(0)
-
-    async def update_context(self):
+        self.history[playback_id] = requester
+        self.history.move_to_end(playback_id)
+        while len(self.history) > self.history_size:
+            self.history.popitem(last=False)
+
+    # requests older than history_age seconds have long since played, don't pick them back up
+    def load_history(self):
+        since = time.time() - self.history_age
+        for playback_id, requester in reversed(self.db.run_blocking(DB.get_recent_requesters, self.history_size, since)):
+            self.add_to_history(playback_id, requester)
+
+    async def update_context(self, priority: int = POLL):
         if not self.context.active:
             return
         if not self.context.live:
             return
-        self.context_time = time.time() * 1000
-        new_context = self.spot.get_context()
+        # taken once the scheduler lets the request out, a wait for the budget isn't part of the round trip
+        sent_at = []
+        try:
+            new_context = await self.spot.get_context(priority=priority,
+                                                      sent=lambda: sent_at.append(self.timeline.begin()))
+        except RequestDropped:
+            # the api budget is needed for requests, the next poll catches up
+            return
+        except NoCurrentTrack:
+            self.timeline.clear()
+            raise
         if new_context is not None:
+            self.timeline.update(sent_at[-1], new_context.get('playback_id', None), new_context.get('progress', None),
+                                 new_context.get('duration', None), new_context.get('paused', True))
             self.context.update(new_context)
             await self.check_context()
             if self.queue_blocked:
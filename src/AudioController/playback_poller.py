@@ -0,0 +1,86 @@
+import asyncio
+from utils import Log
+from utils.errors import NoCurrentTrack
+from AudioController.audio_controller import AudioController
+from AudioController.request_scheduler import USER, POLL
+
+
+# the one loop that asks spotify what is playing. It runs on the shared Spotify session's
+# loop and is the only caller of Context.update, the bots follow along through the
+# playback_changed events the context publishes instead of polling spotify themselves.
+# Polls are timed off what is left of the track: every max_interval seconds mid track to
+# notice skips from the spotify app, one landing handoff_target ms before the end inside
+# check_context's handoff window, and one just after the track ends to pick up the next.
+# While paused or nothing is playing the interval doubles up to max_paused_interval.
+class PlaybackPoller:
+    def __init__(self, ac: AudioController, log: Log, interval: float = 7.5, min_interval: float = 1,
+                 max_interval: float = 30, max_paused_interval: float = 60, handoff_target: int = 6000,
+                 settle: int = 1500):
+        self.ac = ac
+        self.log = log
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_paused_interval = max_paused_interval
+        self.handoff_target = handoff_target
+        self.settle = settle
+        self.paused_interval = interval
+        # polls the handoff depends on are not dropped by the request scheduler
+        self.priority = POLL
+        self.polls = 0
+        # nothing was playing on the last poll
+        self.idle = False
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = self.ac.spot.sp.spawn(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        while True:
+            await self.poll()
+            await asyncio.sleep(self.next_delay())
+
+    async def poll(self):
+        try:
+            self.polls += 1
+            await self.ac.update_context(priority=self.priority)
+            self.idle = False
+        except NoCurrentTrack:
+            self.idle = True
+        except Exception as er:
+            # keep polling, a failed poll is retried on the next tick
+            self.log.error(f'Playback poll failed: {er}')
+
+    # seconds until the next poll, also picks the priority it is sent with
+    def next_delay(self) -> float:
+        self.priority = POLL
+        context = self.ac.context
+        if not context.live or not context.active:
+            # update_context does not call spotify, just keep an eye on the flags
+            self.paused_interval = self.interval
+            return self.interval
+
+        time_left = None if self.idle else self.ac.time_left()
+        if time_left is None:
+            delay = self.paused_interval
+            self.paused_interval = min(self.paused_interval * 2, self.max_paused_interval)
+            return delay
+        self.paused_interval = self.interval
+
+        window_start, window_end = self.ac.handoff_window
+        if time_left > window_end:
+            delay = time_left - self.handoff_target
+            if delay <= self.max_interval * 1000:
+                self.priority = USER
+            delay = min(delay, self.max_interval * 1000)
+        else:
+            # the handoff is scheduled or missed, either way look again once the track changed
+            delay = max(time_left, 0) + self.settle
+            self.priority = USER
+        return max(delay / 1000, self.min_interval)
@@ -0,0 +1,67 @@
+import time
+
+
+# where the current track is, on the monotonic clock. Each poll re-anchors the position
+# to the progress spotify reported, taken to have been sampled halfway through the
+# request's round trip, and records how far the previous estimate had drifted from it.
+class PlaybackTimeline:
+    def __init__(self, clock: callable = time.monotonic, smoothing: float = 0.25):
+        self.clock = clock
+        self.smoothing = smoothing
+        self.playback_id = None
+        self.duration = None
+        self.paused = True
+        # progress in ms at anchor, a monotonic time in seconds
+        self.progress = None
+        self.anchor = None
+        # smoothed round trip of the playback polls in ms
+        self.rtt = 0.0
+        # reported minus predicted progress on the last poll of the same track, in ms
+        self.drift = 0.0
+        self.max_drift = 0.0
+
+    # take the time a request is sent, to pass to update with its response
+    def begin(self) -> float:
+        return self.clock()
+
+    def update(self, sent_at: float, playback_id: str, progress: int, duration: int, paused: bool):
+        received_at = self.clock()
+        rtt = (received_at - sent_at) * 1000
+        self.rtt = rtt if self.anchor is None else self.rtt + self.smoothing * (rtt - self.rtt)
+        sampled_at = sent_at + (received_at - sent_at) / 2
+        if playback_id == self.playback_id and self.anchor is not None and progress is not None:
+            self.drift = progress - self.position(sampled_at)
+            self.max_drift = max(self.max_drift, abs(self.drift))
+        self.playback_id = playback_id
+        self.duration = duration
+        self.paused = paused
+        self.progress = progress
+        self.anchor = sampled_at
+
+    def clear(self):
+        self.playback_id = None
+        self.progress = None
+        self.anchor = None
+
+    # estimated progress in ms, None when nothing is known to be playing
+    def position(self, now: float = None):
+        if self.anchor is None or self.progress is None:
+            return None
+        if self.paused:
+            return self.progress
+        if now is None:
+            now = self.clock()
+        return self.progress + (now - self.anchor) * 1000
+
+    def time_left(self, now: float = None):
+        position = self.position(now)
+        if position is None or self.duration is None or self.paused:
+            return None
+        return self.duration - position
+
+    # monotonic time the current track is expected to end
+    def ends_at(self):
+        time_left = self.time_left()
+        if time_left is None:
+            return None
+        return self.clock() + time_left / 1000
@@ -0,0 +1,105 @@
+import asyncio
+import heapq
+import itertools
+import time
+from utils.errors import RequestDropped
+
+# priority classes, lower goes first
+PLAYBACK = 0
+USER = 1
+POLL = 2
+priority_names = {PLAYBACK: 'playback', USER: 'user', POLL: 'poll'}
+
+
+# token bucket in front of every Spotify request. rate requests a second are let through
+# with bursts of up to burst, waiting requests are released in priority order, and a 429's
+# Retry-After holds everything back until it has passed. Background polls never wait:
+# they are dropped when fewer than poll_reserve + 1 tokens are left, anything is waiting
+# or a Retry-After is in force, so the budget goes to playback control and chat requests.
+# Only used from the SpotifyClient loop, so it needs no locking.
+class RequestScheduler:
+    def __init__(self, rate: float = 5.0, burst: int = 10, poll_reserve: int = 3, clock: callable = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.poll_reserve = poll_reserve
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock()
+        self.blocked_until = 0
+        # heap of (priority, order, enqueued at, future)
+        self.waiting = []
+        self.order = itertools.count()
+        self.wakeup = None
+        self.granted = {priority: 0 for priority in priority_names}
+        self.dropped = 0
+        self.retry_afters = 0
+        self.wait_total = {priority: 0.0 for priority in priority_names}
+        self.wait_max = {priority: 0.0 for priority in priority_names}
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return now
+
+    async def acquire(self, priority: int = USER):
+        now = self.refill()
+        blocked = now < self.blocked_until
+        if priority == POLL and (blocked or len(self.waiting) > 0 or self.tokens < self.poll_reserve + 1):
+            self.dropped += 1
+            raise RequestDropped
+        if not blocked and len(self.waiting) == 0 and self.tokens >= 1:
+            self.grant(priority, 0)
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiting, (priority, next(self.order), now, future))
+        self.release()
+        # a cancelled waiter stays in the heap and is skipped when it comes up
+        await future
+
+    def grant(self, priority: int, waited: float):
+        self.tokens -= 1
+        self.granted[priority] += 1
+        self.wait_total[priority] += waited
+        self.wait_max[priority] = max(self.wait_max[priority], waited)
+
+    # hands out tokens to waiters in priority order, then sleeps until the next one is due
+    def release(self):
+        if self.wakeup is not None:
+            self.wakeup.cancel()
+            self.wakeup = None
+        now = self.refill()
+        while len(self.waiting) > 0 and now >= self.blocked_until and self.tokens >= 1:
+            priority, _, enqueued, future = heapq.heappop(self.waiting)
+            if future.done():
+                continue
+            self.grant(priority, now - enqueued)
+            future.set_result(None)
+        while len(self.waiting) > 0 and self.waiting[0][3].done():
+            heapq.heappop(self.waiting)
+        if len(self.waiting) > 0:
+            delay = max(self.blocked_until - now, (1 - self.tokens) / self.rate, 0)
+            self.wakeup = asyncio.get_running_loop().call_later(delay, self.release)
+
+    # called with a 429's Retry-After, nothing is let through until it has passed
+    def retry_after(self, seconds: float):
+        self.retry_afters += 1
+        self.blocked_until = max(self.blocked_until, self.clock() + seconds)
+        self.tokens = min(self.tokens, 0)
+
+    def metrics(self) -> dict:
+        self.refill()
+        depth = {name: 0 for name in priority_names.values()}
+        for priority, _, _, future in self.waiting:
+            if not future.done():
+                depth[priority_names[priority]] += 1
+        return {'queue_depth': sum(depth.values()),
+                'queue_depth_by_priority': depth,
+                'tokens': self.tokens,
+                'blocked_for': max(self.blocked_until - self.clock(), 0),
+                'granted': {priority_names[p]: count for p, count in self.granted.items()},
+                'dropped_polls': self.dropped,
+                'retry_afters': self.retry_afters,
+                'wait_avg': {priority_names[p]: self.wait_total[p] / self.granted[p] if self.granted[p] else 0.0
+                             for p in priority_names},
+                'wait_max': {priority_names[p]: self.wait_max[p] for p in priority_names}}
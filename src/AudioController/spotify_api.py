@@ -1,16 +1,27 @@
 import spotipy
 from utils import SpotifyCreds
 from utils.errors import BadLink, NoCurrentTrack
+from AudioController.track_cache import TrackCache, LRUCache
+from AudioController.spotify_client import SpotifyClient
+from AudioController.request_scheduler import PLAYBACK, USER, POLL
 
 
 class Spotify:
-    def __init__(self, creds: SpotifyCreds):
+    # every method that talks to spotify is a coroutine, requests go through the pooled
+    # aiohttp session of SpotifyClient (self.sp) so they never block the bots' event loops
+    def __init__(self, creds: SpotifyCreds, cache: TrackCache = None, api_url: str = SpotifyClient.api_url,
+                 auth_manager=None):
+        self.api_url = api_url
+        self.cache = cache
+        # normalized free text request -> track details of its top search result
+        self.search_cache = LRUCache(capacity=512, ttl=3600)
         self.user = creds.username
         self.client_id = creds.client_id
         self.secret = creds.client_secret
-        self.token = self.get_token()
+        self.token = auth_manager if auth_manager is not None else self.get_token()
         self.sp = self.auth()
-        self.sp.search(q='test')
+        # fail at start up rather than on the first request if the credentials are bad
+        self.sp.run_blocking(self.sp.search(q='test'))
 
     def get_token(self):
         cache_path = f'./secret/.cache-{self.user}'
@@ -28,25 +39,60 @@ class Spotify:
                                     open_browser=False, scope=scopes)
 
     def auth(self):
-        return spotipy.Spotify(auth_manager=self.token)
+        return SpotifyClient(auth_manager=self.token, api_url=self.api_url)
 
-    def search_song(self, query):
-        try:
-            results = self.sp.search(query, limit=1, type='track')
-            if results is None:
-                return None
-            else:
-                return results['tracks']['items'][0]['external_urls']['spotify']
-        except IndexError:
+    def close(self):
+        self.sp.close()
+
+    async def metrics(self) -> dict:
+        return await self.sp.metrics()
+
+    async def search_song(self, query):
+        details = await self.search_track(query)
+        if details is None:
             return None
+        return details['link']
 
-    def get_track_info(self, url=None, info=None):
+    # track details of the top search result, built from the search payload itself so
+    # it takes one api call, and none when the same request was searched recently
+    async def search_track(self, query):
+        key = self.normalize_query(query)
+        details = self.search_cache.get(key)
+        if details is not None:
+            return details
+        # spotify gets the request as it was written, the normalized form is only the cache key
+        results = await self.sp.search(query.replace('!sr ', '').strip(), limit=1, type='track')
+        if results is None or len(results['tracks']['items']) == 0:
+            return None
+        details = await self.get_track_details(info=results['tracks']['items'][0])
+        self.search_cache.put(key, details)
+        return details
+
+    # requests that only differ in case, spacing or "by" share a search cache entry
+    @staticmethod
+    def normalize_query(query: str):
+        query = query.replace('!sr ', '').casefold()
+        query = ' '.join(query.split())
+        query = query.replace(' by ', ' ')
+        return query.strip('-').strip()
+
+    async def get_track_info(self, url=None, info=None):
+        details = await self.get_track_details(url=url, info=info)
+        return details['track'], details['artist'], details['link']
+
+    # everything the queue stores about a track, from the same single track lookup
+    async def get_track_details(self, url=None, info=None) -> dict:
 
         if url is None and info is None:
             raise BadLink
 
         if info is None:
-            info = self.sp.track(url)
+            track_id = self.get_track_id(url)
+            if self.cache is not None:
+                details = self.cache.get(track_id)
+                if details is not None:
+                    return details
+            info = await self.sp.track(url)
             if info is None:
                 raise BadLink
 
@@ -62,7 +108,20 @@ class Spotify:
         artists = artists.strip(']')
         artists = artists.strip("'")
         artists = artists.replace("'", '')
-        return track, artists, link
+        details = {'track': track,
+                   'artist': artists,
+                   'link': link,
+                   'id': info['id'],
+                   'uri': info['uri'],
+                   'duration_ms': info['duration_ms']}
+        if self.cache is not None:
+            self.cache.put(details)
+        return details
+
+    # the id out of an open.spotify.com link (with or without ?si=...) or a spotify:track: uri
+    @staticmethod
+    def get_track_id(url: str):
+        return SpotifyClient.get_id(url)
 
     @staticmethod
     def get_track_info_list(info_all: list):
@@ -83,25 +142,25 @@ class Spotify:
             track_info_all.append(track_info)
         return track_info_all
 
-    def get_current_track(self):
+    async def get_current_track(self):
         try:
-            info = self.sp.current_user_playing_track()['item']
+            info = (await self.sp.current_user_playing_track())['item']
             if info is None:
                 raise NoCurrentTrack
-            track, artist, _ = self.get_track_info(info=info)
+            track, artist, _ = await self.get_track_info(info=info)
             return track, artist
         except TypeError:
             raise NoCurrentTrack
 
-    def get_recent_plays(self):
-        recent = self.sp.current_user_recently_played(limit=10)
+    async def get_recent_plays(self):
+        recent = await self.sp.current_user_recently_played(limit=10)
         info_all = recent['items']
         info = []
         for track in self.get_track_info_list(info_all):
             info.append((track['track'], track['artist']))
         return info
 
-    def get_track_link(self, request):
+    async def get_track_link(self, request):
         if 'open.spotify' in request:
             words = request.split(' ')
             link = None
@@ -111,7 +170,7 @@ class Spotify:
                     link = link.strip('\r')
                     link = link.strip('\n')
             try:
-                track, artist, link = self.get_track_info(url=link)
+                track, artist, link = await self.get_track_info(url=link)
                 return track, artist, link
 
             except spotipy.SpotifyException:
@@ -121,24 +180,22 @@ class Spotify:
             return None, None, None
 
         else:
-            request = request.replace('!sr ', '')
-            request = request.replace(' by ', ' ')
-            request = request.strip('-')
-            song_link = self.search_song(request)
-            if song_link:
-                track, artist, link = self.get_track_info(url=song_link)
-                return track, artist, song_link
+            details = await self.search_track(request)
+            if details is not None:
+                return details['track'], details['artist'], details['link']
             else:
                 return None, None, None
 
-    def skip(self):
-        track, artist = self.get_current_track()
-        self.sp.next_track()
+    async def skip(self):
+        track, artist = await self.get_current_track()
+        await self.sp.next_track()
         return track, artist
 
-    def get_context(self) -> dict:
+    # polled in the background, so by default it is dropped (RequestDropped) when the
+    # request budget is tight rather than delaying requests and playback control
+    async def get_context(self, priority: int = POLL, sent: callable = None) -> dict:
         try:
-            info = self.sp.current_user_playing_track()
+            info = await self.sp.current_user_playing_track(priority=priority, sent=sent)
             if info is None:
                 raise NoCurrentTrack
             track = info['item']['name']
@@ -176,34 +233,40 @@ class Spotify:
             print(er)
             raise NoCurrentTrack
 
-    def next(self):
-        self.sp.next_track()
+    async def next(self):
+        await self.sp.next_track()
+
+    async def next_track(self):
+        await self.sp.next_track()
+
+    async def add_to_queue(self, uri: str):
+        await self.sp.add_to_queue(uri)
 
-    def play_pause(self):
-        playback = self.sp.current_playback()
+    async def play_pause(self):
+        playback = await self.sp.current_playback(priority=PLAYBACK)
         if playback['is_playing']:
-            self.sp.pause_playback()
+            await self.sp.pause_playback()
             return True
         else:
-            self.sp.start_playback()
+            await self.sp.start_playback()
             return False
 
-    def prev(self):
+    async def prev(self):
         try:
-            link = self.sp.current_user_playing_track(
-            )['item']['external_urls']['spotify']
-            self.sp.start_playback(uris=[link])
+            link = (await self.sp.current_user_playing_track(
+                priority=PLAYBACK))['item']['external_urls']['spotify']
+            await self.sp.start_playback(uris=[link])
         except Exception as er:
             print(er)
 
-    def play(self, link):
+    async def play(self, link):
         try:
-            self.sp.start_playback(uris=[link])
+            await self.sp.start_playback(uris=[link])
         except spotipy.exceptions.SpotifyException:
             pass
 
-    def get_current_playlist(self):
-        info = self.sp.current_playback()
+    async def get_current_playlist(self):
+        info = await self.sp.current_playback()
         if info is None:
             return None
         try:
@@ -211,8 +274,8 @@ class Spotify:
         except (KeyError, TypeError):
             return None
 
-    def get_queue(self):
-        info = self.sp.queue()
+    async def get_queue(self, priority: int = USER):
+        info = await self.sp.queue(priority=priority)
         queue = info['queue']
         queue_info = []
         for track in queue:
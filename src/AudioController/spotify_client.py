@@ -0,0 +1,182 @@
+import asyncio
+import threading
+import time
+import aiohttp
+from spotipy import SpotifyException
+from AudioController.request_scheduler import RequestScheduler, PLAYBACK, USER, POLL
+
+
+# async Spotify Web API client with the same method names as the spotipy calls the bot
+# used. Requests run on a dedicated event loop thread that owns one pooled keep-alive
+# aiohttp session, so the twitch and discord loops both await them without ever
+# blocking on the network and without each needing their own session.
+# Tokens still come from spotipy's SpotifyOAuth (auth_manager), refreshed off the loop.
+# Every request first takes a token from the RequestScheduler, so playback control goes
+# ahead of chat requests, which go ahead of background polls, and a 429 backs off for
+# its Retry-After instead of hammering the api.
+class SpotifyClient:
+    api_url = 'https://api.spotify.com/v1'
+
+    def __init__(self, auth_manager, api_url: str = api_url, pool_size: int = 10, timeout: float = 10,
+                 scheduler: RequestScheduler = None, max_retries: int = 2):
+        self.auth_manager = auth_manager
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler()
+        self.max_retries = max_retries
+        self.base_url = api_url.rstrip('/')
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._token = None
+        self._token_expires = 0
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='spotify', daemon=True)
+        self._thread.start()
+        self._session: aiohttp.ClientSession = self.run_blocking(self._open())
+
+    async def _open(self):
+        connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+        return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    def run_blocking(self, coro):
+        # for start up code that runs before the bots' event loops exist
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def spawn(self, coro):
+        # runs coro as a background task on the client loop, returns a concurrent future
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    async def call(self, coro):
+        # awaits coro on the client loop from whichever loop the caller is on
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            return await coro
+        return await asyncio.wrap_future(self.spawn(coro))
+
+    def close(self):
+        if self._loop.is_closed():
+            return
+        self.run_blocking(self._shutdown())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    async def _shutdown(self):
+        await self._session.close()
+        # the poller and any pending handoff timers live on this loop, let them finish cancelling
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    # sent is called on the client loop just before the request goes out, after any wait for
+    # the scheduler, for callers that time the round trip
+    async def request(self, method: str, path: str, params: dict = None, payload: dict = None,
+                      priority: int = USER, sent: callable = None):
+        return await self.call(self._request(method, path, params, payload, priority, sent=sent))
+
+    # queue depth, waits and drops of the request scheduler, read on the client loop
+    async def metrics(self) -> dict:
+        return await self.call(self._metrics())
+
+    async def _metrics(self):
+        return self.scheduler.metrics()
+
+    async def _get_token(self):
+        if self._token is None or time.time() >= self._token_expires:
+            # spotipy reads its cache file and may refresh over http, keep that off the loop
+            self._token, expires_at = await self._loop.run_in_executor(None, self._fetch_token)
+            self._token_expires = expires_at - 60
+        return self._token
+
+    def _fetch_token(self):
+        token = self.auth_manager.get_access_token(as_dict=False)
+        info = self.auth_manager.cache_handler.get_cached_token() or {}
+        return token, info.get('expires_at', time.time() + 120)
+
+    async def _request(self, method: str, path: str, params: dict, payload: dict, priority: int = USER,
+                       retry: bool = True, attempt: int = 0, sent: callable = None):
+        url = self.base_url + path
+        if params is not None:
+            params = {key: value for key, value in params.items() if value is not None}
+        # raises RequestDropped for a poll when the budget is tight
+        await self.scheduler.acquire(priority)
+        headers = {'Authorization': f'Bearer {await self._get_token()}'}
+        if sent is not None:
+            sent()
+        async with self._session.request(method, url, params=params, json=payload, headers=headers) as resp:
+            if resp.status == 429:
+                self.scheduler.retry_after(self.retry_after_seconds(resp.headers))
+            # retries are sent once this connection is back in the pool
+            refresh = resp.status == 401 and retry
+            # a poll just runs again on its next tick, anything else waits out the Retry-After
+            backoff = resp.status == 429 and priority != POLL and attempt < self.max_retries
+            if not refresh and not backoff:
+                if resp.status >= 400:
+                    text = await resp.text()
+                    raise SpotifyException(resp.status, -1, f'{url}:\n {text}', headers=dict(resp.headers))
+                if resp.status == 204 or resp.content_length == 0:
+                    return None
+                try:
+                    return await resp.json(content_type=None)
+                except ValueError:
+                    return None
+        if refresh:
+            # the token was revoked or expired early, get a new one once
+            self._token = None
+            return await self._request(method, path, params, payload, priority, retry=False, attempt=attempt,
+                                       sent=sent)
+        return await self._request(method, path, params, payload, priority, retry, attempt + 1, sent=sent)
+
+    @staticmethod
+    def retry_after_seconds(headers) -> float:
+        try:
+            return max(float(headers.get('Retry-After', 1)), 0)
+        except ValueError:
+            return 1
+
+    # accepts an id, spotify:type:id uri or open.spotify.com link, like spotipy does
+    @staticmethod
+    def get_id(value: str):
+        return value.split('?')[0].rstrip('/').split('/')[-1].split(':')[-1]
+
+    async def track(self, track: str, priority: int = USER):
+        return await self.request('GET', f'/tracks/{self.get_id(track)}', priority=priority)
+
+    async def search(self, q: str, limit: int = 10, type: str = 'track', priority: int = USER):
+        return await self.request('GET', '/search', params={'q': q, 'limit': limit, 'type': type},
+                                  priority=priority)
+
+    async def playlist_items(self, playlist: str, limit: int = 100, priority: int = USER):
+        return await self.request('GET', f'/playlists/{self.get_id(playlist)}/tracks', params={'limit': limit},
+                                  priority=priority)
+
+    # background polls pass POLL so they can be dropped, everything else defaults to USER
+    async def current_user_playing_track(self, priority: int = USER, sent: callable = None):
+        return await self.request('GET', '/me/player/currently-playing', priority=priority, sent=sent)
+
+    async def current_playback(self, priority: int = USER):
+        return await self.request('GET', '/me/player', priority=priority)
+
+    async def current_user_recently_played(self, limit: int = 50, priority: int = USER):
+        return await self.request('GET', '/me/player/recently-played', params={'limit': limit}, priority=priority)
+
+    async def queue(self, priority: int = USER):
+        return await self.request('GET', '/me/player/queue', priority=priority)
+
+    async def add_to_queue(self, uri: str):
+        return await self.request('POST', '/me/player/queue', params={'uri': f'spotify:track:{self.get_id(uri)}'},
+                                  priority=PLAYBACK)
+
+    async def next_track(self):
+        return await self.request('POST', '/me/player/next', priority=PLAYBACK)
+
+    async def start_playback(self, uris: list = None):
+        payload = None
+        if uris is not None:
+            payload = {'uris': [f'spotify:track:{self.get_id(uri)}' for uri in uris]}
+        return await self.request('PUT', '/me/player/play', payload=payload, priority=PLAYBACK)
+
+    async def pause_playback(self):
+        return await self.request('PUT', '/me/player/pause', priority=PLAYBACK)
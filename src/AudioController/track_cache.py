@@ -0,0 +1,76 @@
+import time
+import threading
+from collections import OrderedDict
+from utils.db_handler import DB
+from utils.db_service import DBService
+
+
+# bounded LRU cache whose entries expire ttl seconds after they were stored
+class LRUCache:
+    def __init__(self, capacity: int = 1024, ttl: float = 86400, clock: callable = time.time):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.clock = clock
+        # {key: (stored at, value)}, least recently used first
+        self.entries = OrderedDict()
+        # the twitch and discord bots look things up from their own threads
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.clock() - entry[0] >= self.ttl:
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, stored_at: float = None):
+        if stored_at is None:
+            stored_at = self.clock()
+        with self.lock:
+            self.entries[key] = (stored_at, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return stored_at
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'size': len(self.entries),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'expirations': self.expirations,
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
+
+
+# Spotify.get_track_details dicts keyed by spotify track id. With a db the cache is warmed
+# from the tracks table at start up and new entries are written back on the db worker,
+# so it survives restarts without a lookup ever waiting on sqlite.
+class TrackCache(LRUCache):
+    def __init__(self, capacity: int = 1024, ttl: float = 86400, db: DBService = None, clock: callable = time.time):
+        super().__init__(capacity, ttl, clock)
+        self.db = db
+        if self.db is not None:
+            self.load()
+
+    def load(self):
+        for details, fetched_at in self.db.run_blocking(DB.get_cached_tracks, self.capacity, self.clock() - self.ttl):
+            super().put(details['id'], details, fetched_at)
+
+    def put(self, details: dict):
+        fetched_at = super().put(details['id'], details)
+        if self.db is not None:
+            self.db.submit_write(DB.cache_track, details, fetched_at)
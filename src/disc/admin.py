@@ -50,7 +50,7 @@ class AdminCog(commands.Cog):
     @discord.app_commands.command(name='reset_leaderboard', description='Reset the leaderboard')
     @check()
     async def reset_leaderboard(self, interaction: discord.Interaction):
-        self.db.reset_all_user_stats()
+        await self.db.reset_all_user_stats()
         resp = "The leaderboard has been reset!"
         await interaction.response.send_message(content=resp, ephemeral=True)
         self.log.resp(resp)
@@ -3,7 +3,7 @@ import time
 from AudioController.spotify_api import Spotify
 from discord.ext import tasks, commands
 from AudioController.audio_controller import AudioController
-from utils import Log, DB, Settings, DiscordCreds
+from utils import Log, DBService, EventBus, Settings, DiscordCreds
 from disc.public import PublicCog
 from disc.live_update import AutoUpdate
 from disc.mod import ModCog
@@ -12,13 +12,14 @@ from disc.admin import AdminCog
 
 class DiscordBot(commands.Bot):
     def __init__(self, creds: DiscordCreds, twitch_channel, log: Log,
-                 spot: Spotify, db: DB, ac: AudioController, settings: Settings):
+                 spot: Spotify, db: DBService, ac: AudioController, settings: Settings, bus: EventBus):
         super().__init__('/', intents=discord.Intents.default())
         self.ac = ac
         self.log = log
         self.settings = settings
         self.spot = spot
         self.db = db
+        self.bus = bus
         leaderboard_channel_id = creds.leaderboard_channel_id
         queue_channel_id = creds.queue_channel_id
         if leaderboard_channel_id is None or queue_channel_id is None:
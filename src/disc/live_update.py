@@ -1,5 +1,6 @@
 from table2ascii import table2ascii as t2a, PresetStyle
 from discord.ext import tasks, commands
+from utils.event_bus import QUEUE_CHANGED, PLAYBACK_CHANGED, LEADERBOARD_CHANGED
 import discord
 
 
@@ -11,6 +12,10 @@ class AutoUpdate(commands.Cog):
         self.ac = bot.ac
         self.spot = bot.spot
         self.db = bot.db
+        self.bus = bot.bus
+        self.queue_events = None
+        self.context_events = None
+        self.leaderboard_events = None
         self.leaderboard_channel = bot.get_channel(bot.leaderboard_channel_id)
         self.queue_channel = bot.get_channel(bot.queue_channel_id)
         self.context = None
@@ -21,12 +26,19 @@ class AutoUpdate(commands.Cog):
         self.leaderboard = discord.Embed(
             title=f'{self.twitch_channel} Song Request Leaderboard')
         self.queue = []
+        self.queue_etas = {}
+        self.queue_version = None
     
     async def cog_load(self) -> None:
         self.log.info('AutoUpdate Cog Loaded')
         await self.get_message_obj_queue()
         await self.get_message_obj_leaderboard()
-        
+
+        # the update loops sleep until the db or the playback context publish a change
+        self.queue_events = self.bus.subscribe(QUEUE_CHANGED)
+        self.context_events = self.bus.subscribe(PLAYBACK_CHANGED)
+        self.leaderboard_events = self.bus.subscribe(LEADERBOARD_CHANGED)
+
         self.get_queue.start()
         self.get_leaderboard.start()
         self.get_context.start()
@@ -38,10 +50,14 @@ class AutoUpdate(commands.Cog):
         self.get_leaderboard.cancel()
         self.get_context.cancel()
 
+        for events in (self.queue_events, self.context_events, self.leaderboard_events):
+            if events is not None:
+                events.close()
+
         await self.cleanup_playing()
 
-    def embed_leaderboard(self):
-        sorted_position, sorted_users, sorted_rates = self.db.get_leaderboard()
+    async def embed_leaderboard(self):
+        sorted_position, sorted_users, sorted_rates = await self.db.get_leaderboard()
         embed = discord.Embed(
                 title=f'{self.twitch_channel} Song Request Leaderboard')
         if len(sorted_users) > 0:
@@ -61,9 +77,18 @@ class AutoUpdate(commands.Cog):
             return f"{self.twitch_channel} Song Request Queue: \n" \
                    f"```\nQueue is Currently Empty!\n```"
 
+        # queue etas count from the head starting, so add what is left of the current track
+        # from the playback timeline, ctx.progress is only as fresh as the last poll
+        ctx = self.ac.context
+        time_left = self.ac.time_left()
+        if time_left is None and ctx.duration is not None and ctx.progress is not None:
+            # paused, the position isn't moving
+            time_left = ctx.duration - ctx.progress
+        time_left = int(max(time_left or 0, 0))
+
         i = 1
         body = []
-        header = ['Position', 'Track', 'Artist/s', 'Requester', 'id']
+        header = ['Position', 'Track', 'Artist/s', 'Requester', 'Starts in', 'id']
         for req in q[:5]:
             req_id = req[0]
             pos = req[1]
@@ -71,7 +96,8 @@ class AutoUpdate(commands.Cog):
             artist = req[3]
             user = req[4]
             position = str(pos)
-            body.append([position, track, artist, user, req_id])
+            starts_in = (self.queue_etas.get(req_id, 0) + time_left) // 1000
+            body.append([position, track, artist, user, f'~{starts_in // 60}:{starts_in % 60:02d}', req_id])
             i += 1
 
         queue_content = f"{self.twitch_channel} Song Request Queue: \n" \
@@ -117,20 +143,25 @@ class AutoUpdate(commands.Cog):
             await self.leaderboard_channel.purge()
             self.leaderboard_message_obj = await self.leaderboard_channel.send(f'Empty')
     
-    @tasks.loop(seconds=2)
+    @tasks.loop()
     async def get_queue(self):
+        await self.queue_events.wait()
         if self.queue_message_obj is None:
             return None
 
-        new_queue = self.db.get_queue()
+        queue_version = self.db.queue_version
+        if queue_version == self.queue_version:
+            return None
 
-        if new_queue != self.queue:
-            self.queue = new_queue
-            self.log.info('updating queue')
-            await self.update_playing()
+        self.queue = await self.db.get_queue()
+        self.queue_etas = dict(await self.db.get_queue_etas())
+        self.queue_version = queue_version
+        self.log.info('updating queue')
+        await self.update_playing()
 
-    @tasks.loop(seconds=2)
+    @tasks.loop()
     async def get_context(self):
+        await self.context_events.wait()
         if self.queue_message_obj is None:
             return None
         ctx_loaded = self.ac.context.get_context()
@@ -148,12 +179,13 @@ class AutoUpdate(commands.Cog):
             self.log.info('updating context')
             await self.update_playing()
 
-    @tasks.loop(seconds=2)
+    @tasks.loop()
     async def get_leaderboard(self):
+        await self.leaderboard_events.wait()
         if self.leaderboard_message_obj is None:
             return None
 
-        new_leaderboard = self.db.get_leaderboard()
+        new_leaderboard = await self.db.get_leaderboard()
         if new_leaderboard != self.leaderboard:
             self.leaderboard = new_leaderboard
             self.log.info('updating leaderboard')
@@ -205,7 +237,7 @@ class AutoUpdate(commands.Cog):
         if self.leaderboard_message_obj is None:
             return None
         try:
-            leaderboard = self.embed_leaderboard()
+            leaderboard = await self.embed_leaderboard()
             await self.bot.wait_until_ready()
             try:
                 await self.leaderboard_message_obj.edit(content='', embed=leaderboard)
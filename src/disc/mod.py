@@ -62,7 +62,7 @@ class ModCog(commands.Cog):
     @discord.app_commands.command(name='clear-queue', description='Clear request queue display (admin only)')
     @check()
     async def clear_queue(self, interaction: discord.Interaction):
-        self.db.clear_queue()
+        await self.db.clear_queue()
         resp = 'Queue has been cleared!'
         await interaction.response.send_message(content=resp, ephemeral=True)
         self.log.resp(resp)
@@ -71,7 +71,7 @@ class ModCog(commands.Cog):
     @discord.app_commands.describe(request_id='end the request id of the track')
     @check()
     async def bump(self, interaction: discord.Interaction, request_id: int):
-        if self.db.move_request_pos(request_id):
+        if await self.db.move_request_pos(request_id):
             resp = 'Track moved to top of the queue'
         else:
             resp = 'Could not find track in queue'
@@ -82,7 +82,7 @@ class ModCog(commands.Cog):
     @discord.app_commands.describe(req_id='enter request id')
     @check()
     async def remove_request(self, interaction: discord.Interaction, req_id: int):
-        track, artist = self.db.remove_from_queue_by_id(req_id)
+        track, artist = await self.db.remove_from_queue_by_id(req_id)
         if track is not None:
             await interaction.response.send_message(content=f'removed "{track} by {artist}" from queue', ephemeral=True)
         else:
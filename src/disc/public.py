@@ -4,13 +4,13 @@ import discord
 from discord.ext import commands
 from table2ascii import table2ascii as t2a, PresetStyle
 from utils.errors import UserNotFound, NotActive, TrackNotFound
-from utils import Log, Settings, DB
+from utils import Log, Settings, DBService
 
 
 class PublicCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.db: DB = bot.db
+        self.db: DBService = bot.db
         self.log: Log = bot.log
         self.settings: Settings = bot.settings
         self.ac = bot.ac
@@ -48,12 +48,19 @@ class PublicCog(commands.Cog):
         return wrapper
 
     @discord.app_commands.command(name='stats', description='Gets song request stats of given twitch user.')
-    @discord.app_commands.describe(twitch_username='Enter twitch username (not case sensitive)')
+    @discord.app_commands.describe(twitch_username='Enter twitch username (not case sensitive)',
+                                   seasons_ago='Leaderboard resets ago, leave empty for the current season')
     @check()
-    async def get_stats(self, interaction: discord.Interaction, twitch_username: str):
+    async def get_stats(self, interaction: discord.Interaction, twitch_username: str, seasons_ago: int = 0):
         twitch_username = twitch_username.lower()
 
-        stats = self.db.get_user_stats(twitch_username)
+        epoch = await self.db.get_epoch(seasons_ago)
+        if epoch is None:
+            resp = f'There is no season from {seasons_ago} resets ago.'
+            self.log.resp(resp)
+            await interaction.response.send_message(content=resp, ephemeral=True)
+            return
+        stats = await self.db.get_user_stats(twitch_username, epoch)
         if stats is None:
             raise UserNotFound(twitch_username)
 
@@ -80,7 +87,7 @@ class PublicCog(commands.Cog):
         if not self.ac.context.live or not self.settings.active:
             raise NotActive
 
-        track, artist = self.ac.add_to_queue(request, interaction.user)
+        track, artist = await self.ac.add_to_queue(request, str(interaction.user))
 
         if not track:
             raise TrackNotFound
@@ -94,11 +101,11 @@ class PublicCog(commands.Cog):
     @discord.app_commands.command(name='ping', description='pong')
     @check()
     async def pong(self, interaction: discord.Interaction):
-        embed = self.get_pong_embed(interaction)
+        embed = await self.get_pong_embed(interaction)
         await interaction.response.send_message(embed=embed, ephemeral=True)
         self.log.resp('pong')
 
-    def get_pong_embed(self, ctx: discord.Integration):
+    async def get_pong_embed(self, ctx: discord.Integration):
         embed = discord.Embed(title='🏓 Pong!')
 
         latency = round(self.bot.latency, 2)
@@ -113,6 +120,9 @@ class PublicCog(commands.Cog):
 
         status = self.get_status()
         embed.add_field(name='Status', value=status, inline=False)
+
+        spotify = await self.get_spotify_metrics()
+        embed.add_field(name='Spotify API', value=spotify, inline=False)
         return embed
 
     def get_running_cogs(self) -> str:
@@ -146,6 +156,14 @@ class PublicCog(commands.Cog):
                 routines_str_list.append(f'{routine}: 🔴 Not Running')
         return '\n'.join(routines_str_list)
 
+    async def get_spotify_metrics(self) -> str:
+        metrics = await self.ac.spot.metrics()
+        waits = ', '.join(f'{name} {wait:.2f}s' for name, wait in metrics['wait_avg'].items())
+        return '\n'.join([f'Waiting: {metrics["queue_depth"]}',
+                          f'Average wait: {waits}',
+                          f'Dropped polls: {metrics["dropped_polls"]}',
+                          f'Rate limited: {metrics["retry_afters"]}'])
+
     def get_status(self) -> str:
         status_live = self.ac.context.live
         status_active = self.settings.active
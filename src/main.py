@@ -1,12 +1,14 @@
 import os
 import threading as th
 from AudioController.spotify_api import Spotify
+from AudioController.track_cache import TrackCache
 from twitch.twitch_bot import TwitchBot
 from disc.discord_bot import DiscordBot
 from os.path import exists
 from utils.errors import *
 from AudioController.audio_controller import AudioController, Context
-from utils import Log, DB, Settings, Creds
+from AudioController.playback_poller import PlaybackPoller
+from utils import Log, DB, DBService, EventBus, Settings, Creds
 
 
 def init_data_dir():
@@ -14,32 +16,22 @@ def init_data_dir():
         os.mkdir('./data')
 
 
-def start_twitch_bot(db_log: Log, creds: Creds, settings: Settings, ctx: Context, ac_log: Log):
+def start_twitch_bot(db: DBService, creds: Creds, settings: Settings, ac: AudioController):
     twitch_log = Log('Twitch', settings.log)
 
-    db = DB(db_log)
-    s_bot = Spotify(creds.spotify)
-
     twitch_channel = creds.twitch.channel.lower()
 
-    db.check_user_exists(twitch_channel)
-    db.admin_user(twitch_channel)
-
-    ac = AudioController(db, s_bot, ctx, ac_log)
+    db.run_blocking(DB.check_user_exists, twitch_channel)
+    db.run_blocking(DB.admin_user, twitch_channel)
 
     t_bot = TwitchBot(creds.twitch, twitch_log, db, ac, settings)
     t_bot.run()
 
 
-def start_discord_bot(db_log: Log, creds: Creds, settings: Settings, ctx: Context, ac_log: Log):
+def start_discord_bot(db: DBService, creds: Creds, settings: Settings, ac: AudioController, bus: EventBus):
     discord_log = Log('Discord', settings.log)
 
-    db = DB(db_log)
-    s_bot = Spotify(creds.spotify)
-
-    ac = AudioController(db, s_bot, ctx, ac_log)
-
-    d_bot = DiscordBot(creds.discord, creds.twitch.channel, discord_log, s_bot, db, ac, settings)
+    d_bot = DiscordBot(creds.discord, creds.twitch.channel, discord_log, ac.spot, db, ac, settings, bus)
     d_bot.run(creds.discord.token)
 
 
@@ -50,17 +42,32 @@ def main():
 
     creds = Creds(main_log)
     settings = Settings()
-    ctx = Context()
+    # carries queue/playback/leaderboard change events between the bot threads
+    bus = EventBus()
+    ctx = Context(bus)
 
-    # Database log is used for both twitch and discord bots DB instances
-    # Database not initialized in main function as it cannot be shared between threads
+    # one database service is shared by the twitch and discord bots,
+    # it owns the sqlite connection on its own worker thread
     db_log = Log('Database', settings.log)
+    db = DBService(db_log, bus=bus)
     ac_log = Log('AudioController', settings.log)
-
-    if creds.discord.creds_valid() and settings.discord_bot:
-        th.Thread(target=start_discord_bot, args=(
-            db_log, creds, settings, ctx, ac_log), daemon=True).start()
-    start_twitch_bot(db_log, creds, settings, ctx, ac_log)
+    # track metadata looked up by either bot is cached for both, and kept in the db across restarts
+    track_cache = TrackCache(db=db)
+    # one spotify session, audio controller and playback poller serve both bots
+    spotify = Spotify(creds.spotify, track_cache)
+    ac = AudioController(db, spotify, ctx, ac_log)
+    poller = PlaybackPoller(ac, ac_log)
+
+    try:
+        poller.start()
+        if creds.discord.creds_valid() and settings.discord_bot:
+            th.Thread(target=start_discord_bot, args=(
+                db, creds, settings, ac, bus), daemon=True).start()
+        start_twitch_bot(db, creds, settings, ac)
+    finally:
+        poller.stop()
+        spotify.close()
+        db.close()
 
 
 if __name__ == "__main__":
@@ -1,22 +1,22 @@
 import random
 import string
-import time
+import asyncio
 from twitchio.ext import commands
 from utils.errors import *
-from utils import target_finder, Settings, DB, Log
+from utils import target_finder, Settings, DBService, Log
 
 
 class AdminCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.log: Log = bot.log
-        self.db: DB = bot.db
+        self.db: DBService = bot.db
         self.ac = bot.ac
         self.settings: Settings = bot.settings
         self.channel_name = bot.channel_name
     
     async def cog_check(self, ctx: commands.Context) -> bool:
-        if not self.db.is_user_admin(ctx.author.name.lower()):
+        if not await self.db.is_user_admin(ctx.author.name.lower()):
             raise NotAuthorized('admin')
         return True
 
@@ -67,11 +67,11 @@ class AdminCog(commands.Cog):
                 num = 1
 
         letter = random.choice(string.ascii_lowercase)
-        results = self.ac.spot.sp.search(q=letter, type='playlist', limit=50)
+        results = await self.ac.spot.sp.search(q=letter, type='playlist', limit=50)
         playlist = random.choice(results['playlists']['items'])
 
         # get random song from playlist
-        results = self.ac.spot.sp.playlist_items(playlist['uri'], limit=100)
+        results = await self.ac.spot.sp.playlist_items(playlist['uri'], limit=100)
 
         resp = f'Adding {num} random tracks to the queue...!'
         await ctx.reply(resp)
@@ -85,15 +85,15 @@ class AdminCog(commands.Cog):
         if num == 1:
             # select random songs from playlist
             song = random.choice(results['items'])
-            self.ac.add_to_queue(song['track']['uri'], user=user)
+            await self.ac.add_to_queue(song['track']['uri'], user=user)
         else:
             for _ in range(num):
-                time.sleep(10)
+                await asyncio.sleep(10)
                 song_index = random.choice(numbers)
                 song = results['items'][song_index]
                 numbers.remove(song_index)
 
-                self.ac.add_to_queue(song['track']['uri'], user=user)
+                await self.ac.add_to_queue(song['track']['uri'], user=user)
 
     @commands.command(name='sp-mod')
     async def add_mod(self, ctx: commands.Context):
@@ -101,9 +101,9 @@ class AdminCog(commands.Cog):
         request = ctx.message.content
         request = request.replace(com, '')
 
-        target = target_finder(self.db, request)
+        target = await target_finder(self.db, request)
 
-        self.db.mod_user(target)
+        await self.db.mod_user(target)
         resp = f'@{target} is now a mod! Type !sp-help to see all the available commands!'
         await ctx.reply(resp)
         self.log.resp(resp)
@@ -112,9 +112,9 @@ class AdminCog(commands.Cog):
     async def remove_mod(self, ctx: commands.Context):
         request = ctx.message.content.strip(str(ctx.prefix + ctx.command.name))
 
-        target = target_finder(self.db, request)
+        target = await target_finder(self.db, request)
 
-        self.db.mod_user(target)
+        await self.db.mod_user(target)
         resp = f'@{target} is no longer a mod.'
         await ctx.reply(resp)
         self.log.resp(resp)
@@ -189,7 +189,7 @@ class AdminCog(commands.Cog):
 
     @commands.command(name='sp-clear-queue')
     async def clear_queue(self, ctx: commands.Context):
-        self.db.clear_queue()
+        await self.db.clear_queue()
         resp = f'Queue has been cleared!'
         await ctx.reply(resp)
         self.log.resp(resp)
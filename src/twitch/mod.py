@@ -1,12 +1,12 @@
 from twitchio.ext import commands
 from utils.errors import *
-from utils import Timer, time_finder, target_finder, Settings, DB, Log, Perms
+from utils import time_finder, target_finder, Settings, DBService, Log, Perms
 
 class ModCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.log: Log = bot.log
-        self.db: DB = bot.db
+        self.db: DBService = bot.db
         self.ac = bot.ac
         self.settings: Settings = bot.settings
         self.units = bot.units
@@ -14,7 +14,7 @@ class ModCog(commands.Cog):
         self.units_full = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days"}
 
     async def cog_check(self, ctx: commands.Context) -> bool:
-        if not self.db.is_user_privileged(ctx.author.name.lower()):
+        if not await self.db.is_user_privileged(ctx.author.name.lower()):
             raise NotAuthorized('mod')
         return True
 
@@ -38,22 +38,25 @@ class ModCog(commands.Cog):
         user = ctx.author.name.lower()
         request = ctx.message.content.strip(str(ctx.prefix + ctx.command.name))
 
-        target = target_finder(self.db, request)
+        target = await target_finder(self.db, request)
 
-        if self.ban(user, target):
+        if await self.ban(user, target):
             resp = f'@{target} has been banned!'
             await ctx.reply(resp)
             self.log.resp(resp)
 
-    def ban(self, user, target):
-        # if the user is an admin ban the target even if they're a mod
-        if self.db.is_user_admin(user):
-            self.db.ban_user(target)
+    async def ban(self, user, target):
+        if await self.can_ban(user, target):
+            await self.db.ban_user(target)
             return True
 
-        # if the user is a mod and the target isn't a mod or admin then ban the target
-        elif self.db.is_user_mod(user) and not self.db.is_user_privileged(target):
-            self.db.ban_user(target)
+    async def can_ban(self, user, target):
+        # if the user is an admin they can ban the target even if they're a mod
+        if await self.db.is_user_admin(user):
+            return True
+
+        # if the user is a mod they can ban the target if it isn't a mod or admin
+        elif await self.db.is_user_mod(user) and not await self.db.is_user_privileged(target):
             return True
 
         else:
@@ -64,17 +67,17 @@ class ModCog(commands.Cog):
         user = ctx.author.name.lower()
         request = ctx.message.content.strip(str(ctx.prefix + ctx.command.name))
 
-        target = target_finder(self.db, request)
+        target = await target_finder(self.db, request)
 
-        if self.unban(user, target):
+        if await self.unban(user, target):
             resp = f'@{target} has been unbanned!'
             await ctx.reply(resp)
             self.log.resp(resp)
 
-    def unban(self, user, target):
+    async def unban(self, user, target):
         # if user is a mod or admin and target is banned then unban them
-        if self.db.is_user_privileged(user):
-            self.db.unban_user(target)
+        if await self.db.is_user_privileged(user):
+            await self.db.unban_user(target)
             return True
         else:
             raise NotAuthorized('mod/admin')
@@ -87,25 +90,21 @@ class ModCog(commands.Cog):
         request = ctx.message.content
         request = request.replace(com, '')
 
-        target = target_finder(self.db, request)
+        target = await target_finder(self.db, request)
 
         time_ = request.replace(f'@{target} ', '')
         time_ = time_.strip(' ')
 
         try:
             time_returned = time_finder(time_)
-            if self.ban(user, target):
+            if await self.can_ban(user, target):
+                # bans the target and records when the timeout ends in one transaction
+                seconds = time_returned['time'] * self.units[time_returned['unit']]
+                await self.bot.timeouts.add(target, seconds, user)
                 resp = f'@{target} has been timed out for {time_returned["time"]} ' \
                        f'{self.units_full[time_returned["unit"]]}.'
                 await ctx.reply(resp)
                 self.log.resp(resp)
-                time_ms = (time_returned['time'] * \
-                    self.units[time_returned['unit']]) * 1000
-                try:
-                    Timer(time_ms, self.unban, [user, target])
-                except UserAlreadyRole:
-                    self.log.info(
-                        f'Timeout ended for {target}, user already unbanned.')
         except ValueError:
             raise TimeNotFound
     
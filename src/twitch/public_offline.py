@@ -1,6 +1,6 @@
 from twitchio.ext import commands
 from utils.errors import *
-from utils import Settings, DB, Log, Perms
+from utils import Settings, DBService, Log, Perms
 import datetime
 
 
@@ -10,7 +10,7 @@ class OfflineCog(commands.Cog):
         self.settings: Settings = bot.settings
         self.check_user = bot.check_user
         self.log: Log = bot.log
-        self.db: DB = bot.db
+        self.db: DBService = bot.db
 
     @commands.command(name='help')
     async def help(self, ctx: commands.Context):
@@ -41,7 +41,7 @@ class OfflineCog(commands.Cog):
 
     @commands.command(name='sp-leader')
     async def leader(self, ctx: commands.Context):
-        leader = self.db.get_leader()
+        leader = await self.db.get_leader()
         if leader is None:
             resp = "No one has been rated yet!"
         else:
@@ -54,7 +54,7 @@ class OfflineCog(commands.Cog):
     async def stats(self, ctx: commands.Context):
         user = ctx.author.name.lower()
 
-        stats = self.db.get_user_stats(user)
+        stats = await self.db.get_user_stats(user)
         resp = f"Your position is {stats['pos']} with {stats['rates']} rates from {stats['requests']} requests and {stats['rates given']} rates given!"
 
         await ctx.reply(resp)
@@ -1,13 +1,13 @@
 import twitchio
-from twitchio.ext import commands, routines
+from twitchio.ext import commands
 from utils.errors import *
-from utils import Settings, DB, Log, Perms
+from utils import Settings, DBService, Log, Perms
 
 class OnlineCog(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.log: Log = bot.log
-        self.db: DB = bot.db
+        self.db: DBService = bot.db
         self.ac = bot.ac
         self.settings: Settings = bot.settings
         self.veto_votes = {'track': '', 'artist': '', 'votes': []}
@@ -20,25 +20,15 @@ class OnlineCog(commands.Cog):
             return False
         return True
 
-    @routines.routine(seconds=7.5)
-    async def update_song_context(self):
-        if not self.bot.is_live:
-            return
-        if not self.settings.active:
-            return
-        await self.ac.update_context()
-
     def _load_methods(self, bot) -> None:
         super()._load_methods(bot)
         self.cog_load()
     
     def cog_unload(self) -> None:
         self.log.info('Online cog unloaded')
-        self.update_song_context.cancel()
 
     def cog_load(self) -> None:
         self.log.info('Online cog loaded')
-        self.update_song_context.start()
 
     @commands.cooldown(1, 10, commands.Bucket.channel)
     @commands.command(name='sr')
@@ -48,10 +38,10 @@ class OnlineCog(commands.Cog):
 
         await self.check_permission(ctx.author)
 
-        if self.db.is_user_banned(user):
+        if await self.db.is_user_banned(user):
             raise UserBanned
 
-        track, artist = self.ac.add_to_queue(request, user)
+        track, artist = await self.ac.add_to_queue(request, user)
 
         if track is None:
             resp = f'Your request could not be found on spotify'
@@ -62,7 +52,7 @@ class OnlineCog(commands.Cog):
             resp = f'{track} by {artist} has been added to the queue!'
             await ctx.reply(resp)
             self.log.resp(resp)
-            self.db.add_requests(user)
+            await self.db.add_requests(user)
             return True
     
     async def check_permission(self, user: twitchio.PartialChatter):
@@ -86,7 +76,7 @@ class OnlineCog(commands.Cog):
         return is_follower
 
     async def is_privileged(self, user: twitchio.PartialChatter):
-        if self.db.is_user_privileged(user.name.lower()):
+        if await self.db.is_user_privileged(user.name.lower()):
             return True
         elif user.is_vip:
             return True
@@ -148,12 +138,12 @@ class OnlineCog(commands.Cog):
         user = ctx.author.name.lower()
         song_context = self.ac.context.get_context()
 
-        resp = self.add_rate(song_context, user)
+        resp = await self.add_rate(song_context, user)
         if resp is not None:
             await ctx.reply(resp)
             self.log.resp(resp)
 
-    def add_rate(self, song_context, rater):
+    async def add_rate(self, song_context, rater):
         if song_context is None:
             return None
 
@@ -173,7 +163,7 @@ class OnlineCog(commands.Cog):
         if song_context['requester'] == rater:
             return "Sorry, you can't rate your own requests LUL"
         else:
-            self.db.add_rate(receiver=song_context['requester'], giver=rater)
+            await self.db.add_rate(receiver=song_context['requester'], giver=rater)
             self.current_rates['raters'].append(rater)
             return f"@{rater} liked @{song_context['requester']}'s song request!"
     
\ No newline at end of file
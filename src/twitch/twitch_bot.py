@@ -4,7 +4,7 @@ import asyncio
 import twitchio
 import time
 from twitchio.ext import commands, routines
-from utils import Log, DB, Settings, TwitchCreds
+from utils import Log, DB, DBService, Settings, TwitchCreds, TimeoutScheduler
 from utils.errors import *
 from AudioController.audio_controller import AudioController
 from twitch.public_offline import OfflineCog as PublicOffline
@@ -13,7 +13,7 @@ from twitch.mod import ModCog
 from twitch.admin import AdminCog
 
 class TwitchBot(commands.Bot):
-    def __init__(self, creds: TwitchCreds, log: Log, db: DB, ac: AudioController, settings: Settings):
+    def __init__(self, creds: TwitchCreds, log: Log, db: DBService, ac: AudioController, settings: Settings):
         token = creds.token
         twitch_channel = creds.channel
         super().__init__(token, prefix='!', initial_channels=[twitch_channel])
@@ -26,13 +26,15 @@ class TwitchBot(commands.Bot):
         self.log = log
         self.channel_name = twitch_channel
         self.channel_obj = None
-        self.user_cache = self.db.get_all_users()
+        self.user_cache = self.db.run_blocking(DB.get_all_users)
+        # sp-timeout unbans, picked back up from the db when the bot starts
+        self.timeouts = TimeoutScheduler(db, log)
         self.offline_cogs = [PublicOffline, ModCog, AdminCog]
         self.online_cogs = [PublicOnline]
 
     async def global_before_invoke(self, ctx):
         user = ctx.author.name.lower()
-        self.check_user(user)
+        await self.check_user(user)
         request = ctx.message.content.strip(str(ctx.prefix + ctx.command.name))
         self.log.req(user, request, ctx.command.name)
 
@@ -53,7 +55,7 @@ class TwitchBot(commands.Bot):
     
     @routines.routine(hours=1)
     async def reset_leaderboard_routine(self):
-        self.check_reset_leaderboard()
+        await self.check_reset_leaderboard()
 
     async def event_command_error(self, context: commands.Context, error: Exception) -> None:
         if isinstance(error, commands.errors.CommandOnCooldown):
@@ -147,28 +149,28 @@ class TwitchBot(commands.Bot):
 
 
 
-    def check_user(self, user):
+    async def check_user(self, user):
         if user in self.user_cache:
             return None
         else:
-            self.db.check_user_exists(user)
+            await self.db.check_user_exists(user)
             self.user_cache.append(user)
             return None
     
-    def check_reset_leaderboard(self):
+    async def check_reset_leaderboard(self):
         period = self.settings.leaderboard_reset
         if period == 'off':
             return
 
-        last = self.db.get_last_reset()
-        leader = self.db.get_leader()
+        last = await self.db.get_last_reset()
+        leader = await self.db.get_leader()
 
         if leader is None:
             return
 
         if last is None:
-            rewards = self.give_rewards(leader)
-            self.db.reset_leaderboard(leader, period=period, rewards=rewards)
+            rewards = await self.give_rewards(leader)
+            await self.db.reset_leaderboard(leader, period=period, rewards=rewards)
             return
 
         # checks if leaderboard reset is due by comparing reset time to current time
@@ -176,30 +178,30 @@ class TwitchBot(commands.Bot):
             return
 
         if period == 'weekly':
-            rewards = self.give_rewards(leader)
-            self.db.reset_leaderboard(leader, period=period, rewards=rewards)
+            rewards = await self.give_rewards(leader)
+            await self.db.reset_leaderboard(leader, period=period, rewards=rewards)
         elif period == 'monthly':
-            rewards = self.give_rewards(leader)
-            self.db.reset_leaderboard(leader, period=period, rewards=rewards)
+            rewards = await self.give_rewards(leader)
+            await self.db.reset_leaderboard(leader, period=period, rewards=rewards)
         if bool(last[5]):
-            self.remove_rewards(last)
-            self.db.remove_active_lb(last[0])
+            await self.remove_rewards(last)
+            await self.db.remove_active_lb(last[0])
             
-    def give_rewards(self, leader):
+    async def give_rewards(self, leader):
         rewards = self.settings.leaderboard_rewards
         rewards_return = {}
 
-        if self.db.is_user_privileged(leader):
+        if await self.db.is_user_privileged(leader):
             pass
         elif 'sp_mod' in rewards:
-            self.db.mod_user(leader)
+            await self.db.mod_user(leader)
             rewards_return['sp_mod'] = 1
         
         return rewards_return
 
-    def remove_rewards(self, last):
+    async def remove_rewards(self, last):
         if bool(last[4]):
-            self.db.remove_privilege_user(last[1])
+            await self.db.remove_privilege_user(last[1])
     
     @check_live.error
     async def live_error(self, error):
@@ -221,6 +223,7 @@ class TwitchBot(commands.Bot):
             self.reset_leaderboard_routine.start()
         except RuntimeError:
             self.reset_leaderboard_routine.restart()
+        await self.timeouts.start()
     
     async def event_ready(self):
         self.log.info('Bot is ready')
@@ -257,7 +260,7 @@ class TwitchBot(commands.Bot):
         request = ctx.message.content.strip(str(ctx.prefix + ctx.command.name))
         self.log.req(user, request, ctx.command.name)
 
-        if not self.db.is_user_admin(user):
+        if not await self.db.is_user_admin(user):
             return
         
         self.log.info('Reloading cogs')
@@ -1,6 +1,9 @@
 from utils.db_handler import DB
+from utils.db_service import DBService
+from utils.event_bus import EventBus
 from utils.logger import Log
 from utils.settings import Settings, Perms
 from utils.creds import Creds, SpotifyCreds, TwitchCreds, DiscordCreds
 from utils.async_timer import Timer
+from utils.timeout_scheduler import TimeoutScheduler
 from utils.twitch_utils import time_finder, target_finder
\ No newline at end of file
@@ -1,19 +1,118 @@
 import asyncio
+import heapq
+import itertools
+import weakref
 
-# creates a timer that calls a function after given number of milliseconds
 
+# one per event loop: every Timer made on the loop goes into a heap ordered by deadline
+# and a single task sleeps until the earliest one is due. A pending timer costs one heap
+# entry rather than a task sleeping on its own, and cancelling just marks it, cancelled
+# entries are skipped when they come up or swept out once they make up half the heap.
+class TimerService:
+    _services = weakref.WeakKeyDictionary()
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        # (deadline in loop.time() seconds, order, timer)
+        self.heap = []
+        self.order = itertools.count()
+        self.cancelled = 0
+        self.fired = 0
+        # callbacks that are still running, the loop only keeps weak references to tasks
+        self.running = set()
+        self.task = None
+        self.wakeup = None
+
+    @classmethod
+    def current(cls):
+        loop = asyncio.get_running_loop()
+        service = cls._services.get(loop)
+        if service is None:
+            service = cls._services[loop] = cls(loop)
+        return service
+
+    def schedule(self, timer):
+        heapq.heappush(self.heap, (timer.deadline, next(self.order), timer))
+        if self.task is None or self.task.done():
+            self.task = self.loop.create_task(self.run())
+        elif self.heap[0][2] is timer:
+            # the new timer is due before whatever the task is sleeping until
+            self.wake()
+
+    def cancel(self, timer):
+        self.cancelled += 1
+        if self.cancelled > 64 and self.cancelled * 2 > len(self.heap):
+            self.heap = [entry for entry in self.heap if not entry[2].done]
+            heapq.heapify(self.heap)
+            self.cancelled = 0
+
+    def wake(self):
+        if self.wakeup is not None and not self.wakeup.done():
+            self.wakeup.set_result(None)
+
+    async def run(self):
+        while True:
+            now = self.loop.time()
+            while len(self.heap) > 0 and (self.heap[0][2].done or self.heap[0][0] <= now):
+                _, _, timer = heapq.heappop(self.heap)
+                if timer.done:
+                    self.cancelled -= 1
+                    continue
+                timer.done = True
+                timer.fire()
+                self.fired += 1
+            self.wakeup = self.loop.create_future()
+            handle = None
+            if len(self.heap) > 0:
+                handle = self.loop.call_at(self.heap[0][0], self.wake)
+            try:
+                await self.wakeup
+            finally:
+                if handle is not None:
+                    handle.cancel()
 
+    def pending(self) -> int:
+        return len(self.heap) - self.cancelled
+
+    # loop.time() the next timer is due at, None when nothing is pending
+    def next_deadline(self):
+        while len(self.heap) > 0 and self.heap[0][2].done:
+            heapq.heappop(self.heap)
+            self.cancelled -= 1
+        if len(self.heap) == 0:
+            return None
+        return self.heap[0][0]
+
+    def stats(self) -> dict:
+        next_deadline = self.next_deadline()
+        return {'pending': self.pending(),
+                'fired': self.fired,
+                'running': len(self.running),
+                'next_in': None if next_deadline is None else max(next_deadline - self.loop.time(), 0)}
+
+
+# creates a timer that calls a function after given number of milliseconds
 class Timer:
+    __slots__ = ('deadline', 'done', '_callback', '_args', '_service')
+
     def __init__(self, timeout: int, callback: callable, args: list = []):
+        self._service = TimerService.current()
         # convert milliseconds to seconds
-        self._timeout = float(timeout / 1000)
+        self.deadline = self._service.loop.time() + float(timeout / 1000)
+        # set once the timer has fired or been cancelled
+        self.done = False
         self._callback = callback
-        self._task = asyncio.ensure_future(self._job())
         self._args = args
+        self._service.schedule(self)
 
-    async def _job(self):
-        await asyncio.sleep(self._timeout)
-        await self._callback(*self._args)
+    def fire(self):
+        # the callback gets its own task so a slow one does not hold up the other timers
+        task = self._service.loop.create_task(self._callback(*self._args))
+        self._service.running.add(task)
+        task.add_done_callback(self._service.running.discard)
 
     def cancel(self):
-        self._task.cancel()
+        if self.done:
+            return
+        self.done = True
+        self._service.cancel(self)
@@ -1,72 +1,158 @@
 from utils.errors import *
 from utils.logger import Log
+from utils.event_bus import EventBus, QUEUE_CHANGED, LEADERBOARD_CHANGED
+from utils.migrations import migrate
 from os.path import exists
+from contextlib import contextmanager
+import functools
 import sqlite3
 import time
 
 
 class DB:
-    def __init__(self, log: Log, db_path: str = './data/app.sqlite'):
-        
+    # columns update_user is allowed to write, column names can't be bound as parameters.
+    # roles live on the users table, counters on user_stats for the current epoch
+    role_columns = ('ban', 'moderator', 'administrator')
+    counter_columns = ('requests', 'rates', 'rates_given')
+    user_columns = role_columns + counter_columns
+    # role flags packed into one int per user in the in memory role index
+    BAN = 1
+    MOD = 2
+    ADMIN = 4
+    role_flags = {'ban': BAN, 'moderator': MOD, 'administrator': ADMIN}
+    # queue pos is a sparse sort key, not the position shown to users. New keys go
+    # pos_gap after the last/before the first or halfway between two neighbours,
+    # so adding, removing and bumping a request only ever touches that one row.
+    pos_gap = 1 << 16
+
+    def __init__(self, log: Log, db_path: str = './data/app.sqlite', bus: EventBus = None):
+
         if not exists(db_path):
             with open(db_path, 'w') as f:
                 f.close()
-        
-        self.db = sqlite3.connect(db_path)
+
+        # every query below is a constant string with bound parameters,
+        # so sqlite3's per-connection statement cache compiles each one only once
+        self.db = sqlite3.connect(db_path, cached_statements=256)
         self.cursor = self.db.cursor()
+        # WAL lets readers run alongside a writer and only fsyncs at checkpoints
+        self.cursor.execute('PRAGMA journal_mode = WAL')
+        self.cursor.execute('PRAGMA synchronous = NORMAL')
         self.log = log
+        self.bus = bus
         self.user_tb = 'users'
         self.queue_tb = 'queue'
         self.leaderboard_reset = 'lb_reset'
-        self.cursor.execute(
-            f'CREATE TABLE IF NOT EXISTS {self.user_tb} (username VARCHAR(50) NOT NULL, ban TINYINT, moderator TINYINT, administrator TINYINT, \
-            requests SMALLINT, rates SMALLINT, rates_given SMALLINT, PRIMARY KEY (username))')
-        self.cursor.execute(
-            f'CREATE TABLE IF NOT EXISTS {self.queue_tb} (request_id INTEGER PRIMARY KEY AUTOINCREMENT, pos SMALLINT, track TEXT, artist TEXT, \
-            requester VARCHAR(50), link TEXT)')
-        self.cursor.execute(
-            f'CREATE TABLE IF NOT EXISTS {self.leaderboard_reset} (win_id INTEGER PRIMARY KEY AUTOINCREMENT, winner VARCHAR(50), date INT, next_reset_date INT, sp_mod_given TINYINT, \
-            win_active TINYINT DEFAULT 1)')
+        self.epoch_tb = 'lb_epoch'
+        self.stats_tb = 'user_stats'
+        self.tracks_tb = 'tracks'
+        self.plays_tb = 'plays'
+        self.timeouts_tb = 'timeouts'
+        # rates/requests/rates given are counted in memory and written in one transaction
+        # every counter_flush_interval seconds or once counter_flush_size users are pending
+        self.pending_counters = {}
+        self.counter_flush_interval = 2.0
+        self.counter_flush_size = 50
+        self.last_counter_flush = time.monotonic()
+        # played requests are appended to the play log in batches with the counters
+        self.pending_plays = []
+        # counters and plays taken out of the buffers by a flush that isn't committed yet,
+        # put back if the transaction is rolled back so they are written by the next flush
+        self.uncommitted_counters = []
+        self.uncommitted_plays = []
+        # the queue is held in memory as rows of [request_id, pos, track, artist, requester, link,
+        # track_id, uri, duration_ms] in pos order, queue_version goes up on every change so readers
+        # can tell when to re-read. Adding, moving or removing a request writes one row, unless two
+        # neighbouring keys have run out of room and respace_queue rewrites all n of them. The in
+        # memory side is O(n) too: queue_index scans the list, and so does list.insert/pop, so an
+        # id to index map would have to be rebuilt on every change. Fine for a song request queue
+        self.queue = []
+        self.queue_version = 0
+        # {spotify track id: requests queued for it}, for duplicate checks by id
+        self.queued_ids = {}
+        # (queue_version, start times, total duration), the ms from the head of the queue starting
+        # to each request starting. Rebuilt at most once per queue change, so ETAs never refetch metadata
+        self.queue_timeline = None
+        self.leaderboard_version = 0
+        self.leaderboard_cache = None
+        # depth of nested transaction() blocks, commits are held back until the outermost one ends
+        self.transaction_depth = 0
+        # counters are kept per leaderboard period (epoch), a reset only starts a new epoch
+        # and earlier periods stay in user_stats as history
+        self.epoch = None
+        # {username: role flags} for every user, loaded at start up and written through
+        # by every role change so permission checks never go to sqlite
+        self.roles = {}
+        # tables and indexes are created and changed by the ordered steps in utils.migrations
+        self.schema_version = migrate(self.db, log)
+        self.load_epoch()
+        self.load_roles()
+        self.load_queue()
+
+    def close(self):
+        self.flush_writes()
+        self.db.commit()
+        self.db.close()
+
+    def commit(self):
+        if self.transaction_depth == 0:
+            self.db.commit()
+            self.uncommitted_counters = []
+            self.uncommitted_plays = []
+
+    # runs everything inside the block as one transaction with a single commit, e.g.
+    #     with db.transaction():
+    #         db.add_leaderboard_winner(...)
+    #         db.reset_all_user_stats()
+    # blocks can be nested, if anything raises the whole transaction is rolled back
+    @contextmanager
+    def transaction(self):
+        self.transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self.transaction_depth -= 1
+            if self.transaction_depth == 0:
+                self.rollback()
+            raise
+        self.transaction_depth -= 1
+        self.commit()
+
+    def rollback(self):
+        self.db.rollback()
+        # the in memory copies may hold writes that were just undone, read them back
+        self.load_epoch()
+        self.load_roles()
+        self.load_queue()
+        for counters in self.uncommitted_counters:
+            for username, (requests, rates, rates_given) in counters.items():
+                self.add_to_counters(username, requests, rates, rates_given)
+        self.pending_plays = [play for plays in self.uncommitted_plays for play in plays] + self.pending_plays
+        self.uncommitted_counters = []
+        self.uncommitted_plays = []
+        self.leaderboard_changed()
 
     def error_handler(self, error, func):
         self.log.error(f'Error in {func.__name__}: {error}')
         raise DBError
 
     def check(func: callable):
+        @functools.wraps(func)
         def wrapper(self, *args, **kwargs):
-
-            args = list(args)
-            for ind, item in enumerate(args):
-                if isinstance(item, str):
-                    item = item.replace("'", "''")
-                    item = item.replace('"', '""')
-                    item = item.replace('&', '')
-                    item = item.replace('--', '')
-                    args[ind] = item
-            
-            for kwarg in kwargs.keys():
-                item = kwargs[kwarg]
-                if isinstance(item, str):
-                    item = item.replace("'", "''")
-                    item = item.replace('"', '""')
-                    item = item.replace('&', '')
-                    item = item.replace('--', '')
-                    kwargs[kwarg] = item
-                
             try:
                 return func(self, *args, **kwargs)
             except Exception as er:
                 self.error_handler(er, func)
                 return None
-            
+
         return wrapper
 
     @check
     def remove_active_lb(self, win_id: int):
-        sql = f"UPDATE {self.leaderboard_reset} SET win_active = 0 WHERE win_id = {win_id}"
-        self.cursor.execute(sql)
-        self.db.commit()
-    
+        sql = f"UPDATE {self.leaderboard_reset} SET win_active = 0 WHERE win_id = ?"
+        self.cursor.execute(sql, (win_id,))
+        self.commit()
+
     @check
     def get_last_reset(self):
         sql = f"SELECT * FROM {self.leaderboard_reset} WHERE win_active = 1"
@@ -86,8 +172,9 @@ class DB:
             next_reset_date = date + 604800
         elif period == 'monthly':
             next_reset_date = date + 2592000
-        self.add_leaderboard_winner(winner, date, next_reset_date, bool(rewards['sp_mod']))
-        self.reset_all_user_stats()
+        with self.transaction():
+            self.add_leaderboard_winner(winner, date, next_reset_date, bool(rewards['sp_mod']))
+            self.reset_all_user_stats()
 
     @check
     def get_all_resets(self):
@@ -97,28 +184,21 @@ class DB:
 
     @check
     def add_leaderboard_winner(self, winner: str, start_date, end_date, sp_mod_given: bool):
-        sql = f"INSERT INTO {self.leaderboard_reset} (winner, date, next_reset_date, sp_mod_given) VALUES ('{winner}', {start_date}, {end_date}, {int(sp_mod_given)})"
-        self.cursor.execute(sql)
-        self.db.commit()
+        sql = f"INSERT INTO {self.leaderboard_reset} (winner, date, next_reset_date, sp_mod_given) VALUES (?, ?, ?, ?)"
+        self.cursor.execute(sql, (winner, start_date, end_date, int(sp_mod_given)))
+        self.commit()
         self.get_all_resets()
 
     @check
     def get_leader(self):
-        sql = f"SELECT username, rates FROM {self.user_tb} WHERE rates > 0 ORDER BY rates DESC"
-        self.cursor.execute(sql)
-        results = self.cursor.fetchall()
-        if results is None:
-            return None
-        if len(results) == 0:
-            return None
-        else:
-            return results[0]
+        self.flush_counters()
+        sql = f"SELECT username, rates FROM {self.stats_tb} WHERE epoch = ? AND rates > 0 ORDER BY rates DESC LIMIT 1"
+        self.cursor.execute(sql, (self.epoch,))
+        return self.cursor.fetchone()
 
     @check
     def check_user_exists(self, username):
-        sql = f"SELECT * FROM {self.user_tb} WHERE username = '{username}'"
-        self.cursor.execute(sql)
-        if len(self.cursor.fetchall()) == 0:
+        if username not in self.roles:
             self.init_user(username)
             return False
         else:
@@ -126,18 +206,31 @@ class DB:
 
     @check
     def init_user(self, username: str, ban=0, mod=0, admin=0, requests=0, rates=0, rates_given=0):
-        sql = f"INSERT INTO {self.user_tb} VALUES ('{username}', {ban}, {mod}, {admin}, {requests}, {rates}, {rates_given})"
-        self.cursor.execute(sql)
-        self.db.commit()
+        # the counter columns on users are from before epochs and are left at 0
+        sql = f"INSERT INTO {self.user_tb} VALUES (?, ?, ?, ?, 0, 0, 0)"
+        self.cursor.execute(sql, (username, ban, mod, admin))
+        if requests or rates or rates_given:
+            sql = f"INSERT INTO {self.stats_tb} (username, epoch, requests, rates, rates_given) VALUES (?, ?, ?, ?, ?)"
+            self.cursor.execute(sql, (username, self.epoch, requests, rates, rates_given))
+        self.commit()
+        self.roles[username] = self.pack_roles(ban, mod, admin)
+        if rates:
+            self.leaderboard_changed()
         self.log.info(f'Initialized {username}')
         return True
 
     @check
     def delete_user(self, username: str):
-        sql = f"DELETE FROM {self.user_tb} WHERE username = '{username}'"
-        self.cursor.execute(sql)
-        self.db.commit()
-        if self.cursor.rowcount > 0:
+        self.pending_counters.pop(username, None)
+        self.roles.pop(username, None)
+        sql = f"DELETE FROM {self.user_tb} WHERE username = ?"
+        self.cursor.execute(sql, (username,))
+        deleted = self.cursor.rowcount
+        sql = f"DELETE FROM {self.stats_tb} WHERE username = ?"
+        self.cursor.execute(sql, (username,))
+        self.commit()
+        if deleted > 0:
+            self.leaderboard_changed()
             self.log.info(f'Deleted user: {username}')
             return True
         else:
@@ -146,9 +239,24 @@ class DB:
     @check
     def update_user(self, username: str, update: dict):
         for col in update.keys():
-            sql = f"UPDATE {self.user_tb} SET {col} = '{update[col]}' WHERE username = '{username}'"
-            self.cursor.execute(sql)
-            self.db.commit()
+            if col not in self.user_columns:
+                raise ValueError(f'Unknown user column: {col}')
+        roles = {col: value for col, value in update.items() if col in self.role_columns}
+        counters = {col: value for col, value in update.items() if col in self.counter_columns}
+        with self.transaction():
+            if len(roles) > 0:
+                self.write_roles([username], roles)
+            if len(counters) > 0:
+                # buffered increments would otherwise land on top of the new values
+                self.flush_counters()
+                cols = ', '.join(counters)
+                values = ', '.join('?' for _ in counters)
+                updates = ', '.join(f'{col} = excluded.{col}' for col in counters)
+                sql = f"INSERT INTO {self.stats_tb} (username, epoch, {cols}) VALUES (?, ?, {values}) " \
+                      f"ON CONFLICT (username, epoch) DO UPDATE SET {updates}"
+                self.cursor.execute(sql, (username, self.epoch, *counters.values()))
+        if 'rates' in update:
+            self.leaderboard_changed()
 
     @check
     def get_all_users(self):
@@ -158,286 +266,605 @@ class DB:
 
     @check
     def get_user_full(self, username: str):
-        sql = f"SELECT * FROM {self.user_tb} WHERE username = '{username}'"
-        self.cursor.execute(sql)
+        self.flush_counters()
+        sql = f"SELECT users.username, ban, moderator, administrator, COALESCE(stats.requests, 0), " \
+              f"COALESCE(stats.rates, 0), COALESCE(stats.rates_given, 0) FROM {self.user_tb} AS users " \
+              f"LEFT JOIN {self.stats_tb} AS stats ON stats.username = users.username AND stats.epoch = ? " \
+              f"WHERE users.username = ?"
+        self.cursor.execute(sql, (self.epoch, username))
         results = self.cursor.fetchall()[0]
         return {'ban': bool(results[1]), 'mod': bool(results[2]), 'admin': bool(results[3]),
                 'requests': int(results[4]), 'rates': int(results[5]), 'rates given': int(results[6])}
 
+    def load_roles(self):
+        sql = f"SELECT username, ban, moderator, administrator FROM {self.user_tb}"
+        self.cursor.execute(sql)
+        self.roles = {username: self.pack_roles(ban, mod, admin) for username, ban, mod, admin in self.cursor.fetchall()}
+
+    def pack_roles(self, ban, mod, admin):
+        return (self.BAN if ban else 0) | (self.MOD if mod else 0) | (self.ADMIN if admin else 0)
+
+    # only called once the change has been executed, so the index never runs ahead of sqlite
+    def set_roles(self, username: str, flags: int, value: bool):
+        if value:
+            self.roles[username] |= flags
+        else:
+            self.roles[username] &= ~flags
+
+    # unknown users raise (KeyError -> DBError) the same as the old empty result did
     @check
     def is_user_banned(self, username: str):
-        sql = f"SELECT ban FROM {self.user_tb} WHERE username = '{username}'"
-        self.cursor.execute(sql)
-        return bool(self.cursor.fetchall()[0][0])
+        return bool(self.roles[username] & self.BAN)
 
     @check
     def is_user_mod(self, username: str):
-        sql = f"SELECT moderator FROM {self.user_tb} WHERE username = '{username}'"
-        self.cursor.execute(sql)
-        return bool(self.cursor.fetchall()[0][0])
+        return bool(self.roles[username] & self.MOD)
 
     @check
     def is_user_admin(self, username: str):
-
-        sql = f"SELECT administrator FROM {self.user_tb} WHERE username = '{username}'"
-        self.cursor.execute(sql)
-        return bool(self.cursor.fetchall()[0][0])
+        return bool(self.roles[username] & self.ADMIN)
 
     @check
     def is_user_privileged(self, username: str):
+        # an unknown user isn't privileged
+        return bool(self.roles.get(username, 0) & self.MOD)
 
-        sql = f"SELECT moderator, administrator FROM {self.user_tb} WHERE username = '{username}'"
-        self.cursor.execute(sql)
-        results = self.cursor.fetchall()
-        for res in results:
-            if bool(res[0]) is True:
-                return True
-        return False
+    # one UPDATE for any number of users and role columns, the caller commits
+    def write_roles(self, usernames: list, update: dict):
+        cols = ', '.join(f'{col} = ?' for col in update)
+        sql = f"UPDATE {self.user_tb} SET {cols} WHERE username = ?"
+        self.cursor.executemany(sql, [(*update.values(), username) for username in usernames])
+        for username in usernames:
+            if username in self.roles:
+                for col, value in update.items():
+                    self.set_roles(username, self.role_flags[col], bool(value))
+
+    # applies the same role change to many users in one transaction, users that
+    # don't exist yet are created first, e.g. update_roles(mod_list, {'ban': 0, 'moderator': 1})
+    @check
+    def update_roles(self, usernames: list, update: dict):
+
+        for col in update.keys():
+            if col not in self.role_columns:
+                raise ValueError(f'Unknown role column: {col}')
+        usernames = list(dict.fromkeys(usernames))
+        new_users = [(username,) for username in usernames if username not in self.roles]
+        with self.transaction():
+            sql = f"INSERT INTO {self.user_tb} VALUES (?, 0, 0, 0, 0, 0, 0)"
+            self.cursor.executemany(sql, new_users)
+            for (username,) in new_users:
+                self.roles[username] = 0
+            self.write_roles(usernames, update)
+        self.log.info(f'Updated roles of {len(usernames)} users: {update}')
 
     @check
     def remove_privilege_user(self, username: str):
 
-        sql = f"UPDATE {self.user_tb} SET administrator = '0', moderator = '0' WHERE username = '{username}'"
-        self.cursor.execute(sql)
-        self.db.commit()
+        self.write_roles([username], {'moderator': 0, 'administrator': 0})
+        self.commit()
 
     @check
     def ban_user(self, username: str):
 
-        self.remove_privilege_user(username)
-        sql = f"UPDATE {self.user_tb} SET ban = '1' WHERE username = '{username}'"
-        self.cursor.execute(sql)
-        self.db.commit()
+        self.write_roles([username], {'ban': 1, 'moderator': 0, 'administrator': 0})
+        # a ban replaces any timeout the user was serving
+        self.cursor.execute(f"DELETE FROM {self.timeouts_tb} WHERE username = ?", (username,))
+        self.commit()
         self.log.info(f'Banned user: {username}')
 
 
     @check
     def unban_user(self, username: str):
 
-        sql = f"UPDATE {self.user_tb} SET ban = '0' WHERE username = '{username}'"
-        self.cursor.execute(sql)
-        self.db.commit()
+        self.write_roles([username], {'ban': 0})
+        self.cursor.execute(f"DELETE FROM {self.timeouts_tb} WHERE username = ?", (username,))
+        self.commit()
         self.log.info(f'Unbanned user: {username}')
 
+    # bans the user until expires_at (unix seconds), replacing any earlier timeout
+    @check
+    def timeout_user(self, username: str, expires_at: int, issued_by: str = None):
+
+        with self.transaction():
+            self.ban_user(username)
+            sql = f"INSERT OR REPLACE INTO {self.timeouts_tb} (username, expires_at, issued_by) VALUES (?, ?, ?)"
+            self.cursor.execute(sql, (username, int(expires_at), issued_by))
+        self.log.info(f'Timed out user: {username} until {int(expires_at)}')
+
+    # the earliest expires_at of all pending timeouts, None when there are none
+    @check
+    def get_next_timeout(self):
+
+        self.cursor.execute(f"SELECT MIN(expires_at) FROM {self.timeouts_tb}")
+        return self.cursor.fetchone()[0]
+
+    # unbans everyone whose timeout has expired by now in one transaction, returns their usernames
+    @check
+    def expire_timeouts(self, now: int):
+
+        self.cursor.execute(f"SELECT username FROM {self.timeouts_tb} WHERE expires_at <= ?", (int(now),))
+        usernames = [username for username, in self.cursor.fetchall()]
+        if len(usernames) == 0:
+            return []
+        with self.transaction():
+            self.write_roles(usernames, {'ban': 0})
+            self.cursor.execute(f"DELETE FROM {self.timeouts_tb} WHERE expires_at <= ?", (int(now),))
+        self.log.info(f'Timeouts ended for: {", ".join(usernames)}')
+        return usernames
+
     @check
     def mod_user(self, username: str):
 
-        self.unban_user(username)
-        sql = f"UPDATE {self.user_tb} SET moderator = '1' WHERE username = '{username}'"
-        self.cursor.execute(sql)
-        self.db.commit()
+        self.write_roles([username], {'ban': 0, 'moderator': 1})
+        self.commit()
 
     @check
     def admin_user(self, username: str):
 
-        self.mod_user(username)
-        sql = f"UPDATE {self.user_tb} SET administrator = '1' WHERE username = '{username}'"
-        self.cursor.execute(sql)
-        self.db.commit()
+        self.write_roles([username], {'ban': 0, 'moderator': 1, 'administrator': 1})
+        self.commit()
 
     @check
     def add_rate(self, receiver, giver):
 
-        sql = f"UPDATE {self.user_tb} SET rates = rates + 1 WHERE username = '{receiver}'"
-        self.cursor.execute(sql)
-        sql2 = f"UPDATE {self.user_tb} SET rates_given = rates_given + 1 WHERE username = '{giver}'"
-        self.cursor.execute(sql2)
-        self.db.commit()
+        self.add_to_counters(receiver, rates=1)
+        self.add_to_counters(giver, rates_given=1)
+        self.check_flush_counters()
+        # leaderboard reads flush first, so listeners can be told straight away
+        self.leaderboard_changed()
 
     @check
     def add_requests(self, username: str):
 
-        sql = f"UPDATE {self.user_tb} SET requests = requests + 1 WHERE username = '{username}'"
-        self.cursor.execute(sql)
-        self.db.commit()
+        self.add_to_counters(username, requests=1)
+        self.check_flush_counters()
+
+    def add_to_counters(self, username: str, requests=0, rates=0, rates_given=0):
+        counters = self.pending_counters.setdefault(username, [0, 0, 0])
+        counters[0] += requests
+        counters[1] += rates
+        counters[2] += rates_given
+
+    def check_flush_counters(self):
+        if len(self.pending_counters) >= self.counter_flush_size or len(self.pending_plays) >= self.counter_flush_size or \
+                time.monotonic() - self.last_counter_flush >= self.counter_flush_interval:
+            self.flush_writes()
+
+    # everything that is written in batches, run every counter_flush_interval by DBService
+    @check
+    def flush_writes(self):
+
+        with self.transaction():
+            self.flush_counters()
+            self.flush_plays()
+
+    @check
+    def flush_counters(self):
+
+        self.last_counter_flush = time.monotonic()
+        if len(self.pending_counters) == 0:
+            return
+        counters = self.pending_counters
+        self.pending_counters = {}
+        self.uncommitted_counters.append(counters)
+        updates = [(username, self.epoch, requests, rates, rates_given)
+                   for username, (requests, rates, rates_given) in counters.items()]
+        # a user's first counter in an epoch creates their row for it
+        sql = f"INSERT INTO {self.stats_tb} (username, epoch, requests, rates, rates_given) VALUES (?, ?, ?, ?, ?) " \
+              f"ON CONFLICT (username, epoch) DO UPDATE SET requests = requests + excluded.requests, " \
+              f"rates = rates + excluded.rates, rates_given = rates_given + excluded.rates_given"
+        with self.transaction():
+            self.cursor.executemany(sql, updates)
+
+    def load_epoch(self):
+        self.cursor.execute(f"SELECT MAX(epoch) FROM {self.epoch_tb}")
+        (epoch,) = self.cursor.fetchone()
+        if epoch is None:
+            # only after delete_all, the migrations start the first epoch
+            self.cursor.execute(f"INSERT INTO {self.epoch_tb} (started) VALUES (?)", (int(time.time()),))
+            epoch = self.cursor.lastrowid
+            self.commit()
+        self.epoch = epoch
+
+    # returns the epoch of the period seasons_ago resets back, None if there wasn't one
+    @check
+    def get_epoch(self, seasons_ago: int = 0):
+
+        sql = f"SELECT epoch FROM {self.epoch_tb} ORDER BY epoch DESC LIMIT 1 OFFSET ?"
+        self.cursor.execute(sql, (max(seasons_ago, 0),))
+        result = self.cursor.fetchone()
+        if result is None:
+            return None
+        return result[0]
 
     @check
     def reset_all_user_stats(self):
 
-        sql = f"UPDATE {self.user_tb} SET requests = '0', rates = '0', rates_given = '0'"
-        self.cursor.execute(sql)
-        self.db.commit()
-        self.log.info('All user stats have been reset')
-
-    @check
-    def get_user_stats(self, username: str):
-
-        sql = f"SELECT rates, requests, rates_given FROM {self.user_tb} WHERE username = '{username}'"
-        self.cursor.execute(sql)
-        info = self.cursor.fetchall()
-        if len(info) == 0:
+        # buffered counters belong to the period that is ending
+        self.flush_counters()
+        sql = f"INSERT INTO {self.epoch_tb} (started) VALUES (?)"
+        self.cursor.execute(sql, (int(time.time()),))
+        self.commit()
+        self.epoch = self.cursor.lastrowid
+        self.leaderboard_changed()
+        self.log.info(f'All user stats have been reset, leaderboard epoch is now {self.epoch}')
+
+    @check
+    def get_user_stats(self, username: str, epoch: int = None):
+
+        # position is 1 + the number of users with strictly more rates in the epoch, so users
+        # on the same number of rates share a position (1, 1, 3...). The count is a range
+        # search on idx_user_stats_rates rather than a sort of the whole table.
+        self.flush_counters()
+        if epoch is None:
+            epoch = self.epoch
+        sql = f"SELECT COALESCE(stats.rates, 0), COALESCE(stats.requests, 0), COALESCE(stats.rates_given, 0), " \
+              f"(SELECT COUNT(*) FROM {self.stats_tb} AS ahead " \
+              f"WHERE ahead.epoch = ? AND ahead.rates > COALESCE(stats.rates, 0)) + 1 " \
+              f"FROM {self.user_tb} AS users LEFT JOIN {self.stats_tb} AS stats " \
+              f"ON stats.username = users.username AND stats.epoch = ? WHERE users.username = ?"
+        self.cursor.execute(sql, (epoch, epoch, username))
+        info = self.cursor.fetchone()
+        if info is None:
             return None
-        info = info[0]
-
-        sql2 = f"SELECT username FROM {self.user_tb} ORDER BY rates DESC"
-        self.cursor.execute(sql2)
-        sorted_users = [user[0] for user in self.cursor.fetchall()]
-        pos = sorted_users.index(username) + 1
 
-        return {'pos': pos, 'requests': info[1], 'rates': info[0], 'rates given': info[2]}
+        return {'pos': info[3], 'requests': info[1], 'rates': info[0], 'rates given': info[2]}
 
     @check
-    def get_leaderboard(self):
+    def get_leaderboard(self, limit=50):
 
-        sql = f"SELECT username, rates FROM {self.user_tb} WHERE rates > 0 ORDER BY rates DESC"
-        self.cursor.execute(sql)
+        # the formatted leaderboard is reused until leaderboard_changed is next called
+        key = (self.leaderboard_version, limit)
+        if self.leaderboard_cache is not None and self.leaderboard_cache[0] == key:
+            return self.leaderboard_cache[1]
+        self.flush_counters()
+        sql = f"SELECT username, rates FROM {self.stats_tb} WHERE epoch = ? AND rates > 0 ORDER BY rates DESC LIMIT ?"
+        self.cursor.execute(sql, (self.epoch, limit))
         results = self.cursor.fetchall()
-        return self.format_user_results(results)
+        leaderboard = self.format_user_results(results, limit)
+        self.leaderboard_cache = (key, leaderboard)
+        return leaderboard
 
+    # keeps the longest run of users whose column fits in a discord embed field
     @check
-    def format_user_results(self, results, limit=50):
+    def format_user_results(self, results, limit=50, max_length=1024):
         sorted_users = []
         sorted_rates = []
         sorted_position = []
-        i = 1
-        for res in results[:limit]:
+        length = 0
+        for i, res in enumerate(results[:limit], start=1):
+            user = str(res[0])
+            # entries are joined with ' \n ', 3 characters between each one
+            length += len(user) if i == 1 else len(user) + 3
+            if length > max_length:
+                break
             sorted_position.append(str(i))
-            sorted_users.append(str(res[0]))
+            sorted_users.append(user)
             sorted_rates.append(str(res[1]))
-            i += 1
         sorted_position = ' \n '.join(sorted_position)
         sorted_users = ' \n '.join(sorted_users)
         sorted_rates = ' \n '.join(sorted_rates)
-        if len(sorted_users) > 1024:
-            return self.format_user_results(results, limit=limit - 5)
+        return sorted_position, sorted_users, sorted_rates
+
+
+    def load_queue(self):
+        sql = f"SELECT request_id, pos, track, artist, requester, link, track_id, uri, duration_ms " \
+              f"FROM {self.queue_tb} ORDER BY pos ASC"
+        self.cursor.execute(sql)
+        self.queue = [list(row) for row in self.cursor.fetchall()]
+        self.queued_ids = {}
+        for req in self.queue:
+            self.count_queued_id(req[6], 1)
+        self.queue_version += 1
+
+    def count_queued_id(self, track_id: str, change: int):
+        if track_id is None:
+            return
+        count = self.queued_ids.get(track_id, 0) + change
+        if count > 0:
+            self.queued_ids[track_id] = count
         else:
-            return sorted_position, sorted_users, sorted_rates
+            self.queued_ids.pop(track_id, None)
 
+    def queue_changed(self):
+        self.queue_version += 1
+        if self.bus is not None:
+            self.bus.publish(QUEUE_CHANGED)
+
+    def leaderboard_changed(self):
+        self.leaderboard_version += 1
+        if self.bus is not None:
+            self.bus.publish(LEADERBOARD_CHANGED)
 
     @check
-    def add_to_queue(self, requester: str, track: str, link, artist: str = 'na', pos: int = None):
+    def add_to_queue(self, requester: str, track: str, link, artist: str = 'na', pos: int = None,
+                     track_id: str = None, uri: str = None, duration_ms: int = 0):
 
-        q = f"SELECT COUNT(*) FROM {self.queue_tb}"
-        self.cursor.execute(q)
-        (rows,) = self.cursor.fetchone()
-        if pos is None:
-            pos = rows + 1
-        elif pos > (rows + 1):
-            pos = rows + 1
-        sql = f"INSERT INTO {self.queue_tb} (requester, track, link, artist, pos) VALUES ('{requester}', '{track}', '{link}', '{artist}', '{pos}')"
-        self.cursor.execute(sql)
-        self.db.commit()
+        if pos is None or pos > len(self.queue):
+            index = len(self.queue)
+        else:
+            index = max(pos, 1) - 1
+        key = self.new_pos_key(index)
+        # discord passes its user object, stored by name like the twitch requesters
+        requester = str(requester)
+        sql = f"INSERT INTO {self.queue_tb} (requester, track, link, artist, pos, track_id, uri, duration_ms) " \
+              f"VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+        self.cursor.execute(sql, (requester, track, link, artist, key, track_id, uri, duration_ms))
+        self.commit()
+        self.queue.insert(index, [self.cursor.lastrowid, key, track, artist, requester, link, track_id, uri, duration_ms])
+        self.count_queued_id(track_id, 1)
+        self.queue_changed()
         return True
 
+    # returns a sort key that puts a request at the given index of the in memory queue
+    def new_pos_key(self, index: int):
+        if len(self.queue) == 0:
+            return self.pos_gap
+        if index == 0:
+            return self.queue[0][1] - self.pos_gap
+        if index >= len(self.queue):
+            return self.queue[-1][1] + self.pos_gap
+        before = self.queue[index - 1][1]
+        after = self.queue[index][1]
+        if after - before < 2:
+            # no room left between the two, space the whole queue out again (rare)
+            self.respace_queue()
+            return self.new_pos_key(index)
+        return (before + after) // 2
+
+    # O(n) rows written, only after enough inserts between the same two requests to use up pos_gap
+    def respace_queue(self):
+        keys = []
+        for i, req in enumerate(self.queue):
+            req[1] = (i + 1) * self.pos_gap
+            keys.append((req[1], req[0]))
+        sql = f"UPDATE {self.queue_tb} SET pos = ? WHERE request_id = ?"
+        self.cursor.executemany(sql, keys)
+
+    def queue_index(self, req_id: int):
+        for index, req in enumerate(self.queue):
+            if req[0] == req_id:
+                return index
+        return None
+
     @check
     def remove_from_queue_by_id(self, req_id: int):
 
-        sql = f"SELECT track, artist, pos FROM {self.queue_tb} WHERE request_id = '{req_id}'"
-        self.cursor.execute(sql)
-        results = self.cursor.fetchall()
-        if len(results) == 0:
+        index = self.queue_index(req_id)
+        if index is None:
             return None, None
-        (track, artist, pos) = results[0]
-        sql2 = f"DELETE FROM {self.queue_tb} WHERE request_id = '{req_id}'"
-        self.cursor.execute(sql2)
-        self.db.commit()
-        sql3 = f"UPDATE {self.queue_tb} SET pos = pos - 1 WHERE pos > '{pos}'"
-        self.cursor.execute(sql3)
-        self.db.commit()
-        return track, artist
+        req = self.queue.pop(index)
+        self.count_queued_id(req[6], -1)
+        sql = f"DELETE FROM {self.queue_tb} WHERE request_id = ?"
+        self.cursor.execute(sql, (req_id,))
+        self.commit()
+        self.queue_changed()
+        return req[2], req[3]
 
     @check
     def remove_from_queue_by_info(self, track, artist):
-        track = track.replace("'", "''")
-        artist = artist.replace("'", "''")
-        sql = f"SELECT request_id, pos FROM {self.queue_tb} WHERE track = '{track}' AND artist = '{artist}'"
-        self.cursor.execute(sql)
-        results = self.cursor.fetchall()
-        if len(results) == 0:
-            return False
-        req_id = results[0][0]
-        pos = results[0][1]
-        sql2 = f"DELETE FROM {self.queue_tb} WHERE request_id = '{req_id}'"
-        self.cursor.execute(sql2)
-        self.db.commit()
-        sql3 = f"UPDATE {self.queue_tb} SET pos = pos - 1 WHERE pos > '{pos}'"
-        self.cursor.execute(sql3)
-        self.db.commit()
-        return True
+        for req in self.queue:
+            if req[2] == track and req[3] == artist:
+                self.remove_from_queue_by_id(req[0])
+                return True
+        return False
 
     @check
     def clear_queue(self):
 
         sql = f"DELETE FROM {self.queue_tb}"
         self.cursor.execute(sql)
-        self.db.commit()
+        self.commit()
+        self.queue = []
+        self.queued_ids = {}
+        self.queue_changed()
 
     @check
     def get_req_id_by_track_name(self, track_name):
-        track_name = track_name.replace("'", "''")
-        sql = f"SELECT request_id FROM {self.queue_tb} WHERE track = '{track_name}'"
-        self.cursor.execute(sql)
-        results = self.cursor.fetchone()
-        if results:
-            return results[0]
-        else:
-            return None
+        for req in self.queue:
+            if req[2] == track_name:
+                return req[0]
+        return None
 
     @check
     def move_request_pos(self, req_id: int, pos_new: int = 1):
 
-        sql = f"SELECT pos FROM {self.queue_tb} WHERE request_id = {req_id}"
-        self.cursor.execute(sql)
-        info = self.cursor.fetchall()
-        if len(info) == 0:
+        index = self.queue_index(req_id)
+        if index is None:
             return False
-        pos_old = info[0][0]
-        sql2 = f"UPDATE {self.queue_tb} SET pos = '{pos_new}' WHERE request_id = '{req_id}'"
-        self.cursor.execute(sql2)
-        if pos_new > pos_old:
-            sql3 = f"UPDATE {self.queue_tb} SET pos = pos - 1 WHERE '{pos_new}' >= pos AND pos > '{pos_old}' " \
-                   f"AND request_id != '{req_id}'"
-        else:
-            sql3 = f"UPDATE {self.queue_tb} SET pos = pos + 1 WHERE '{pos_new}' <= pos < '{pos_old}' " \
-                   f"AND request_id != {req_id}"
-        self.cursor.execute(sql3)
-        self.db.commit()
+        req = self.queue.pop(index)
+        index_new = min(max(pos_new, 1) - 1, len(self.queue))
+        req[1] = self.new_pos_key(index_new)
+        self.queue.insert(index_new, req)
+        sql = f"UPDATE {self.queue_tb} SET pos = ? WHERE request_id = ?"
+        self.cursor.execute(sql, (req[1], req_id))
+        self.commit()
+        self.queue_changed()
         return True
 
+    # the queue is kept in memory, written through to sqlite on every change,
+    # positions shown to users are worked out here from the sort order
     @check
     def get_queue(self):
 
-        sql = f"SELECT * FROM {self.queue_tb} ORDER BY pos ASC"
-        self.cursor.execute(sql)
-        results = self.cursor.fetchall()
-        self.db.commit()
-        return results
+        return [(req_id, pos, track, artist, requester, link)
+                for pos, (req_id, _, track, artist, requester, link, *_) in enumerate(self.queue, start=1)]
+
+    # as a get_queue row followed by track_id, uri and duration_ms
+    @check
+    def get_queue_head(self):
+
+        if len(self.queue) == 0:
+            return None
+        req_id, _, track, artist, requester, link, track_id, uri, duration_ms = self.queue[0]
+        return req_id, 1, track, artist, requester, link, track_id, uri, duration_ms
+
+    def get_queue_timeline(self):
+        if self.queue_timeline is None or self.queue_timeline[0] != self.queue_version:
+            starts = []
+            total = 0
+            for req in self.queue:
+                starts.append(total)
+                total += req[8] or 0
+            self.queue_timeline = (self.queue_version, starts, total)
+        return self.queue_timeline
+
+    # total length of the queue in ms, requests without a known duration count as 0
+    @check
+    def get_queue_duration(self):
+
+        return self.get_queue_timeline()[2]
+
+    # [(request_id, ms from the head of the queue starting until this request starts)] in queue order
+    @check
+    def get_queue_etas(self):
+
+        _, starts, _ = self.get_queue_timeline()
+        return [(req[0], start) for req, start in zip(self.queue, starts)]
+
+    @check
+    def get_request_eta(self, req_id: int):
+
+        index = self.queue_index(req_id)
+        if index is None:
+            return None
+        return self.get_queue_timeline()[1][index]
+
+    @check
+    def is_track_id_in_queue(self, track_id: str):
+
+        return track_id in self.queued_ids
 
     @check
     def get_track_list(self):
 
-        sql = f"SELECT track, artist FROM {self.queue_tb}"
-        self.cursor.execute(sql)
-        return self.cursor.fetchall()
+        return [(req[2], req[3]) for req in self.queue]
 
     @check
     def is_track_in_queue(self, track: str, artist: str):
-        track = track.replace("'", "''")
-        artist = artist.replace("'", "''")
-        sql = f"SELECT * FROM {self.queue_tb} WHERE track = '{track}' AND artist = '{artist}'"
-        self.cursor.execute(sql)
-        if len(self.cursor.fetchall()) == 0:
-            return False
-        else:
-            return True
+        for req in self.queue:
+            if req[2] == track and req[3] == artist:
+                return True
+        return False
 
     # returns requester of track in queue, returns false if track doesn't have a requester
 
     @check
     def get_requester(self, track: str, artist: str):
-        track = track.replace("'", "''")
-        artist = artist.replace("'", "''")
-        sql = f"SELECT requester FROM {self.queue_tb} WHERE track = '{track}' AND artist = '{artist}'"
-        self.cursor.execute(sql)
-        results = self.cursor.fetchall()
-        if len(results) != 0:
-            return results[0][0]
-        else:
-            return False
+        for req in self.queue:
+            if req[2] == track and req[3] == artist:
+                return req[4]
+        return False
+
+    # queues a play for the play log, spotify_id is the id at the end of the track link
+    @check
+    def log_play(self, spotify_id: str, track: str, artist: str, link: str, requester: str = None):
+
+        self.pending_plays.append((spotify_id, track, artist, link, requester, int(time.time())))
+        self.check_flush_counters()
+
+    @check
+    def flush_plays(self):
+
+        if len(self.pending_plays) == 0:
+            return
+        plays = self.pending_plays
+        self.pending_plays = []
+        self.uncommitted_plays.append(plays)
+        with self.transaction():
+            sql = f"INSERT OR IGNORE INTO {self.tracks_tb} (spotify_id, track, artist, link) VALUES (?, ?, ?, ?)"
+            self.cursor.executemany(sql, [(spotify_id, track, artist, link)
+                                          for spotify_id, track, artist, link, _, _ in plays])
+            sql = f"INSERT INTO {self.plays_tb} (track_id, requester, played_at) " \
+                  f"SELECT track_id, ?, ? FROM {self.tracks_tb} WHERE spotify_id = ?"
+            self.cursor.executemany(sql, [(requester, played_at, spotify_id)
+                                          for spotify_id, _, _, _, requester, played_at in plays])
+
+    # most recent first, as (track, artist, link, requester, played_at)
+    @check
+    def get_recent_plays(self, limit: int = 10):
+
+        self.flush_plays()
+        sql = f"SELECT tracks.track, tracks.artist, tracks.link, plays.requester, plays.played_at " \
+              f"FROM {self.plays_tb} AS plays JOIN {self.tracks_tb} AS tracks ON tracks.track_id = plays.track_id " \
+              f"ORDER BY plays.play_id DESC LIMIT ?"
+        self.cursor.execute(sql, (limit,))
+        return self.cursor.fetchall()
+
+    # who requested the last limit requested plays since the given time,
+    # as (spotify_id, requester) most recent first
+    @check
+    def get_recent_requesters(self, limit: int = 10, since: int = 0):
+
+        self.flush_plays()
+        sql = f"SELECT tracks.spotify_id, plays.requester " \
+              f"FROM {self.plays_tb} AS plays JOIN {self.tracks_tb} AS tracks ON tracks.track_id = plays.track_id " \
+              f"WHERE plays.requester IS NOT NULL AND plays.played_at >= ? ORDER BY plays.play_id DESC LIMIT ?"
+        self.cursor.execute(sql, (int(since), limit))
+        return self.cursor.fetchall()
+
+    @check
+    def was_played_since(self, spotify_id: str, since: int):
+
+        self.flush_plays()
+        sql = f"SELECT 1 FROM {self.tracks_tb} AS tracks JOIN {self.plays_tb} AS plays " \
+              f"ON plays.track_id = tracks.track_id AND plays.played_at >= ? WHERE tracks.spotify_id = ? LIMIT 1"
+        self.cursor.execute(sql, (since, spotify_id))
+        return self.cursor.fetchone() is not None
+
+    # as (track, artist, link, plays), most played first
+    @check
+    def get_most_played(self, limit: int = 10):
+
+        self.flush_plays()
+        sql = f"SELECT tracks.track, tracks.artist, tracks.link, counts.plays FROM " \
+              f"(SELECT track_id, COUNT(*) AS plays FROM {self.plays_tb} GROUP BY track_id) AS counts " \
+              f"JOIN {self.tracks_tb} AS tracks ON tracks.track_id = counts.track_id " \
+              f"ORDER BY counts.plays DESC LIMIT ?"
+        self.cursor.execute(sql, (limit,))
+        return self.cursor.fetchall()
+
+    # stores a Spotify.get_track_details dict for the track cache
+    @check
+    def cache_track(self, details: dict, cached_at: float):
+
+        sql = f"INSERT INTO {self.tracks_tb} (spotify_id, track, artist, link, uri, duration_ms, cached_at) " \
+              f"VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (spotify_id) DO UPDATE SET track = excluded.track, " \
+              f"artist = excluded.artist, link = excluded.link, uri = excluded.uri, " \
+              f"duration_ms = excluded.duration_ms, cached_at = excluded.cached_at"
+        self.cursor.execute(sql, (details['id'], details['track'], details['artist'], details['link'],
+                                  details['uri'], details['duration_ms'], int(cached_at)))
+        self.commit()
+
+    # the newest limit tracks cached since the given time, as (details, cached_at) oldest first
+    @check
+    def get_cached_tracks(self, limit: int, since: float):
+
+        sql = f"SELECT spotify_id, track, artist, link, uri, duration_ms, cached_at FROM {self.tracks_tb} " \
+              f"WHERE cached_at >= ? ORDER BY cached_at DESC LIMIT ?"
+        self.cursor.execute(sql, (int(since), limit))
+        tracks = [({'track': track, 'artist': artist, 'link': link, 'id': spotify_id,
+                    'uri': uri, 'duration_ms': duration_ms}, cached_at)
+                  for spotify_id, track, artist, link, uri, duration_ms, cached_at in self.cursor.fetchall()]
+        tracks.reverse()
+        return tracks
 
     @check
     def delete_all(self):
+        self.pending_counters = {}
+        self.pending_plays = []
         self.cursor.execute(f"DELETE FROM {self.queue_tb}")
         self.cursor.execute(f"DELETE FROM {self.user_tb}")
+        self.roles = {}
         self.cursor.execute(f"DELETE FROM {self.leaderboard_reset}")
-        self.db.commit()
+        self.cursor.execute(f"DELETE FROM {self.stats_tb}")
+        self.cursor.execute(f"DELETE FROM {self.epoch_tb}")
+        self.cursor.execute(f"DELETE FROM {self.plays_tb}")
+        self.cursor.execute(f"DELETE FROM {self.tracks_tb}")
+        self.cursor.execute(f"DELETE FROM {self.timeouts_tb}")
+        self.commit()
+        self.load_epoch()
+        self.queue = []
+        self.queued_ids = {}
+        self.queue_changed()
+        self.leaderboard_changed()
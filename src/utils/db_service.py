@@ -0,0 +1,73 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.db_handler import DB
+from utils.logger import Log
+from utils.event_bus import EventBus
+
+
+# owns the single DB connection on a dedicated worker thread and gives both bots
+# an awaitable API, e.g. await db.is_user_banned(user). Calls run one at a time on
+# the worker so neither bot's event loop ever waits on sqlite (or an fsync) itself.
+class DBService:
+    def __init__(self, log: Log, db_path: str = './data/app.sqlite', bus: EventBus = None):
+        self.log = log
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+        # the connection is created on the worker so it is only ever used from that thread
+        self._db: DB = self._executor.submit(DB, log, db_path, bus).result()
+        # flushes buffered chat counters and plays even when no new writes come in to trigger it
+        self._closed = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_writes_loop, name='db-flush', daemon=True)
+        self._flusher.start()
+
+    def _flush_writes_loop(self):
+        while not self._closed.wait(self._db.counter_flush_interval):
+            self.submit_write(DB.flush_writes)
+
+    def submit(self, func: callable, *args, **kwargs):
+        # runs func(db, *args, **kwargs) on the worker thread, returns a concurrent future
+        return self._executor.submit(func, self._db, *args, **kwargs)
+
+    def submit_write(self, func: callable, *args, **kwargs):
+        # for writes nobody waits on, a failure is logged instead of staying in the dropped future
+        future = self.submit(func, *args, **kwargs)
+        future.add_done_callback(functools.partial(self._log_failure, func))
+        return future
+
+    def _log_failure(self, func: callable, future):
+        if future.cancelled():
+            return
+        er = future.exception()
+        if er is not None:
+            self.log.error(f'Background {func.__name__} failed: {er!r}')
+
+    async def run(self, func: callable, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+
+    def run_blocking(self, func: callable, *args, **kwargs):
+        # for start up code that runs before the bots' event loops exist
+        return self.submit(func, *args, **kwargs).result()
+
+    @property
+    def queue_version(self):
+        # a plain int read, safe without going through the worker
+        return self._db.queue_version
+
+    def __getattr__(self, name):
+        method = getattr(DB, name)
+        if not callable(method):
+            raise AttributeError(name)
+
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            return await self.run(method, *args, **kwargs)
+
+        return wrapper
+
+    def close(self):
+        # stop the flusher first, DB.close flushes whatever is still pending
+        self._closed.set()
+        self._flusher.join()
+        self.run_blocking(DB.close)
+        self._executor.shutdown(wait=True)
@@ -80,3 +80,6 @@ class BadLink(Exception):
 class BadPerms(Exception):
     def __init__(self, perm: str):
         self.perm = perm
+
+class RequestDropped(Exception):
+    pass
@@ -0,0 +1,62 @@
+import asyncio
+import threading
+
+QUEUE_CHANGED = 'queue_changed'
+PLAYBACK_CHANGED = 'playback_changed'
+LEADERBOARD_CHANGED = 'leaderboard_changed'
+
+
+# a subscription belongs to the event loop it was made on, publishers on any
+# thread hand events over to that loop. Events that arrive between two waits
+# are coalesced, so a burst of changes wakes the subscriber once.
+class Subscription:
+    def __init__(self, bus, events: set, loop: asyncio.AbstractEventLoop):
+        self.bus = bus
+        self.events = events
+        self.loop = loop
+        self._pending = set()
+        self._ready = asyncio.Event()
+        # the first wait returns straight away so subscribers can draw the current state
+        self._ready.set()
+
+    def _notify(self, event: str):
+        self._pending.add(event)
+        self._ready.set()
+
+    async def wait(self) -> set:
+        await self._ready.wait()
+        self._ready.clear()
+        events = self._pending
+        self._pending = set()
+        return events
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = []
+
+    def subscribe(self, *events: str) -> Subscription:
+        # must be called from inside the subscriber's event loop
+        subscription = Subscription(self, set(events), asyncio.get_running_loop())
+        with self._lock:
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def publish(self, event: str):
+        with self._lock:
+            subscriptions = [sub for sub in self._subscriptions if event in sub.events]
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._notify, event)
+            except RuntimeError:
+                # the subscriber's loop has been closed
+                self.unsubscribe(subscription)
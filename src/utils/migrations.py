@@ -0,0 +1,153 @@
+import sqlite3
+import time
+from utils.logger import Log
+
+# ordered schema changes, each one runs once per database and is recorded in schema_version.
+# Steps only use IF (NOT) EXISTS / OR IGNORE statements, so a database that already has
+# part of a change (from before schema_version existed) is brought up to date safely.
+migrations = []
+
+
+def migration(version: int, name: str):
+    def wrapper(step: callable):
+        migrations.append((version, name, step))
+        migrations.sort(key=lambda m: m[0])
+        return step
+    return wrapper
+
+
+def latest_version():
+    return migrations[-1][0] if migrations else 0
+
+
+# runs every pending migration inside a single transaction, returns the schema version.
+# When nothing is pending this is one small read.
+def migrate(db: sqlite3.Connection, log: Log):
+    cursor = db.cursor()
+    cursor.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY, name TEXT, applied INT)')
+    cursor.execute('SELECT MAX(version) FROM schema_version')
+    current = cursor.fetchone()[0] or 0
+    pending = [m for m in migrations if m[0] > current]
+    if len(pending) == 0:
+        return current
+
+    # sqlite3 doesn't open a transaction for CREATE/DROP on its own, so start one explicitly
+    cursor.execute('BEGIN')
+    try:
+        for version, name, step in pending:
+            step(cursor)
+            cursor.execute('INSERT INTO schema_version (version, name, applied) VALUES (?, ?, ?)',
+                           (version, name, int(time.time())))
+            log.info(f'Applied migration {version}: {name}')
+        db.commit()
+    except Exception as er:
+        db.rollback()
+        log.error(f'Migration failed, schema left at version {current}: {er}')
+        raise
+    return pending[-1][0]
+
+
+# copies rows in batches of batch_size, walking the source by rowid so a large table is
+# never held in memory at once. select_sql must select rowid first and take (last rowid, limit),
+# insert_sql gets the remaining columns.
+def backfill(cursor: sqlite3.Cursor, select_sql: str, insert_sql: str, batch_size: int = 1000, params: tuple = ()):
+    last = 0
+    copied = 0
+    while True:
+        cursor.execute(select_sql, (*params, last, batch_size))
+        rows = cursor.fetchall()
+        if len(rows) == 0:
+            return copied
+        cursor.executemany(insert_sql, [row[1:] for row in rows])
+        copied += len(rows)
+        last = rows[-1][0]
+
+
+# ADD COLUMN has no IF NOT EXISTS, so only columns the table doesn't have yet are added
+def add_columns(cursor: sqlite3.Cursor, table: str, columns: tuple):
+    cursor.execute(f'PRAGMA table_info({table})')
+    existing = [row[1] for row in cursor.fetchall()]
+    for column, column_type in columns:
+        if column not in existing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+
+
+@migration(1, 'base tables')
+def base_tables(cursor: sqlite3.Cursor):
+    cursor.execute(
+        'CREATE TABLE IF NOT EXISTS users (username VARCHAR(50) NOT NULL, ban TINYINT, moderator TINYINT, administrator TINYINT, \
+        requests SMALLINT, rates SMALLINT, rates_given SMALLINT, PRIMARY KEY (username))')
+    cursor.execute(
+        'CREATE TABLE IF NOT EXISTS queue (request_id INTEGER PRIMARY KEY AUTOINCREMENT, pos SMALLINT, track TEXT, artist TEXT, \
+        requester VARCHAR(50), link TEXT)')
+    cursor.execute(
+        'CREATE TABLE IF NOT EXISTS lb_reset (win_id INTEGER PRIMARY KEY AUTOINCREMENT, winner VARCHAR(50), date INT, next_reset_date INT, sp_mod_given TINYINT, \
+        win_active TINYINT DEFAULT 1)')
+    # queue is loaded in pos order
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_queue_pos ON queue (pos)')
+
+
+@migration(2, 'leaderboard epochs')
+def leaderboard_epochs(cursor: sqlite3.Cursor):
+    cursor.execute('CREATE TABLE IF NOT EXISTS lb_epoch (epoch INTEGER PRIMARY KEY AUTOINCREMENT, started INT)')
+    cursor.execute(
+        'CREATE TABLE IF NOT EXISTS user_stats (username VARCHAR(50) NOT NULL, epoch INTEGER NOT NULL, \
+        requests INTEGER DEFAULT 0, rates INTEGER DEFAULT 0, rates_given INTEGER DEFAULT 0, PRIMARY KEY (username, epoch))')
+    # a period's leaderboard is read in rates order so (epoch, rates, username) covers it
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_stats_rates ON user_stats (epoch, rates, username)')
+    cursor.execute('SELECT MAX(epoch) FROM lb_epoch')
+    if cursor.fetchone()[0] is not None:
+        return
+    # counters kept on the users table before epochs become the first period
+    cursor.execute('INSERT INTO lb_epoch (started) VALUES (?)', (int(time.time()),))
+    epoch = cursor.lastrowid
+    backfill(cursor,
+             'SELECT rowid, username, ?, requests, rates, rates_given FROM users '
+             'WHERE rowid > ? AND (requests > 0 OR rates > 0 OR rates_given > 0) ORDER BY rowid LIMIT ?',
+             'INSERT OR IGNORE INTO user_stats (username, epoch, requests, rates, rates_given) VALUES (?, ?, ?, ?, ?)',
+             params=(epoch,))
+
+
+@migration(3, 'play log')
+def play_log(cursor: sqlite3.Cursor):
+    # tracks are stored once per spotify id, the play log only references them by track_id
+    cursor.execute(
+        'CREATE TABLE IF NOT EXISTS tracks (track_id INTEGER PRIMARY KEY, spotify_id TEXT NOT NULL UNIQUE, \
+        track TEXT, artist TEXT, link TEXT)')
+    cursor.execute(
+        'CREATE TABLE IF NOT EXISTS plays (play_id INTEGER PRIMARY KEY AUTOINCREMENT, track_id INTEGER NOT NULL, \
+        requester VARCHAR(50), played_at INT)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_plays_track ON plays (track_id, played_at)')
+
+
+@migration(4, 'drop unused indexes')
+def drop_unused_indexes(cursor: sqlite3.Cursor):
+    # the queue is searched in memory and the leaderboard is read from user_stats now
+    cursor.execute('DROP INDEX IF EXISTS idx_queue_track_artist')
+    cursor.execute('DROP INDEX IF EXISTS idx_users_rates')
+
+
+@migration(5, 'queue track ids and durations')
+def queue_track_details(cursor: sqlite3.Cursor):
+    add_columns(cursor, 'queue', (('track_id', 'TEXT'), ('uri', 'TEXT'), ('duration_ms', 'INTEGER DEFAULT 0')))
+    # requests queued before this only have the link, the id is its last path segment
+    cursor.execute('SELECT request_id, link FROM queue WHERE track_id IS NULL AND link IS NOT NULL')
+    ids = [(link.split('/')[-1].split('?')[0], request_id) for request_id, link in cursor.fetchall()]
+    cursor.executemany("UPDATE queue SET track_id = ?1, uri = 'spotify:track:' || ?1 WHERE request_id = ?2", ids)
+
+
+@migration(6, 'track cache columns')
+def track_cache_columns(cursor: sqlite3.Cursor):
+    # lets tracks double as the persistent side of the track metadata cache
+    add_columns(cursor, 'tracks', (('uri', 'TEXT'), ('duration_ms', 'INTEGER'), ('cached_at', 'INT')))
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tracks_cached_at ON tracks (cached_at)')
+
+
+@migration(7, 'timeouts')
+def timeouts(cursor: sqlite3.Cursor):
+    # sp-timeout unbans, kept in the db so they still happen after a restart
+    cursor.execute(
+        'CREATE TABLE IF NOT EXISTS timeouts (username VARCHAR(50) NOT NULL, expires_at INT NOT NULL, \
+        issued_by VARCHAR(50), PRIMARY KEY (username))')
+    # the scheduler only ever asks for the earliest expiry and everything that is due
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_timeouts_expires ON timeouts (expires_at)')
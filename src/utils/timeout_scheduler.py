@@ -0,0 +1,58 @@
+import time
+from utils.async_timer import Timer
+from utils.db_service import DBService
+from utils.logger import Log
+
+
+# unbans timed out users when their timeout ends. Timeouts are rows in the db, and a single
+# Timer is armed for the earliest expires_at. When it fires every timeout due by then is
+# lifted in one transaction and the timer is armed for the next one, so a restart only
+# has to read the earliest expiry back to carry on where it left off. If the db fails the
+# due timeouts are left in the table and tried again retry_backoff seconds later.
+class TimeoutScheduler:
+    def __init__(self, db: DBService, log: Log, clock: callable = time.time, retry_backoff: float = 30):
+        self.db = db
+        self.log = log
+        self.clock = clock
+        self.retry_backoff = retry_backoff
+        self.timer = None
+        self.next_expiry = None
+
+    async def start(self):
+        # anything that expired while the bot was down is unbanned straight away
+        await self.expire()
+
+    def stop(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.next_expiry = None
+
+    async def add(self, username: str, seconds: float, issued_by: str = None):
+        expires_at = int(self.clock() + seconds)
+        await self.db.timeout_user(username, expires_at, issued_by)
+        if self.next_expiry is None or expires_at < self.next_expiry:
+            self.arm(expires_at)
+        return expires_at
+
+    def arm(self, expires_at):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.next_expiry = expires_at
+        if expires_at is None:
+            return
+        self.timer = Timer(max(expires_at - self.clock(), 0) * 1000, self.expire)
+
+    async def expire(self):
+        try:
+            unbanned = await self.db.expire_timeouts(int(self.clock()))
+            next_expiry = await self.db.get_next_timeout()
+        except Exception as er:
+            # the timeouts are still due, arming for them now would retry straight away
+            self.log.error(f'Failed to lift timeouts, retrying in {self.retry_backoff}s: {er}')
+            self.arm(self.clock() + self.retry_backoff)
+            return
+        for username in unbanned:
+            self.log.info(f'Timeout ended for {username}')
+        self.arm(next_expiry)
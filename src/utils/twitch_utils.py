@@ -1,8 +1,8 @@
 from utils.errors import TimeNotFound, TargetNotFound
-from utils.db_handler import DB
+from utils.db_service import DBService
 
 
-def target_finder(db: DB, request: str) -> str:
+async def target_finder(db: DBService, request: str) -> str:
     words = request.split(' ')
     for word in words:
         if word.startswith('@'):
@@ -11,7 +11,7 @@ def target_finder(db: DB, request: str) -> str:
             target = target.strip('\n')
             target = target.strip('\r')
             target = target.strip(' ')
-            db.check_user_exists(target)
+            await db.check_user_exists(target)
             return target
     raise TargetNotFound
 
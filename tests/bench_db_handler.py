@@ -0,0 +1,96 @@
+import os
+import sys
+import sqlite3
+import tempfile
+import time
+path_src = os.path.abspath('./src')
+sys.path.insert(1, path_src)
+import utils.db_handler as db_handler
+from utils.logger import Log
+
+# Compares executing the !sr / !rate hot path statements as f-strings, escaped the way the old
+# check decorator did, with executing them with bound parameters, which reuses sqlite3's
+# statement cache instead of parsing a new string every time. Only cursor.execute is timed,
+# each style gets a fresh database with the app's schema so neither sees the other's rows.
+# run from the repo root: python tests/bench_db_handler.py
+
+ITERATIONS = 5000
+USERS = 200
+
+
+def escape(item):
+    # the escaping pass the old check decorator ran over every string argument
+    item = item.replace("'", "''")
+    item = item.replace('"', '""')
+    item = item.replace('&', '')
+    item = item.replace('--', '')
+    return item
+
+
+def formatted(i):
+    user = escape(f"chatter{i % USERS}")
+    track = escape(f"track {i}")
+    link = escape(f'https://open.spotify.com/track/{i}')
+    return [(f"SELECT ban FROM users WHERE username = '{user}'", ()),
+            (f"SELECT 1 FROM queue WHERE track = '{track}' AND artist = 'artist'", ()),
+            (f"INSERT INTO queue (requester, track, link, artist, pos) "
+             f"VALUES ('{user}', '{track}', '{link}', 'artist', {i})", ()),
+            (f"UPDATE users SET requests = requests + 1 WHERE username = '{user}'", ())]
+
+
+def bound(i):
+    user = f"chatter{i % USERS}"
+    track = f"track {i}"
+    return [("SELECT ban FROM users WHERE username = ?", (user,)),
+            ("SELECT 1 FROM queue WHERE track = ? AND artist = ?", (track, 'artist')),
+            ("INSERT INTO queue (requester, track, link, artist, pos) VALUES (?, ?, ?, ?, ?)",
+             (user, track, f'https://open.spotify.com/track/{i}', 'artist', i)),
+            ("UPDATE users SET requests = requests + 1 WHERE username = ?", (user,))]
+
+
+def new_db(tmp, name, log):
+    # the schema and users come from DB itself, the timed statements run on a bare connection
+    db_path = os.path.join(tmp, name)
+    db = db_handler.DB(log, db_path)
+    for i in range(USERS):
+        db.init_user(f"chatter{i}")
+    db.close()
+    conn = sqlite3.connect(db_path)
+    # fsync cost would drown out the parse/execute cost being measured
+    conn.execute('PRAGMA synchronous = OFF')
+    return conn
+
+
+def run(conn, statements):
+    cursor = conn.cursor()
+    # building the statements (and escaping) is left out, only what sqlite does with them is timed
+    batches = [statements(i) for i in range(ITERATIONS)]
+    elapsed = 0.0
+    for i, batch in enumerate(batches):
+        start = time.perf_counter()
+        for sql, params in batch:
+            cursor.execute(sql, params)
+            cursor.fetchall()
+        elapsed += time.perf_counter() - start
+        if i % 100 == 0:
+            # keep the queue as short as a real one, otherwise scanning it for the track dominates
+            cursor.execute("DELETE FROM queue")
+    conn.commit()
+    conn.close()
+    return elapsed
+
+
+def main():
+    log = Log('bench', False, False, file=os.path.join(tempfile.gettempdir(), 'sbotify-bench.log'))
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = run(new_db(tmp, 'formatted.sqlite', log), formatted)
+        current = run(new_db(tmp, 'bound.sqlite', log), bound)
+
+    print(f'{ITERATIONS} hot path iterations, {len(bound(0))} statements each')
+    print(f'formatted sql:    {legacy * 1000:.1f} ms ({legacy / ITERATIONS * 1e6:.1f} us/iter)')
+    print(f'bound parameters: {current * 1000:.1f} ms ({current / ITERATIONS * 1e6:.1f} us/iter)')
+    print(f'speedup: {legacy / current:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
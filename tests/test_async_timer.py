@@ -0,0 +1,65 @@
+import unittest
+import asyncio
+import os
+import sys
+path_src = os.path.abspath('./src')
+sys.path.insert(1, path_src)
+from utils.async_timer import Timer, TimerService
+
+
+class TestTimer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.fired = []
+        self.loop = asyncio.get_running_loop()
+
+    async def record(self, name):
+        self.fired.append((name, self.loop.time()))
+
+    async def test_timers_fire_in_deadline_order(self):
+        start = self.loop.time()
+        Timer(30, self.record, ['third'])
+        Timer(10, self.record, ['first'])
+        Timer(20, self.record, ['second'])
+        await asyncio.sleep(0.06)
+        self.assertEqual(['first', 'second', 'third'], [name for name, _ in self.fired])
+        # millisecond resolution, give or take the loop's clock granularity
+        for (name, at), expected in zip(self.fired, (0.01, 0.02, 0.03)):
+            self.assertAlmostEqual(expected, at - start, delta=0.01)
+
+    async def test_cancel(self):
+        timer = Timer(10, self.record, ['cancelled'])
+        Timer(20, self.record, ['kept'])
+        service = TimerService.current()
+        self.assertEqual(2, service.pending())
+        timer.cancel()
+        timer.cancel()
+        self.assertEqual(1, service.pending())
+        await asyncio.sleep(0.04)
+        self.assertEqual(['kept'], [name for name, _ in self.fired])
+        self.assertEqual(0, service.pending())
+        self.assertIsNone(service.next_deadline())
+
+    async def test_earlier_timer_wakes_the_service(self):
+        Timer(10000, self.record, ['later'])
+        Timer(10, self.record, ['sooner'])
+        await asyncio.sleep(0.03)
+        self.assertEqual(['sooner'], [name for name, _ in self.fired])
+        service = TimerService.current()
+        self.assertAlmostEqual(10, service.next_deadline() - self.loop.time(), delta=0.1)
+
+    async def test_thousands_of_timers_share_one_task(self):
+        tasks_before = len(asyncio.all_tasks())
+        timers = [Timer(86400000 + i, self.record, [i]) for i in range(5000)]
+        service = TimerService.current()
+        self.assertEqual(5000, service.pending())
+        self.assertLessEqual(len(asyncio.all_tasks()), tasks_before + 1)
+        for timer in timers[:4000]:
+            timer.cancel()
+        # cancelled timers are swept out of the heap once they make up most of it
+        self.assertEqual(1000, service.pending())
+        self.assertLess(len(service.heap), 2000)
+        self.assertAlmostEqual(86400 + 4, service.stats()['next_in'], delta=0.1)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=1)
@@ -0,0 +1,65 @@
+import unittest
+import asyncio
+import os
+import sys
+import time
+path_src = os.path.abspath('./src')
+sys.path.insert(1, path_src)
+from AudioController.audio_controller import AudioController, Context
+from utils.db_service import DBService
+from utils.db_handler import DB
+from utils.logger import Log
+
+logger = Log('test', True, False)
+
+
+class TestHistory(unittest.TestCase):
+    def test_history_is_bounded_and_matched_by_id(self):
+        context = Context()
+        ac = AudioController(None, None, context, logger, history_size=3)
+        for i in range(5):
+            ac.add_to_history(f'id{i}', f'user{i}')
+        self.assertEqual(['id2', 'id3', 'id4'], list(ac.history))
+        # re-adding a track makes it the newest again
+        ac.add_to_history('id2', 'user5')
+        ac.add_to_history('id6', 'user6')
+        self.assertEqual(['id4', 'id2', 'id6'], list(ac.history))
+
+        context.playback_id = 'id3'
+        self.assertFalse(ac.check_history())
+        context.playback_id = 'id2'
+        self.assertTrue(ac.check_history())
+        self.assertEqual(('user5', True), (context.requester, context.playing_queue))
+        self.assertNotIn('id2', ac.history)
+
+    def test_set_requester_follows_the_poller(self):
+        context = Context()
+        # no spotify session, the playing track comes from the polled context
+        ac = AudioController(None, None, context, logger)
+        track_info = (1, 0, 'track', 'artist', 'user1', 'https://open.spotify.com/track/id1', 'id1', None)
+        context.playback_id = 'id0'
+        asyncio.run(ac.set_requester(track_info))
+        self.assertIsNone(context.requester)
+        context.playback_id = 'id1'
+        asyncio.run(ac.set_requester(track_info))
+        self.assertEqual(('user1', True), (context.requester, context.playing_queue))
+
+    def test_history_survives_restart(self):
+        service = DBService(logger, './data/test_history.sqlite')
+        service.run_blocking(DB.delete_all)
+        for i in range(4):
+            service.run_blocking(DB.log_play, f'id{i}', 'track', 'artist', f'https://open.spotify.com/track/id{i}',
+                                 f'user{i}')
+        # playlist tracks have no requester
+        service.run_blocking(DB.log_play, 'playlist', 'track', 'artist', 'link')
+
+        ac = AudioController(service, None, Context(), logger, history_size=3)
+        self.assertEqual({'id1': 'user1', 'id2': 'user2', 'id3': 'user3'}, dict(ac.history))
+        self.assertEqual(['id1', 'id2', 'id3'], list(ac.history))
+        self.assertEqual([], service.run_blocking(DB.get_recent_requesters, 10, time.time() + 60))
+        service.run_blocking(DB.delete_all)
+        service.close()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=1)
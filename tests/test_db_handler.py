@@ -1,9 +1,13 @@
 import unittest
+import asyncio
 import os
 import sys
+import threading
+import time
 path_src = os.path.abspath('./src')
 sys.path.insert(1, path_src)
 import utils.db_handler as db_handler
+from utils.db_service import DBService
 from utils.logger import Log
 from utils.errors import *
 
@@ -97,6 +101,118 @@ class TestDbHandler(unittest.TestCase):
         db.clear_queue()
         self.assertEqual([], db.get_queue())
         self.assertIsNone(db.get_req_id_by_track_name('NotATrack'))
+
+    def test_queue_requester_object(self):
+        # discord's /queue passes a user object rather than a name
+        class Member:
+            def __str__(self):
+                return 'discordUser'
+
+        self.assertTrue(db.add_to_queue(Member(), 'track1', 'link', 'artist'))
+        self.assertEqual('discordUser', db.get_queue()[0][4])
+        db.load_queue()
+        self.assertEqual('discordUser', db.get_queue()[0][4])
+
+    def test_queue_changes_touch_one_row(self):
+        for i in range(100):
+            db.add_to_queue('requester', f'track{i}', 'link', 'artist')
+        track50_id = db.get_req_id_by_track_name('track50')
+
+        changes = db.db.total_changes
+        db.add_to_queue('requester', 'appended', 'link', 'artist')
+        db.move_request_pos(track50_id)
+        db.remove_from_queue_by_id(db.get_queue()[1][0])
+        db.remove_from_queue_by_info('track99', 'artist')
+        self.assertEqual(4, db.db.total_changes - changes)
+
+        queue = db.get_queue()
+        self.assertEqual(list(range(1, 100)), [req[1] for req in queue])
+        self.assertEqual('track50', queue[0][2])
+        self.assertEqual('track1', queue[1][2])
+        self.assertEqual('appended', queue[-1][2])
+
+    def test_queue_version_and_head(self):
+        self.assertIsNone(db.get_queue_head())
+        version = db.queue_version
+        db.add_to_queue('requester', 'track1', 'link1', 'artist')
+        db.add_to_queue('requester2', 'track2', 'link2', 'artist')
+        self.assertEqual(version + 2, db.queue_version)
+        head = db.get_queue_head()
+        self.assertEqual(db.get_queue()[0], head[:6])
+        self.assertEqual('track1', head[2])
+
+        # reads and failed changes leave the version alone
+        version = db.queue_version
+        db.get_queue()
+        db.is_track_in_queue('track1', 'artist')
+        db.move_request_pos(-1)
+        db.remove_from_queue_by_id(-1)
+        self.assertEqual(version, db.queue_version)
+
+        db.move_request_pos(db.get_req_id_by_track_name('track2'))
+        self.assertEqual(version + 1, db.queue_version)
+        self.assertEqual('track2', db.get_queue_head()[2])
+
+        # the in memory queue is written through, a fresh connection loads the same queue
+        reloaded = db_handler.DB(log=logger, db_path='./data/test.sqlite')
+        self.assertEqual(db.get_queue(), reloaded.get_queue())
+        reloaded.close()
+
+    def test_queue_insert_between(self):
+        db.add_to_queue('requester', 'track1', 'link', 'artist')
+        db.add_to_queue('requester', 'track3', 'link', 'artist')
+        db.add_to_queue('requester', 'track2', 'link', 'artist', pos=2)
+        db.add_to_queue('requester', 'track0', 'link', 'artist', pos=1)
+        db.add_to_queue('requester', 'track4', 'link', 'artist', pos=50)
+        self.assertEqual(['track0', 'track1', 'track2', 'track3', 'track4'], [req[2] for req in db.get_queue()])
+        # keep inserting at the same spot until the gap runs out and the queue is spaced out again
+        for i in range(40):
+            db.add_to_queue('requester', f'squeezed{i}', 'link', 'artist', pos=2)
+        tracks = [req[2] for req in db.get_queue()]
+        self.assertEqual(['track0', 'squeezed39', 'squeezed38'], tracks[:3])
+        self.assertEqual(['squeezed0', 'track1', 'track2', 'track3', 'track4'], tracks[-5:])
+        track3_id = db.get_req_id_by_track_name('track3')
+        db.move_request_pos(track3_id, 2)
+        self.assertEqual(['track0', 'track3', 'squeezed39'], [req[2] for req in db.get_queue()[:3]])
+
+    def test_queue_track_ids_and_etas(self):
+        db.add_to_queue('requester', 'track1', 'https://open.spotify.com/track/id1', 'artist',
+                        track_id='id1', uri='spotify:track:id1', duration_ms=200000)
+        db.add_to_queue('requester', 'track2', 'https://open.spotify.com/track/id2', 'artist',
+                        track_id='id2', uri='spotify:track:id2', duration_ms=180000)
+        db.add_to_queue('requester', 'track3', 'https://open.spotify.com/track/id3', 'artist', pos=1,
+                        track_id='id3', uri='spotify:track:id3', duration_ms=100000)
+        self.assertTrue(db.is_track_id_in_queue('id2'))
+        self.assertFalse(db.is_track_id_in_queue('id4'))
+        self.assertEqual(('id3', 'spotify:track:id3', 100000), db.get_queue_head()[6:])
+        self.assertEqual(480000, db.get_queue_duration())
+        ids = [req[0] for req in db.get_queue()]
+        self.assertEqual(list(zip(ids, [0, 100000, 300000])), db.get_queue_etas())
+        self.assertEqual(300000, db.get_request_eta(ids[2]))
+
+        db.remove_from_queue_by_id(ids[0])
+        self.assertFalse(db.is_track_id_in_queue('id3'))
+        self.assertEqual(380000, db.get_queue_duration())
+        self.assertEqual(200000, db.get_request_eta(ids[2]))
+        # ids and durations come back with the queue
+        db.load_queue()
+        self.assertTrue(db.is_track_id_in_queue('id1'))
+        self.assertEqual(380000, db.get_queue_duration())
+
+    def test_special_characters_round_trip(self):
+        # values are bound as parameters so they are stored exactly as given
+        track = "Don't Stop Me Now -- Live & \"Remastered\""
+        artist = "Guns N' Roses & Friends"
+        db.init_user("o'reilly--&")
+        self.assertTrue(db.check_user_exists("o'reilly--&"))
+        db.add_requests("o'reilly--&")
+        self.assertEqual(1, db.get_user_stats("o'reilly--&")['requests'])
+        db.add_to_queue("o'reilly--&", track, 'link', artist)
+        self.assertTrue(db.is_track_in_queue(track, artist))
+        self.assertEqual("o'reilly--&", db.get_requester(track, artist))
+        self.assertEqual(track, db.get_queue()[0][2])
+        self.assertTrue(db.remove_from_queue_by_info(track, artist))
+        self.assertFalse(db.is_track_in_queue(track, artist))
     
     def test_db_leaderboard(self):
         for i in range(100):
@@ -114,9 +230,328 @@ class TestDbHandler(unittest.TestCase):
         db.add_leaderboard_winner('dbleaderboarduser99', 1000, 1000, False)
         winner_db_entry = db.get_last_reset()
         self.assertEqual(winner_db_entry[1], 'dbleaderboarduser99')
+
+    def test_counters_are_group_committed(self):
+        db.init_user('bufferedReceiver')
+        db.init_user('bufferedGiver')
+        interval = db.counter_flush_interval
+        db.counter_flush_interval = 60
+        try:
+            for _ in range(20):
+                db.add_rate('bufferedReceiver', 'bufferedGiver')
+                db.add_requests('bufferedGiver')
+            # increments are coalesced per user and nothing has been written yet
+            self.assertEqual(2, len(db.pending_counters))
+            stored = db.cursor.execute("SELECT rates FROM user_stats WHERE username = 'bufferedReceiver'").fetchone()
+            self.assertIsNone(stored)
+            # reads still see the pending increments
+            self.assertEqual(20, db.get_user_stats('bufferedReceiver')['rates'])
+            self.assertEqual(20, db.get_user_stats('bufferedGiver')['rates given'])
+            self.assertEqual(20, db.get_user_stats('bufferedGiver')['requests'])
+            self.assertEqual(0, len(db.pending_counters))
+        finally:
+            db.counter_flush_interval = interval
+
+    def test_counters_flush_at_size_threshold(self):
+        for i in range(db.counter_flush_size):
+            db.init_user(f'thresholdUser{i}')
+        interval = db.counter_flush_interval
+        db.counter_flush_interval = 60
+        try:
+            for i in range(db.counter_flush_size):
+                db.add_requests(f'thresholdUser{i}')
+            self.assertEqual(0, len(db.pending_counters))
+            stored = db.cursor.execute("SELECT SUM(requests) FROM user_stats WHERE epoch = ?", (db.epoch,)).fetchone()
+            self.assertEqual(db.counter_flush_size, stored[0])
+        finally:
+            db.counter_flush_interval = interval
+
+    def test_leaderboard_fits_field_limit(self):
+        # 40 character names, 24 of them plus separators would be 1029 characters
+        for i in range(60):
+            db.init_user(f'{i:02d}'.ljust(40, 'x'), rates=100 - i)
+        sorted_position, sorted_users, sorted_rates = db.get_leaderboard()
+        users = sorted_users.split(' \n ')
+        self.assertLessEqual(len(sorted_users), 1024)
+        self.assertEqual(23, len(users))
+        self.assertEqual(23, len(sorted_rates.split(' \n ')))
+        self.assertEqual('23', sorted_position.split(' \n ')[-1])
+        self.assertEqual('22'.ljust(40, 'x'), users[-1])
+
+    def test_leaderboard_is_memoized(self):
+        db.init_user('memoReceiver', rates=1)
+        db.init_user('memoGiver')
+        first = db.get_leaderboard()
+        self.assertIs(first, db.get_leaderboard())
+        db.add_rate('memoReceiver', 'memoGiver')
+        second = db.get_leaderboard()
+        self.assertIsNot(first, second)
+        self.assertEqual('2', second[2])
+        # a different limit is its own result, not the one cached for the default
+        db.init_user('memoOther', rates=3)
+        self.assertEqual('memoOther', db.get_leaderboard(limit=1)[1])
+        self.assertEqual(['memoOther', 'memoReceiver'], db.get_leaderboard()[1].split())
+
+    def test_user_stats_position_ties(self):
+        db.init_user('firstUser', rates=10)
+        db.init_user('tiedUser', rates=10)
+        db.init_user('thirdUser', rates=5)
+        db.init_user('noRatesUser')
+        # users on the same number of rates share a position and the next position is skipped
+        self.assertEqual(1, db.get_user_stats('firstUser')['pos'])
+        self.assertEqual(1, db.get_user_stats('tiedUser')['pos'])
+        self.assertEqual(3, db.get_user_stats('thirdUser')['pos'])
+        self.assertEqual(4, db.get_user_stats('noRatesUser')['pos'])
+        self.assertIsNone(db.get_user_stats('missingUser'))
+
+    def test_role_checks_use_role_index(self):
+        db.init_user('indexedMod', mod=1)
+        db.init_user('indexedUser')
+        statements = []
+        db.db.set_trace_callback(statements.append)
+        try:
+            self.assertTrue(db.check_user_exists('indexedUser'))
+            self.assertTrue(db.is_user_privileged('indexedMod'))
+            self.assertFalse(db.is_user_admin('indexedMod'))
+            self.assertFalse(db.is_user_banned('indexedUser'))
+            self.assertFalse(db.is_user_privileged('notIndexedUser'))
+        finally:
+            db.db.set_trace_callback(None)
+        self.assertEqual([], statements)
+        # the index is written through and matches what a fresh load reads back
+        db.admin_user('indexedUser')
+        db.ban_user('indexedMod')
+        db.update_user('indexedMod', {'moderator': 1})
+        written = dict(db.roles)
+        db.load_roles()
+        self.assertEqual(written, db.roles)
+        self.assertEqual(db.MOD | db.ADMIN, db.roles['indexedUser'])
+        self.assertEqual(db.BAN | db.MOD, db.roles['indexedMod'])
+
+    def test_transaction_commits_once(self):
+        db.init_user('txUser')
+        statements = []
+        db.db.set_trace_callback(statements.append)
+        try:
+            db.admin_user('txUser')
+            with db.transaction():
+                db.update_user('txUser', {'moderator': 0, 'rates': 4, 'requests': 2})
+                db.ban_user('txUser')
+        finally:
+            db.db.set_trace_callback(None)
+        self.assertEqual(2, statements.count('COMMIT'))
+        self.assertTrue(db.is_user_banned('txUser'))
+        self.assertEqual(4, db.get_user_stats('txUser')['rates'])
+
+    def test_transaction_rolls_back(self):
+        db.init_user('rollbackUser')
+        with self.assertRaises(DBError):
+            with db.transaction():
+                db.admin_user('rollbackUser')
+                db.add_to_queue('rollbackUser', 'track1', 'link', 'artist')
+                db.update_user('rollbackUser', {'not_a_column': 1})
+        self.assertFalse(db.is_user_admin('rollbackUser'))
+        self.assertEqual([], db.get_queue())
+        db.load_roles()
+        self.assertFalse(db.is_user_admin('rollbackUser'))
+
+    def test_rollback_keeps_buffered_writes(self):
+        interval = db.counter_flush_interval
+        db.counter_flush_interval = 60
+        try:
+            db.init_user('a')
+            db.init_user('b')
+            db.add_rate('a', 'b')
+            db.log_play('id1', 'track1', 'artist', 'https://open.spotify.com/track/id1', 'a')
+            # the flushes inside the failed transaction are undone, their writes go back in the buffers
+            with self.assertRaises(ValueError):
+                with db.transaction():
+                    db.update_user('b', {'requests': 5})
+                    db.flush_plays()
+                    raise ValueError
+            self.assertEqual(1, db.pending_counters['a'][1])
+            self.assertEqual(1, len(db.pending_plays))
+        finally:
+            db.counter_flush_interval = interval
+        self.assertEqual(1, db.get_user_stats('a')['rates'])
+        self.assertEqual(1, db.get_user_stats('b')['rates given'])
+        self.assertEqual(0, db.get_user_stats('b')['requests'])
+        self.assertEqual('a', db.get_recent_plays(1)[0][3])
+
+    def test_update_roles_bulk(self):
+        db.init_user('bannedImport', ban=1)
+        mod_list = ['bannedImport', 'newImport', 'newImport']
+        db.update_roles(mod_list, {'ban': 0, 'moderator': 1})
+        self.assertTrue(db.is_user_mod('newImport'))
+        self.assertTrue(db.is_user_mod('bannedImport'))
+        self.assertFalse(db.is_user_banned('bannedImport'))
+        stored = db.cursor.execute("SELECT COUNT(*) FROM users WHERE moderator = 1 AND ban = 0").fetchone()
+        self.assertEqual(2, stored[0])
+        with self.assertRaises(DBError):
+            db.update_roles(mod_list, {'rates': 1})
+
+    def test_reset_starts_new_epoch(self):
+        db.init_user('seasonLeader', rates=5, requests=6)
+        db.init_user('seasonGiver')
+        db.add_rate('seasonLeader', 'seasonGiver')
+        first_epoch = db.epoch
+        db.add_rate('seasonLeader', 'seasonGiver')
+        db.flush_counters()
+        db.add_rate('seasonLeader', 'seasonGiver')
+        changes = db.db.total_changes
+        db.reset_all_user_stats()
+        # the buffered rate goes to the ending period, then only the new epoch row is written
+        self.assertEqual(3, db.db.total_changes - changes)
+        self.assertEqual(first_epoch + 1, db.epoch)
+        self.assertEqual(0, db.get_user_stats('seasonLeader')['rates'])
+        self.assertEqual(1, db.get_user_stats('seasonLeader')['pos'])
+        self.assertIsNone(db.get_leader())
+        self.assertEqual('', db.get_leaderboard()[1])
+        # the finished period is still there as history, including what was still buffered
+        self.assertEqual(first_epoch, db.get_epoch(1))
+        last_season = db.get_user_stats('seasonLeader', first_epoch)
+        self.assertEqual(8, last_season['rates'])
+        self.assertEqual(6, last_season['requests'])
+        self.assertEqual(3, db.get_user_stats('seasonGiver', first_epoch)['rates given'])
+        self.assertIsNone(db.get_epoch(2))
+        db.add_rate('seasonGiver', 'seasonLeader')
+        self.assertEqual('seasonGiver', db.get_leader()[0])
+
+    def test_play_log(self):
+        interval = db.counter_flush_interval
+        db.counter_flush_interval = 60
+        try:
+            for i in range(6):
+                db.log_play(f'id{i % 2}', f'track{i % 2}', 'artist', f'https://open.spotify.com/track/id{i % 2}', f'user{i}')
+            # plays are batched like the counters
+            self.assertEqual(6, len(db.pending_plays))
+            self.assertEqual(0, db.cursor.execute("SELECT COUNT(*) FROM plays").fetchone()[0])
+            recent = db.get_recent_plays(3)
+        finally:
+            db.counter_flush_interval = interval
+        self.assertEqual(['user5', 'user4', 'user3'], [play[3] for play in recent])
+        self.assertEqual(('track1', 'artist', 'https://open.spotify.com/track/id1'), recent[0][:3])
+        # repeat plays only reference the track row
+        self.assertEqual(2, db.cursor.execute("SELECT COUNT(*) FROM tracks").fetchone()[0])
+        self.assertEqual(6, db.cursor.execute("SELECT COUNT(*) FROM plays").fetchone()[0])
+        self.assertTrue(db.was_played_since('id0', int(time.time()) - 60))
+        self.assertFalse(db.was_played_since('id0', int(time.time()) + 60))
+        self.assertFalse(db.was_played_since('id2', 0))
+        self.assertEqual([('track0', 3), ('track1', 3)], sorted((play[0], play[3]) for play in db.get_most_played()))
+
+    def test_timeouts(self):
+        for name in ('early', 'late', 'banned'):
+            db.init_user(name)
+        db.timeout_user('early', 100, 'mod')
+        db.timeout_user('late', 200, 'mod')
+        db.timeout_user('banned', 150, 'mod')
+        # a permanent ban replaces the timeout
+        db.ban_user('banned')
+        self.assertTrue(db.is_user_banned('early'))
+        self.assertEqual(100, db.get_next_timeout())
+        self.assertEqual([], db.expire_timeouts(99))
+        self.assertEqual(['early'], db.expire_timeouts(150))
+        self.assertFalse(db.is_user_banned('early'))
+        self.assertTrue(db.is_user_banned('late'))
+        self.assertEqual(200, db.get_next_timeout())
+        self.assertEqual(['late'], db.expire_timeouts(1000))
+        self.assertTrue(db.is_user_banned('banned'))
+        self.assertIsNone(db.get_next_timeout())
+
+    def test_hot_queries_use_indexes(self):
+        for i in range(50):
+            db.init_user(f'planuser{i}', rates=i % 7)
+            db.add_to_queue(f'planuser{i}', f'track{i}', 'link', 'artist')
+            db.timeout_user(f'planuser{i}', 1000 + i)
+
+        # collect the statements (with their bound values) the hot paths actually run
+        statements = []
+        db.db.set_trace_callback(statements.append)
+        try:
+            db.get_queue()
+            db.add_to_queue('planuser1', 'planned', 'link', 'artist')
+            db.move_request_pos(db.get_req_id_by_track_name('track20'))
+            db.remove_from_queue_by_id(db.get_req_id_by_track_name('track21'))
+            db.is_track_in_queue('track10', 'artist')
+            db.get_requester('track11', 'artist')
+            db.remove_from_queue_by_info('track12', 'artist')
+            db.get_leaderboard()
+            db.get_leader()
+            db.get_user_stats('planuser3')
+            db.log_play('planid', 'planned', 'artist', 'link', 'planuser1')
+            db.was_played_since('planid', 0)
+            db.get_next_timeout()
+            db.expire_timeouts(1010)
+        finally:
+            db.db.set_trace_callback(None)
+
+        queries = [sql for sql in statements if sql.startswith(('SELECT', 'UPDATE', 'DELETE'))]
+        self.assertGreater(len(queries), 0)
+        for sql in queries:
+            plan = [row[3] for row in db.cursor.execute(f'EXPLAIN QUERY PLAN {sql}').fetchall()]
+            for detail in plan:
+                self.assertFalse(detail.startswith('SCAN') and 'INDEX' not in detail,
+                                 f'full table scan in "{sql}": {plan}')
+                self.assertNotIn('TEMP B-TREE', detail, f'unindexed sort in "{sql}": {plan}')
     
     def tearDown(self) -> None:
         db.delete_all()
 
+
+class TestDBService(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.service = DBService(log=logger, db_path='./data/test_service.sqlite')
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.service.close()
+
+    async def asyncSetUp(self) -> None:
+        await self.service.delete_all()
+
+    async def test_calls_are_awaitable(self):
+        self.assertTrue(await self.service.init_user('serviceUser', ban=1))
+        self.assertTrue(await self.service.is_user_banned('serviceUser'))
+        await self.service.add_to_queue('serviceUser', 'track', 'link', 'artist')
+        self.assertTrue(await self.service.is_track_in_queue('track', 'artist'))
+        with self.assertRaises(DBError):
+            await self.service.is_user_banned('notAUser')
+
+    async def test_queue_version(self):
+        version = self.service.queue_version
+        await self.service.add_to_queue('serviceUser', 'track', 'link', 'artist')
+        self.assertEqual(version + 1, self.service.queue_version)
+        self.assertEqual('track', (await self.service.get_queue_head())[2])
+
+    async def test_connection_stays_on_worker_thread(self):
+        def worker_thread(database):
+            return threading.get_ident()
+
+        # concurrent calls from the event loop all run on the one worker thread
+        idents = await asyncio.gather(*[self.service.run(worker_thread) for _ in range(10)])
+        self.assertEqual(1, len(set(idents)))
+        self.assertNotEqual(threading.get_ident(), idents[0])
+
+    async def test_close_flushes_counters(self):
+        service = DBService(log=logger, db_path='./data/test_service_close.sqlite')
+        await service.delete_all()
+        await service.init_user('closeUser')
+        await service.add_requests('closeUser')
+        service.close()
+        reopened = db_handler.DB(log=logger, db_path='./data/test_service_close.sqlite')
+        self.assertEqual(1, reopened.get_user_stats('closeUser')['requests'])
+        reopened.delete_all()
+        reopened.close()
+
+    async def test_wal_journal(self):
+        def journal_mode(database):
+            return database.cursor.execute('PRAGMA journal_mode').fetchone()[0]
+
+        self.assertEqual('wal', await self.service.run(journal_mode))
+
+    async def asyncTearDown(self) -> None:
+        await self.service.delete_all()
+
 if __name__ == '__main__':
     unittest.main(verbosity=1)
@@ -0,0 +1,87 @@
+import unittest
+import asyncio
+import os
+import sys
+import threading
+path_src = os.path.abspath('./src')
+sys.path.insert(1, path_src)
+from utils.event_bus import EventBus, QUEUE_CHANGED, PLAYBACK_CHANGED, LEADERBOARD_CHANGED
+from utils.db_handler import DB
+from utils.logger import Log
+from AudioController.audio_controller import Context
+
+logger = Log('test', True, False)
+
+
+class TestEventBus(unittest.IsolatedAsyncioTestCase):
+    async def test_first_wait_returns_straight_away(self):
+        bus = EventBus()
+        events = bus.subscribe(QUEUE_CHANGED)
+        self.assertEqual(set(), await asyncio.wait_for(events.wait(), 1))
+
+    async def test_publish_from_another_thread(self):
+        bus = EventBus()
+        events = bus.subscribe(QUEUE_CHANGED)
+        await events.wait()
+        publisher = threading.Thread(target=bus.publish, args=(QUEUE_CHANGED,))
+        publisher.start()
+        publisher.join()
+        self.assertEqual({QUEUE_CHANGED}, await asyncio.wait_for(events.wait(), 1))
+
+    async def test_events_are_coalesced_and_filtered(self):
+        bus = EventBus()
+        events = bus.subscribe(QUEUE_CHANGED, LEADERBOARD_CHANGED)
+        await events.wait()
+        for _ in range(10):
+            bus.publish(QUEUE_CHANGED)
+        bus.publish(PLAYBACK_CHANGED)
+        bus.publish(LEADERBOARD_CHANGED)
+        self.assertEqual({QUEUE_CHANGED, LEADERBOARD_CHANGED}, await asyncio.wait_for(events.wait(), 1))
+        # nothing else is pending after a burst has been handled
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(events.wait(), 0.05)
+
+    async def test_closed_subscription_gets_nothing(self):
+        bus = EventBus()
+        events = bus.subscribe(QUEUE_CHANGED)
+        await events.wait()
+        events.close()
+        bus.publish(QUEUE_CHANGED)
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(events.wait(), 0.05)
+
+    async def test_context_publishes_playback_changes(self):
+        bus = EventBus()
+        ctx = Context(bus)
+        events = bus.subscribe(PLAYBACK_CHANGED)
+        await events.wait()
+        ctx.update({'track': 'track1', 'artist': 'artist1', 'progress': 1000, 'paused': False})
+        self.assertEqual({PLAYBACK_CHANGED}, await asyncio.wait_for(events.wait(), 1))
+        # only progress moving on is not a change anyone displays
+        ctx.update({'track': 'track1', 'artist': 'artist1', 'progress': 8500, 'paused': False})
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(events.wait(), 0.05)
+        ctx.requester = 'requester'
+        self.assertEqual({PLAYBACK_CHANGED}, await asyncio.wait_for(events.wait(), 1))
+
+    async def test_db_publishes_queue_and_leaderboard_changes(self):
+        bus = EventBus()
+        db = DB(log=logger, db_path='./data/test_event_bus.sqlite', bus=bus)
+        db.delete_all()
+        db.init_user('receiver')
+        db.init_user('giver')
+        queue_events = bus.subscribe(QUEUE_CHANGED)
+        leaderboard_events = bus.subscribe(LEADERBOARD_CHANGED)
+        await queue_events.wait()
+        await leaderboard_events.wait()
+
+        db.add_to_queue('requester', 'track1', 'link', 'artist')
+        self.assertEqual({QUEUE_CHANGED}, await asyncio.wait_for(queue_events.wait(), 1))
+        db.add_rate('receiver', 'giver')
+        self.assertEqual({LEADERBOARD_CHANGED}, await asyncio.wait_for(leaderboard_events.wait(), 1))
+        db.delete_all()
+        db.close()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=1)
@@ -0,0 +1,106 @@
+import unittest
+import os
+import sys
+import sqlite3
+path_src = os.path.abspath('./src')
+sys.path.insert(1, path_src)
+import utils.migrations as migrations
+from utils.db_handler import DB
+from utils.logger import Log
+
+logger = Log('test', True, False)
+db_path = './data/test_migrations.sqlite'
+
+
+class TestMigrations(unittest.TestCase):
+    def setUp(self) -> None:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(db_path + suffix):
+                os.remove(db_path + suffix)
+
+    def tearDown(self) -> None:
+        self.setUp()
+
+    def test_new_database_is_migrated(self):
+        db = DB(logger, db_path)
+        self.assertEqual(migrations.latest_version(), db.schema_version)
+        versions = [row[0] for row in db.cursor.execute('SELECT version FROM schema_version ORDER BY version')]
+        self.assertEqual([m[0] for m in migrations.migrations], versions)
+        db.close()
+
+    def test_nothing_pending_is_one_read(self):
+        DB(logger, db_path).close()
+        conn = sqlite3.connect(db_path)
+        statements = []
+        conn.set_trace_callback(statements.append)
+        self.assertEqual(migrations.latest_version(), migrations.migrate(conn, logger))
+        conn.close()
+        self.assertEqual(2, len(statements))
+        self.assertFalse(any(sql in ('BEGIN', 'COMMIT') for sql in statements))
+
+    def test_legacy_database_is_upgraded(self):
+        # a database made before schema_version existed, with counters still on users
+        conn = sqlite3.connect(db_path)
+        migrations.base_tables(conn.cursor())
+        conn.execute('CREATE INDEX idx_queue_track_artist ON queue (track, artist)')
+        conn.execute("INSERT INTO queue (pos, track, artist, requester, link) "
+                     "VALUES (1, 'track', 'artist', 'legacyUser1', 'https://open.spotify.com/track/legacyid')")
+        conn.executemany('INSERT INTO users VALUES (?, 0, 0, 0, ?, ?, 0)',
+                         [(f'legacyUser{i}', i, i * 2) for i in range(25)])
+        conn.commit()
+        conn.close()
+
+        db = DB(logger, db_path)
+        self.assertEqual(migrations.latest_version(), db.schema_version)
+        self.assertEqual(48, db.get_user_stats('legacyUser24')['rates'])
+        self.assertEqual(24, db.get_user_stats('legacyUser24')['requests'])
+        self.assertEqual(1, db.get_user_stats('legacyUser24')['pos'])
+        self.assertEqual(0, db.get_user_stats('legacyUser0')['rates'])
+        self.assertEqual(24, db.cursor.execute('SELECT COUNT(*) FROM user_stats').fetchone()[0])
+        indexes = [row[0] for row in db.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+        self.assertNotIn('idx_queue_track_artist', indexes)
+        self.assertIn('idx_user_stats_rates', indexes)
+        self.assertEqual(('legacyid', 'spotify:track:legacyid', 0), db.get_queue_head()[6:])
+        self.assertTrue(db.is_track_id_in_queue('legacyid'))
+        db.close()
+
+    def test_backfill_walks_in_batches(self):
+        conn = sqlite3.connect(db_path)
+        conn.execute('CREATE TABLE source (name TEXT)')
+        conn.execute('CREATE TABLE target (name TEXT, tag TEXT)')
+        conn.executemany('INSERT INTO source VALUES (?)', [(f'row{i}',) for i in range(25)])
+        statements = []
+        conn.set_trace_callback(statements.append)
+        copied = migrations.backfill(conn.cursor(),
+                                     'SELECT rowid, name, ? FROM source WHERE rowid > ? ORDER BY rowid LIMIT ?',
+                                     'INSERT INTO target VALUES (?, ?)', batch_size=10, params=('tag',))
+        conn.set_trace_callback(None)
+        self.assertEqual(25, copied)
+        self.assertEqual(25, conn.execute("SELECT COUNT(*) FROM target WHERE tag = 'tag'").fetchone()[0])
+        # three full or partial batches and the empty read that ends the walk
+        self.assertEqual(4, len([sql for sql in statements if sql.startswith('SELECT')]))
+        conn.close()
+
+    def test_failed_migration_rolls_back(self):
+        DB(logger, db_path).close()
+        version = migrations.latest_version() + 1
+
+        @migrations.migration(version, 'broken')
+        def broken(cursor):
+            cursor.execute('CREATE TABLE half_done (id INTEGER)')
+            cursor.execute('SELECT * FROM missing_table')
+
+        conn = sqlite3.connect(db_path)
+        try:
+            with self.assertRaises(sqlite3.OperationalError):
+                migrations.migrate(conn, logger)
+            tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+            self.assertNotIn('half_done', tables)
+            self.assertEqual(version - 1, conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0])
+        finally:
+            conn.close()
+            migrations.migrations.remove((version, 'broken', broken))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=1)
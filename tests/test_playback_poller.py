@@ -0,0 +1,154 @@
+import unittest
+import asyncio
+import os
+import sys
+path_src = os.path.abspath('./src')
+sys.path.insert(1, path_src)
+from AudioController.audio_controller import AudioController, Context
+from AudioController.playback_poller import PlaybackPoller
+from AudioController.request_scheduler import USER, POLL
+from utils.logger import Log
+
+logger = Log('test', True, False)
+
+
+class TestPlaybackPoller(unittest.TestCase):
+    def setUp(self) -> None:
+        self.context = Context()
+        self.context.live = True
+        self.ac = AudioController(None, None, self.context, logger)
+        self.poller = PlaybackPoller(self.ac, logger)
+
+    def playing(self, progress, duration=200000, paused=False):
+        self.context.update({'track': 'track', 'progress': progress, 'duration': duration, 'paused': paused,
+                             'playback_id': 'id'})
+        self.ac.timeline.update(self.ac.timeline.begin(), 'id', progress, duration, paused)
+
+    def test_mid_track_polls_rarely(self):
+        self.playing(progress=10000)
+        self.assertAlmostEqual(30, self.poller.next_delay(), places=1)
+        self.assertEqual(POLL, self.poller.priority)
+
+    def test_poll_lands_inside_handoff_window(self):
+        self.playing(progress=180000)
+        delay = self.poller.next_delay()
+        self.assertAlmostEqual(14, delay, places=1)
+        self.assertEqual(USER, self.poller.priority)
+        # simulate the poll landing late, it is still inside the window
+        window_start, window_end = self.ac.handoff_window
+        self.assertTrue(window_start < 20000 - delay * 1000 - 1000 <= window_end)
+
+    def test_after_handoff_waits_for_track_change(self):
+        self.playing(progress=195000)
+        self.assertAlmostEqual(6.5, self.poller.next_delay(), places=1)
+        # a poll after the end of the track still waits for spotify to move on
+        self.playing(progress=205000)
+        self.assertAlmostEqual(1.5, self.poller.next_delay(), places=1)
+
+    def test_whole_track_takes_few_polls(self):
+        polls = 0
+        progress = 0
+        while progress < 200000:
+            self.playing(progress=progress)
+            polls += 1
+            progress += self.poller.next_delay() * 1000
+        # against 27 at a fixed 7.5 seconds
+        self.assertLessEqual(polls, 9)
+
+    def test_paused_backs_off(self):
+        self.playing(progress=10000, paused=True)
+        delays = [self.poller.next_delay() for _ in range(5)]
+        self.assertEqual([7.5, 15, 30, 60, 60], delays)
+        self.playing(progress=10000)
+        self.poller.next_delay()
+        self.assertEqual(7.5, self.poller.paused_interval)
+
+    def test_nothing_playing_backs_off(self):
+        self.playing(progress=10000)
+        self.poller.idle = True
+        self.assertEqual(7.5, self.poller.next_delay())
+        self.assertEqual(15, self.poller.next_delay())
+
+    def test_offline_keeps_interval(self):
+        self.context.live = False
+        self.assertEqual(7.5, self.poller.next_delay())
+        self.assertEqual(7.5, self.poller.next_delay())
+
+
+class TestHandoffTimer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.context = Context()
+        self.context.live = True
+        self.ac = AudioController(None, None, self.context, logger)
+        self.poller = PlaybackPoller(self.ac, logger)
+        self.loop = asyncio.get_running_loop()
+
+    async def asyncTearDown(self) -> None:
+        if self.ac.next_timer is not None:
+            self.ac.next_timer.cancel()
+
+    async def poll(self, progress, duration=200000, paused=False):
+        self.context.update({'track': 'track', 'progress': progress, 'duration': duration, 'paused': paused,
+                             'playback_id': 'id'})
+        self.ac.timeline.update(self.ac.timeline.begin(), 'id', progress, duration, paused)
+        await self.ac.check_context()
+
+    def fires_in(self):
+        return (self.ac.next_timer.deadline - self.loop.time()) * 1000
+
+    async def test_handoff_poll_delayed_past_window(self):
+        await self.poll(progress=170000)
+        timer = self.ac.next_timer
+        self.assertIsNotNone(timer)
+        self.assertAlmostEqual(30000 - self.ac.handoff_lead, self.fires_in(), delta=50)
+        # the poll meant to land 6 s before the end waits behind user requests and lands after the window
+        self.poller.next_delay()
+        self.assertEqual(USER, self.poller.priority)
+        await self.poll(progress=198500)
+        self.assertIs(timer, self.ac.next_timer)
+        self.assertFalse(timer.done)
+
+    async def test_each_poll_rearms_from_timeline(self):
+        await self.poll(progress=170000)
+        first = self.ac.next_timer
+        # a later poll replaces the timer with one from its own reading of the track
+        await self.poll(progress=185000)
+        self.assertTrue(first.done)
+        self.assertAlmostEqual(15000 - self.ac.handoff_lead, self.fires_in(), delta=50)
+
+    async def test_poll_just_after_handoff_fired(self):
+        played = []
+
+        async def play_next(skipped=False):
+            played.append(skipped)
+
+        self.ac.play_next = play_next
+        await self.poll(progress=170000)
+        self.ac.timeline.rtt = 400
+        # the timer fires handoff_lead + rtt before the end, 2.4 s out, still before the window
+        timer = self.ac.next_timer
+        timer.cancel()
+        await self.ac.handoff('id')
+        # a late handoff poll comes back after that with 2.7 s and 2.3 s left
+        await self.poll(progress=197300)
+        await self.poll(progress=197700)
+        self.assertIs(timer, self.ac.next_timer)
+        await asyncio.sleep(0.05)
+        self.assertEqual([False], played)
+        # the next track is handed off as usual
+        self.context.update({'track': 'next', 'progress': 0, 'duration': 200000, 'paused': False,
+                             'playback_id': 'next'})
+        self.ac.timeline.update(self.ac.timeline.begin(), 'next', 0, 200000, False)
+        await self.ac.check_context()
+        self.assertIsNot(timer, self.ac.next_timer)
+
+    async def test_pause_disarms_handoff(self):
+        await self.poll(progress=170000)
+        timer = self.ac.next_timer
+        await self.poll(progress=175000, paused=True)
+        self.assertTrue(timer.done)
+        self.assertIsNone(self.ac.next_timer)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=1)
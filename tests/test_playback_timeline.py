@@ -0,0 +1,140 @@
+import unittest
+import os
+import random
+import sys
+path_src = os.path.abspath('./src')
+sys.path.insert(1, path_src)
+from AudioController.playback_timeline import PlaybackTimeline
+from AudioController.audio_controller import AudioController, Context
+from utils.logger import Log
+
+
+class SimClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+# the spotify side of the simulation, a track playing on the true clock with optional stalls
+class SimPlayer:
+    def __init__(self, clock: SimClock, duration: int, stalls: list = ()):
+        self.clock = clock
+        self.duration = duration
+        self.started_at = clock.now
+        # (at ms into the track, stalled for ms)
+        self.stalls = stalls
+
+    def progress(self, at: float) -> int:
+        progress = (at - self.started_at) * 1000
+        for stall_at, stalled_for in self.stalls:
+            if progress > stall_at:
+                progress = max(stall_at, progress - stalled_for)
+        return int(min(progress, self.duration))
+
+    def ends_at(self) -> float:
+        return self.started_at + (self.duration + sum(stalled for _, stalled in self.stalls)) / 1000
+
+
+# polls a simulated track through to its handoff, each request taking a random time each way.
+# Returns the error in ms of the predicted end of the track at the handoff, and of the
+# estimate the controller used to make, anchoring progress at the time the request was sent
+def simulate(seed: int, polls: list, stalls: list = (), duration: int = 200000):
+    rand = random.Random(seed)
+    clock = SimClock()
+    player = SimPlayer(clock, duration, stalls)
+    timeline = PlaybackTimeline(clock=clock)
+    naive_end = None
+    for poll_at in polls:
+        clock.now = player.started_at + poll_at / 1000
+        sent_at = timeline.begin()
+        clock.now += rand.uniform(0.02, 0.3)
+        progress = player.progress(clock.now)
+        clock.now += rand.uniform(0.02, 0.3)
+        timeline.update(sent_at, 'track', progress, duration, False)
+        naive_end = sent_at + (duration - progress) / 1000
+    true_end = player.ends_at()
+    return (timeline.ends_at() - true_end) * 1000, (naive_end - true_end) * 1000, timeline
+
+
+class TestPlaybackTimeline(unittest.TestCase):
+    polls = [0, 30000, 60000, 90000, 120000, 150000, 180000, 194000]
+
+    def test_handoff_accuracy(self):
+        errors = []
+        naive_errors = []
+        for seed in range(200):
+            error, naive_error, _ = simulate(seed, self.polls)
+            errors.append(abs(error))
+            naive_errors.append(abs(naive_error))
+        # the remaining error is the difference between the two legs of the round trip
+        self.assertLess(max(errors), 140)
+        self.assertLess(sum(errors) / len(errors), 60)
+        self.assertLess(sum(errors) / len(errors), sum(naive_errors) / len(naive_errors) / 2)
+
+    def test_stall_is_corrected_on_next_poll(self):
+        error, _, timeline = simulate(1, self.polls, stalls=[(100000, 800)])
+        self.assertLess(abs(error), 140)
+        self.assertGreater(timeline.max_drift, 500)
+
+    def test_handoff_lands_before_the_end(self):
+        for seed in range(50):
+            error, _, timeline = simulate(seed, self.polls)
+            time_left = timeline.time_left()
+            # check_context fires play_next a round trip ahead of the lead, which is when the
+            # request for the next track reaches spotify after one more (at most 600 ms) round trip
+            fire_in = time_left - AudioController.handoff_lead - timeline.rtt
+            arrives = fire_in + 600
+            lands_before_end = time_left - error - arrives
+            self.assertGreater(lands_before_end, 0)
+            self.assertLess(lands_before_end, AudioController.handoff_lead + 200)
+
+    def test_paused_position_holds(self):
+        clock = SimClock()
+        timeline = PlaybackTimeline(clock=clock)
+        timeline.update(timeline.begin(), 'track', 50000, 200000, True)
+        clock.now += 30
+        self.assertEqual(50000, timeline.position())
+        self.assertIsNone(timeline.time_left())
+        timeline.clear()
+        self.assertIsNone(timeline.position())
+
+
+# answers get_context for the player after waiting queued_for seconds for the request scheduler
+class SimSpotify:
+    def __init__(self, player: SimPlayer, queued_for: float, legs: tuple):
+        self.player = player
+        self.queued_for = queued_for
+        self.legs = legs
+
+    async def get_context(self, priority: int, sent: callable = None):
+        clock = self.player.clock
+        clock.now += self.queued_for
+        sent()
+        clock.now += self.legs[0]
+        progress = self.player.progress(clock.now)
+        clock.now += self.legs[1]
+        return {'track': 'track', 'progress': progress, 'duration': self.player.duration, 'paused': False,
+                'playback_id': 'track'}
+
+
+class TestQueuedPoll(unittest.IsolatedAsyncioTestCase):
+    async def test_scheduler_wait_is_not_round_trip(self):
+        clock = SimClock()
+        player = SimPlayer(clock, 200000)
+        context = Context()
+        context.live = True
+        ac = AudioController(None, SimSpotify(player, 1.5, (0.1, 0.1)), context, Log('test', True, False))
+        ac.timeline = PlaybackTimeline(clock=clock)
+        clock.now += 190
+        await ac.update_context()
+        ac.next_timer.cancel()
+        # a poll stuck behind user requests for 1.5 s still measures a 200 ms round trip
+        self.assertAlmostEqual(200, ac.timeline.rtt, places=3)
+        # progress is whole ms, the queued wait would put the end 750 ms out
+        self.assertAlmostEqual(player.ends_at(), ac.timeline.ends_at(), delta=0.002)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=1)
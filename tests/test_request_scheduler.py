@@ -0,0 +1,80 @@
+import unittest
+import asyncio
+import os
+import sys
+import time
+path_src = os.path.abspath('./src')
+sys.path.insert(1, path_src)
+from AudioController.request_scheduler import RequestScheduler, PLAYBACK, USER, POLL
+from utils.errors import RequestDropped
+
+
+class TestRequestScheduler(unittest.IsolatedAsyncioTestCase):
+    async def test_burst_then_rate(self):
+        scheduler = RequestScheduler(rate=20, burst=5)
+        started = time.monotonic()
+        for _ in range(5):
+            await scheduler.acquire(USER)
+        self.assertLess(time.monotonic() - started, 0.02)
+        for _ in range(4):
+            await scheduler.acquire(USER)
+        # four more tokens at 20 a second
+        self.assertGreater(time.monotonic() - started, 0.15)
+        self.assertEqual(9, scheduler.metrics()['granted']['user'])
+
+    async def test_waiters_go_in_priority_order(self):
+        scheduler = RequestScheduler(rate=20, burst=1, poll_reserve=0)
+        await scheduler.acquire(USER)
+        order = []
+
+        async def request(name, priority):
+            await scheduler.acquire(priority)
+            order.append(name)
+
+        tasks = [asyncio.create_task(request('user1', USER)), asyncio.create_task(request('user2', USER)),
+                 asyncio.create_task(request('skip', PLAYBACK))]
+        await asyncio.sleep(0.01)
+        metrics = scheduler.metrics()
+        self.assertEqual(3, metrics['queue_depth'])
+        self.assertEqual({'playback': 1, 'user': 2, 'poll': 0}, metrics['queue_depth_by_priority'])
+        await asyncio.gather(*tasks)
+        self.assertEqual(['skip', 'user1', 'user2'], order)
+        metrics = scheduler.metrics()
+        self.assertEqual(0, metrics['queue_depth'])
+        self.assertGreater(metrics['wait_max']['user'], metrics['wait_max']['playback'])
+        self.assertGreater(metrics['wait_avg']['user'], 0)
+
+    async def test_polls_are_dropped_when_budget_is_tight(self):
+        scheduler = RequestScheduler(rate=1, burst=5, poll_reserve=2)
+        for _ in range(3):
+            await scheduler.acquire(POLL)
+        # the two tokens left are kept for playback control and requests
+        with self.assertRaises(RequestDropped):
+            await scheduler.acquire(POLL)
+        await scheduler.acquire(USER)
+        await scheduler.acquire(PLAYBACK)
+        self.assertEqual(1, scheduler.metrics()['dropped_polls'])
+
+    async def test_retry_after_holds_everything_back(self):
+        scheduler = RequestScheduler(rate=100, burst=10)
+        scheduler.retry_after(0.2)
+        with self.assertRaises(RequestDropped):
+            await scheduler.acquire(POLL)
+        started = time.monotonic()
+        await scheduler.acquire(PLAYBACK)
+        self.assertGreaterEqual(time.monotonic() - started, 0.19)
+        self.assertEqual(1, scheduler.metrics()['retry_afters'])
+
+    async def test_cancelled_waiter_is_skipped(self):
+        scheduler = RequestScheduler(rate=20, burst=1)
+        await scheduler.acquire(USER)
+        cancelled = asyncio.create_task(scheduler.acquire(PLAYBACK))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await scheduler.acquire(USER)
+        self.assertEqual(0, scheduler.metrics()['granted']['playback'])
+        self.assertEqual(0, scheduler.metrics()['queue_depth'])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=1)
@@ -0,0 +1,239 @@
+import unittest
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+from aiohttp import web
+from spotipy import SpotifyException
+path_src = os.path.abspath('./src')
+sys.path.insert(1, path_src)
+from AudioController.spotify_api import Spotify
+from AudioController.spotify_client import SpotifyClient
+from AudioController.request_scheduler import USER
+from AudioController.audio_controller import AudioController, Context
+from AudioController.playback_poller import PlaybackPoller
+from utils.errors import NoCurrentTrack, RequestDropped
+from utils.event_bus import EventBus, PLAYBACK_CHANGED
+from utils.logger import Log
+
+
+def track_object(track_id, name='track'):
+    return {'external_urls': {'spotify': f'https://open.spotify.com/track/{track_id}'},
+            'name': name, 'artists': [{'name': 'artist1'}, {'name': 'artist2'}],
+            'id': track_id, 'uri': f'spotify:track:{track_id}', 'duration_ms': 180000,
+            'album': {'images': [{'url': 'large'}, {'url': 'medium'}]}}
+
+
+# stands in for spotipy's SpotifyOAuth, the client only needs the token and when it expires
+class TokenManager:
+    def __init__(self):
+        self.fetches = 0
+        self.cache_handler = self
+
+    def get_access_token(self, as_dict=False):
+        self.fetches += 1
+        return f'token{self.fetches}'
+
+    def get_cached_token(self):
+        return {'expires_at': time.time() + 3600}
+
+
+# a local stand in for the spotify web api, records every request it is sent
+class FakeSpotifyApi:
+    def __init__(self):
+        self.requests = []
+        self.peers = set()
+        self.playing = None
+        self.delay = 0
+        self.reject_token = None
+        self.rate_limited = 0
+        app = web.Application()
+        app.router.add_get('/v1/search', self.search)
+        app.router.add_get('/v1/tracks/{track_id}', self.track)
+        app.router.add_get('/v1/me/player/currently-playing', self.currently_playing)
+        app.router.add_get('/v1/me/player/queue', self.queue)
+        app.router.add_post('/v1/me/player/queue', self.add_to_queue)
+        app.router.add_post('/v1/me/player/next', self.next_track)
+        self.runner = web.AppRunner(app)
+
+    async def start(self):
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f'http://127.0.0.1:{port}/v1'
+
+    async def record(self, request):
+        self.requests.append((request.method, request.path, dict(request.query), request.headers['Authorization']))
+        self.peers.add(request.transport.get_extra_info('peername'))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if request.headers['Authorization'] == self.reject_token:
+            raise web.HTTPUnauthorized()
+        if self.rate_limited > 0:
+            self.rate_limited -= 1
+            raise web.HTTPTooManyRequests(headers={'Retry-After': '0.2'})
+
+    async def search(self, request):
+        await self.record(request)
+        items = [] if request.query['q'] == 'nothing' else [track_object('found', request.query['q'])]
+        return web.json_response({'tracks': {'items': items}})
+
+    async def track(self, request):
+        await self.record(request)
+        if request.match_info['track_id'] == 'missing':
+            return web.json_response({'error': {'status': 404, 'message': 'not found'}}, status=404)
+        return web.json_response(track_object(request.match_info['track_id']))
+
+    async def currently_playing(self, request):
+        await self.record(request)
+        if self.playing is None:
+            return web.Response(status=204)
+        return web.json_response({'item': track_object(self.playing), 'progress_ms': 1000, 'is_playing': True,
+                                  'context': None})
+
+    async def queue(self, request):
+        await self.record(request)
+        return web.json_response({'queue': [track_object('next1'), track_object('next2')]})
+
+    async def add_to_queue(self, request):
+        await self.record(request)
+        return web.Response(status=204)
+
+    async def next_track(self, request):
+        await self.record(request)
+        return web.Response(status=204)
+
+
+class TestSpotifyClient(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.api = FakeSpotifyApi()
+        api_url = await self.api.start()
+        self.tokens = TokenManager()
+        creds = SimpleNamespace(username='test', client_id='id', client_secret='secret')
+        # the constructor checks the credentials with a blocking search, which this loop has to serve
+        self.spot = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: Spotify(creds, api_url=api_url, auth_manager=self.tokens))
+        self.api.requests.clear()
+
+    async def asyncTearDown(self) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self.spot.close)
+        await self.api.runner.cleanup()
+
+    async def test_search_and_track_lookups(self):
+        self.assertEqual(('Never gonna give you up', 'artist1, artist2', 'https://open.spotify.com/track/found'),
+                         await self.spot.get_track_link('Never gonna give you up'))
+        self.assertEqual('https://open.spotify.com/track/found', await self.spot.search_song('never gonna give you up'))
+        self.assertIsNone(await self.spot.search_track('nothing'))
+        details = await self.spot.get_track_details(url='https://open.spotify.com/track/abc?si=1')
+        self.assertEqual(('abc', 'spotify:track:abc', 180000), (details['id'], details['uri'], details['duration_ms']))
+        paths = [(method, path) for method, path, _, _ in self.api.requests]
+        self.assertEqual([('GET', '/v1/search'), ('GET', '/v1/search'), ('GET', '/v1/tracks/abc')], paths)
+        self.assertEqual({'q': 'Never gonna give you up', 'limit': '1', 'type': 'track'}, self.api.requests[0][2])
+        # "by" in a title is searched as written
+        await self.spot.search_track('!sr Stand By Me')
+        self.assertEqual('Stand By Me', self.api.requests[-1][2]['q'])
+
+    async def test_playback_calls(self):
+        with self.assertRaises(NoCurrentTrack):
+            await self.spot.get_context()
+        self.api.playing = 'playing'
+        context = await self.spot.get_context()
+        self.assertEqual(('playing', 'medium', False), (context['playback_id'], context['album_art'], context['paused']))
+        self.assertEqual(['next1', 'next2'], await self.spot.get_queue())
+        await self.spot.add_to_queue('https://open.spotify.com/track/abc')
+        await self.spot.next_track()
+        self.assertEqual(('POST', '/v1/me/player/queue', {'uri': 'spotify:track:abc'}), self.api.requests[-2][:3])
+        self.assertEqual(('POST', '/v1/me/player/next'), self.api.requests[-1][:2])
+
+    async def test_errors_raise_spotify_exception(self):
+        with self.assertRaises(SpotifyException) as raised:
+            await self.spot.get_track_details(url='spotify:track:missing')
+        self.assertEqual(404, raised.exception.http_status)
+
+    async def test_one_token_and_one_connection(self):
+        for _ in range(5):
+            await self.spot.search_song(f'song {_}')
+        self.assertEqual(1, self.tokens.fetches)
+        self.assertEqual({'Bearer token1'}, {auth for _, _, _, auth in self.api.requests})
+        # requests one after another reuse the pooled keep-alive connection
+        self.assertEqual(1, len(self.api.peers))
+
+    async def test_rejected_token_is_refreshed_once(self):
+        await self.spot.search_song('first')
+        self.api.reject_token = 'Bearer token1'
+        await self.spot.search_song('second')
+        self.assertEqual(2, self.tokens.fetches)
+        self.assertEqual('Bearer token2', self.api.requests[-1][3])
+
+    async def test_slow_response_does_not_block_the_loop(self):
+        self.api.delay = 0.3
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticking = asyncio.create_task(ticker())
+        await self.spot.search_song('slow')
+        ticking.cancel()
+        self.assertGreater(ticks, 10)
+
+
+    async def test_rate_limited_requests_wait_for_retry_after(self):
+        # refill quickly so polls are let through again as soon as the Retry-After is over
+        self.spot.sp.scheduler.rate = 100
+        self.api.rate_limited = 1
+        started = time.monotonic()
+        await self.spot.next_track()
+        self.assertGreaterEqual(time.monotonic() - started, 0.19)
+        self.assertEqual(2, len(self.api.requests))
+        self.api.playing = 'playing'
+        self.api.rate_limited = 1
+        # a background poll is not retried, and the next one is dropped while backing off
+        with self.assertRaises(SpotifyException) as raised:
+            await self.spot.get_context()
+        self.assertEqual(429, raised.exception.http_status)
+        with self.assertRaises(RequestDropped):
+            await self.spot.get_context()
+        self.assertEqual('playing', (await self.spot.get_context(priority=USER))['playback_id'])
+        metrics = await self.spot.metrics()
+        self.assertEqual(2, metrics['retry_afters'])
+        self.assertEqual(1, metrics['dropped_polls'])
+
+    async def test_poller_updates_shared_context(self):
+        bus = EventBus()
+        events = bus.subscribe(PLAYBACK_CHANGED)
+        await events.wait()
+        context = Context(bus)
+        context.live = True
+        await events.wait()
+        poller = PlaybackPoller(AudioController(None, self.spot, context, Log('test', True, False)),
+                                Log('test', True, False), interval=0.05)
+        # nothing playing is not an error
+        await self.spot.sp.call(poller.poll())
+        self.assertIsNone(context.track)
+        self.api.playing = 'playing'
+        poller.start()
+        self.assertEqual({PLAYBACK_CHANGED}, await asyncio.wait_for(events.wait(), 1))
+        # the event goes out on the first changed field, the poller's thread may still be mid update
+        for _ in range(100):
+            if context.playback_id == 'playing':
+                break
+            await asyncio.sleep(0.01)
+        poller.stop()
+        self.assertEqual(('playing', False), (context.playback_id, context.paused))
+
+
+class TestClientHelpers(unittest.TestCase):
+    def test_get_id(self):
+        self.assertEqual('abc', SpotifyClient.get_id('https://open.spotify.com/track/abc?si=123'))
+        self.assertEqual('abc', SpotifyClient.get_id('spotify:playlist:abc'))
+        self.assertEqual('abc', SpotifyClient.get_id('abc'))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=1)
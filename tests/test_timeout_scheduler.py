@@ -0,0 +1,110 @@
+import unittest
+import asyncio
+import os
+import sys
+import time
+path_src = os.path.abspath('./src')
+sys.path.insert(1, path_src)
+from utils.timeout_scheduler import TimeoutScheduler
+from utils.db_service import DBService
+from utils.db_handler import DB
+from utils.logger import Log
+from utils.errors import DBError
+
+logger = Log('test', True, False)
+
+
+class Clock:
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+class TestTimeoutScheduler(unittest.IsolatedAsyncioTestCase):
+    db_path = './data/test_timeouts.sqlite'
+
+    async def asyncSetUp(self) -> None:
+        self.db = DBService(logger, self.db_path)
+        await self.db.delete_all()
+        for name in ('user1', 'user2', 'user3'):
+            await self.db.init_user(name)
+
+    async def asyncTearDown(self) -> None:
+        await self.db.delete_all()
+        self.db.close()
+
+    async def test_earliest_timeout_is_armed(self):
+        clock = Clock()
+        scheduler = TimeoutScheduler(self.db, logger, clock)
+        await scheduler.start()
+        self.assertIsNone(scheduler.timer)
+        await scheduler.add('user1', 3600, 'mod')
+        expires_at = await scheduler.add('user2', 60, 'mod')
+        await scheduler.add('user3', 60, 'mod')
+        self.assertEqual(expires_at, scheduler.next_expiry)
+        self.assertTrue(await self.db.is_user_banned('user2'))
+        # both users due at the same time are unbanned together
+        clock.now += 61
+        await scheduler.expire()
+        self.assertFalse(await self.db.is_user_banned('user2'))
+        self.assertFalse(await self.db.is_user_banned('user3'))
+        self.assertTrue(await self.db.is_user_banned('user1'))
+        self.assertEqual(int(clock.now - 61 + 3600), scheduler.next_expiry)
+        scheduler.stop()
+
+    async def test_timer_unbans(self):
+        scheduler = TimeoutScheduler(self.db, logger)
+        await scheduler.add('user1', 0, 'mod')
+        self.assertTrue(await self.db.is_user_banned('user1'))
+        for _ in range(100):
+            if not await self.db.is_user_banned('user1'):
+                break
+            await asyncio.sleep(0.01)
+        self.assertFalse(await self.db.is_user_banned('user1'))
+        self.assertIsNone(scheduler.timer)
+
+    async def test_db_error_backs_off(self):
+        clock = Clock()
+        scheduler = TimeoutScheduler(self.db, logger, clock)
+        await scheduler.add('user1', 60, 'mod')
+        clock.now += 61
+        expire_timeouts = self.db.expire_timeouts
+
+        async def locked(now):
+            raise DBError('database is locked')
+
+        self.db.expire_timeouts = locked
+        await scheduler.expire()
+        # still banned, and tried again after the backoff rather than straight away
+        self.assertTrue(await self.db.is_user_banned('user1'))
+        self.assertEqual(clock.now + scheduler.retry_backoff, scheduler.next_expiry)
+        self.assertAlmostEqual(scheduler.retry_backoff, scheduler.timer.deadline - asyncio.get_running_loop().time(),
+                               delta=0.1)
+        self.db.expire_timeouts = expire_timeouts
+        await scheduler.expire()
+        self.assertFalse(await self.db.is_user_banned('user1'))
+        self.assertIsNone(scheduler.timer)
+
+    async def test_timeouts_survive_restart(self):
+        clock = Clock()
+        scheduler = TimeoutScheduler(self.db, logger, clock)
+        await scheduler.add('user1', 60, 'mod')
+        await scheduler.add('user2', 600, 'mod')
+        scheduler.stop()
+        self.db.close()
+
+        self.db = DBService(logger, self.db_path)
+        clock.now += 120
+        restarted = TimeoutScheduler(self.db, logger, clock)
+        # user1 expired while the bot was down
+        await restarted.start()
+        self.assertFalse(await self.db.is_user_banned('user1'))
+        self.assertTrue(await self.db.is_user_banned('user2'))
+        self.assertEqual(await self.db.get_next_timeout(), restarted.next_expiry)
+        restarted.stop()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=1)
@@ -0,0 +1,158 @@
+import unittest
+import os
+import sys
+path_src = os.path.abspath('./src')
+sys.path.insert(1, path_src)
+from AudioController.track_cache import TrackCache, LRUCache
+from AudioController.spotify_api import Spotify
+from utils.db_service import DBService
+from utils.db_handler import DB
+from utils.logger import Log
+
+logger = Log('test', True, False)
+
+
+def details(track_id, name='track'):
+    return {'track': name, 'artist': 'artist', 'link': f'https://open.spotify.com/track/{track_id}',
+            'id': track_id, 'uri': f'spotify:track:{track_id}', 'duration_ms': 200000}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+# counts the lookups that would have gone to the spotify web api
+class TrackLookups:
+    def __init__(self):
+        self.calls = 0
+
+    async def track(self, url):
+        self.calls += 1
+        return self.track_object(Spotify.get_track_id(url))
+
+    async def search(self, q, limit=10, type='track'):
+        self.calls += 1
+        self.last_query = q
+        if q == 'nothing':
+            return {'tracks': {'items': []}}
+        return {'tracks': {'items': [self.track_object('found')][:limit]}}
+
+    @staticmethod
+    def track_object(track_id):
+        return {'external_urls': {'spotify': f'https://open.spotify.com/track/{track_id}'},
+                'name': 'track', 'artists': [{'name': 'artist1'}, {'name': 'artist2'}],
+                'id': track_id, 'uri': f'spotify:track:{track_id}', 'duration_ms': 180000}
+
+
+class TestTrackCache(unittest.IsolatedAsyncioTestCase):
+    def test_least_recently_used_is_evicted(self):
+        cache = TrackCache(capacity=2)
+        cache.put(details('id1'))
+        cache.put(details('id2'))
+        self.assertIsNotNone(cache.get('id1'))
+        cache.put(details('id3'))
+        self.assertIsNone(cache.get('id2'))
+        self.assertIsNotNone(cache.get('id1'))
+        self.assertIsNotNone(cache.get('id3'))
+        stats = cache.stats()
+        self.assertEqual(2, stats['size'])
+        self.assertEqual(3, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(1, stats['evictions'])
+
+    def test_entries_expire(self):
+        clock = Clock()
+        cache = TrackCache(ttl=60, clock=clock)
+        cache.put(details('id1'))
+        clock.now += 59
+        self.assertIsNotNone(cache.get('id1'))
+        clock.now += 1
+        self.assertIsNone(cache.get('id1'))
+        self.assertEqual(1, cache.stats()['expirations'])
+        self.assertEqual(0, cache.stats()['size'])
+
+    def test_track_ids_from_links(self):
+        self.assertEqual('abc', Spotify.get_track_id('https://open.spotify.com/track/abc?si=123'))
+        self.assertEqual('abc', Spotify.get_track_id('https://open.spotify.com/track/abc'))
+        self.assertEqual('abc', Spotify.get_track_id('spotify:track:abc'))
+
+    async def test_spotify_lookups_go_through_cache(self):
+        spot = Spotify.__new__(Spotify)
+        spot.sp = TrackLookups()
+        spot.cache = TrackCache()
+        first = await spot.get_track_info(url='https://open.spotify.com/track/abc?si=1')
+        second = await spot.get_track_info(url='spotify:track:abc')
+        self.assertEqual(('track', 'artist1, artist2', 'https://open.spotify.com/track/abc'), first)
+        self.assertEqual(first, second)
+        self.assertEqual(1, spot.sp.calls)
+        self.assertEqual(180000, (await spot.get_track_details(url='spotify:track:abc'))['duration_ms'])
+
+
+    async def test_search_builds_details_from_results(self):
+        spot = Spotify.__new__(Spotify)
+        spot.sp = TrackLookups()
+        spot.cache = TrackCache()
+        spot.search_cache = LRUCache()
+        details = await spot.search_track('Never Gonna  Give You Up by Rick Astley')
+        self.assertEqual('found', details['id'])
+        self.assertEqual('Never Gonna  Give You Up by Rick Astley', spot.sp.last_query)
+        self.assertEqual(1, spot.sp.calls)
+        # the same request written differently is answered from memory, as is a link to the track
+        self.assertIs(details, await spot.search_track('!sr never gonna give you up BY rick astley '))
+        self.assertEqual('https://open.spotify.com/track/found', await spot.search_song('never gonna give you up rick astley'))
+        self.assertEqual(details, await spot.get_track_details(url='spotify:track:found'))
+        self.assertEqual(1, spot.sp.calls)
+        self.assertIsNone(await spot.search_track('nothing'))
+
+    def test_normalize_query(self):
+        self.assertEqual('song artist', Spotify.normalize_query('!sr  Song   BY\tArtist'))
+        self.assertEqual('by the way', Spotify.normalize_query('By The Way'))
+
+
+class TestTrackCachePersistence(unittest.TestCase):
+    db_path = './data/test_track_cache.sqlite'
+
+    def test_cache_survives_restart(self):
+        service = DBService(logger, self.db_path)
+        service.run_blocking(DB.delete_all)
+        clock = Clock()
+        cache = TrackCache(capacity=2, ttl=60, db=service, clock=clock)
+        cache.put(details('old'))
+        clock.now += 30
+        for i, name in enumerate(('first', 'second', 'third'), start=1):
+            cache.put(details(f'id{i}', name))
+            clock.now += 1
+        service.close()
+
+        service = DBService(logger, self.db_path)
+        clock.now += 17
+        restarted = TrackCache(capacity=2, ttl=60, db=service, clock=clock)
+        # only the newest capacity entries are loaded, most recent last
+        self.assertEqual(['id2', 'id3'], list(restarted.entries))
+        self.assertEqual('third', restarted.get('id3')['track'])
+        # expiry still counts from when the track was first fetched
+        clock.now += 41
+        self.assertIsNone(restarted.get('id2'))
+        service.run_blocking(DB.delete_all)
+        service.close()
+
+    def test_failed_write_back_is_logged(self):
+        service = DBService(logger, self.db_path)
+        service.run_blocking(DB.delete_all)
+        cache = TrackCache(db=service)
+        with self.assertLogs(level='ERROR') as logs:
+            # missing the columns the tracks table needs
+            cache.put({'id': 'broken'})
+            service.run_blocking(DB.get_cached_tracks, 10, 0)
+        self.assertTrue(any('Background cache_track failed' in line for line in logs.output))
+        # the lookup is still answered from memory
+        self.assertEqual({'id': 'broken'}, cache.get('broken'))
+        service.close()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=1)
@@ -4,7 +4,7 @@ import sys
 import time
 path_src = os.path.abspath('./src')
 sys.path.insert(1, path_src)
-from utils import DB, Log, Settings, Creds
+from utils import DBService, Log, Settings, Creds
 from utils.errors import *
 from twitch.twitch_bot import TwitchBot
 from twitch.public_online import OnlineCog
@@ -16,7 +16,7 @@ from AudioController.spotify_api import Spotify
 logger = Log('test', True, False)
 creds = Creds(logger)
 settings = Settings()
-db = DB(log=logger, db_path='./data/test.sqlite')
+db = DBService(log=logger, db_path='./data/test.sqlite')
 
 
 ac = AudioController(db, Spotify(creds.spotify), Context())
@@ -24,9 +24,9 @@ ac = AudioController(db, Spotify(creds.spotify), Context())
 tb = TwitchBot(creds.twitch, logger, db, ac, settings)
 
 
-class TestTwitchBot(unittest.TestCase):
-    def setUp(self) -> None:
-        db.delete_all()
+class TestTwitchBot(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        await db.delete_all()
 
     def test_add_veto(self):
         pc =  OnlineCog(tb)
@@ -52,78 +52,86 @@ class TestTwitchBot(unittest.TestCase):
         self.assertEqual(
             f'track1 by artist2 has been vetoed by chat LUL', resp4)
 
-    def test_add_rates(self):
+    async def test_add_rates(self):
         pc = OnlineCog(tb)
-        db.delete_user('requester1')
-        db.delete_user('rategiver')
-        db.init_user('requester1', requests=1)
-        db.init_user('rategiver')
+        await db.delete_user('requester1')
+        await db.delete_user('rategiver')
+        await db.init_user('requester1', requests=1)
+        await db.init_user('rategiver')
         song_context1 = {"playing_queue": True, "track": "track1",
                          "artist": "artist1", "requester": "requester1"}
-        resp1 = pc.add_rate(song_context1, 'rategiver')
+        resp1 = await pc.add_rate(song_context1, 'rategiver')
         self.assertEqual(
             f"@rategiver liked @requester1's song request!", resp1)
-        stats1 = db.get_user_stats('requester1')
+        stats1 = await db.get_user_stats('requester1')
         self.assertEqual(1, stats1['rates'])
-        stats2 = db.get_user_stats('rategiver')
+        stats2 = await db.get_user_stats('rategiver')
         self.assertEqual(1, stats2['rates given'])
-        resp2 = pc.add_rate(song_context1, 'rategiver')
+        resp2 = await pc.add_rate(song_context1, 'rategiver')
         self.assertIsNone(resp2)
-        resp3 = pc.add_rate(song_context1, 'requester1')
+        resp3 = await pc.add_rate(song_context1, 'requester1')
         self.assertEqual("Sorry, you can't rate your own requests LUL", resp3)
-        db.delete_user('requester1')
-        db.delete_user('rategiver')
+        await db.delete_user('requester1')
+        await db.delete_user('rategiver')
 
-    def test_ban_unban_user(self):
+    async def test_ban_unban_user(self):
         mc = ModCog(tb)
-        db.delete_user('tempmoduser')
-        db.delete_user('tempbanuser')
-        db.delete_user('tempuser')
-        db.delete_user('tempmoduser2')
-        db.init_user('tempmoduser', mod=1)
-        db.init_user('tempbanuser')
-        db.init_user('tempuser')
-        db.init_user('tempmoduser2', mod=1)
-        self.assertRaises(NotAuthorized, mc.ban, 'tempuser', 'tempbanuser')
-        self.assertTrue(mc.ban('tempmoduser', 'tempbanuser'))
-        self.assertTrue(db.is_user_banned('tempbanuser'))
-        self.assertRaises(NotAuthorized, mc.ban, 'tempmoduser', 'tempmoduser2')
-        self.assertRaises(NotAuthorized, mc.unban, 'tempuser', 'tempbanuser')
-        self.assertTrue(mc.unban('tempmoduser', 'tempbanuser'))
-        self.assertFalse(db.is_user_banned('tempbanuser'))
+        await db.delete_user('tempmoduser')
+        await db.delete_user('tempbanuser')
+        await db.delete_user('tempuser')
+        await db.delete_user('tempmoduser2')
+        await db.init_user('tempmoduser', mod=1)
+        await db.init_user('tempbanuser')
+        await db.init_user('tempuser')
+        await db.init_user('tempmoduser2', mod=1)
+        with self.assertRaises(NotAuthorized):
+            await mc.ban('tempuser', 'tempbanuser')
+        self.assertTrue(await mc.ban('tempmoduser', 'tempbanuser'))
+        self.assertTrue(await db.is_user_banned('tempbanuser'))
+        with self.assertRaises(NotAuthorized):
+            await mc.ban('tempmoduser', 'tempmoduser2')
+        # the permission check on its own doesn't ban anyone
+        self.assertTrue(await mc.can_ban('tempmoduser', 'tempuser'))
+        self.assertFalse(await db.is_user_banned('tempuser'))
+        with self.assertRaises(NotAuthorized):
+            await mc.can_ban('tempmoduser', 'tempmoduser2')
+        with self.assertRaises(NotAuthorized):
+            await mc.unban('tempuser', 'tempbanuser')
+        self.assertTrue(await mc.unban('tempmoduser', 'tempbanuser'))
+        self.assertFalse(await db.is_user_banned('tempbanuser'))
 
-    def test_leaderboard_reset(self):
-        db.delete_all()
+    async def test_leaderboard_reset(self):
+        await db.delete_all()
         tb.settings.set_leaderboard_reset('weekly')
-        db.init_user('previousWinner', mod=1, rates=1)
+        await db.init_user('previousWinner', mod=1, rates=1)
         now = int(time.time())
         week_ago = now - 604800
-        db.add_leaderboard_winner('previousWinner', week_ago, now-100, sp_mod_given=True)
-        db.init_user('leader', rates=10)
-        tb.check_reset_leaderboard()
-        resets = db.get_all_resets()
+        await db.add_leaderboard_winner('previousWinner', week_ago, now-100, sp_mod_given=True)
+        await db.init_user('leader', rates=10)
+        await tb.check_reset_leaderboard()
+        resets = await db.get_all_resets()
         self.assertEqual('previousWinner', resets[0][1])
         self.assertEqual(0, resets[0][5])
         self.assertEqual('leader', resets[1][1])
         self.assertEqual(1, resets[1][5])
         self.assertAlmostEqual(now + 604800, resets[1][3], delta=20)
-        self.assertTrue(db.is_user_mod('leader'))
-        self.assertFalse(db.is_user_mod('previousWinner'))
-        db.delete_all()
-        db.init_user('leader', rates=10)
-        db.init_user('previousWinner', mod=1, rates=1)
-        db.add_leaderboard_winner('previousWinner', week_ago, now-100, sp_mod_given=True)
+        self.assertTrue(await db.is_user_mod('leader'))
+        self.assertFalse(await db.is_user_mod('previousWinner'))
+        await db.delete_all()
+        await db.init_user('leader', rates=10)
+        await db.init_user('previousWinner', mod=1, rates=1)
+        await db.add_leaderboard_winner('previousWinner', week_ago, now-100, sp_mod_given=True)
         tb.settings.set_leaderboard_reset('off')
-        tb.check_reset_leaderboard()
-        resets = db.get_all_resets()
+        await tb.check_reset_leaderboard()
+        resets = await db.get_all_resets()
         self.assertEqual(1, len(resets))
         self.assertEqual('previousWinner', resets[0][1])
         self.assertEqual(1, resets[0][5])
-        self.assertTrue(db.is_user_mod('previousWinner'))
-        self.assertFalse(db.is_user_mod('leader'))
+        self.assertTrue(await db.is_user_mod('previousWinner'))
+        self.assertFalse(await db.is_user_mod('leader'))
 
-    def tearDown(self) -> None:
-        db.delete_all()
+    async def asyncTearDown(self) -> None:
+        await db.delete_all()
 
 if __name__ == '__main__':
     unittest.main(verbosity=1)